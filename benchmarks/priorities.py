@@ -0,0 +1,136 @@
+"""
+Benchmark: login latency while a bulk import is running.
+
+This simulates a Stormpath backend which can serve a fixed number of calls at
+once (any more queue up on its side), and measures the latency of interactive
+logins in three scenarios:
+
+- No bulk import (the baseline).
+- A bulk import, where every call has the same priority.
+- A bulk import, made within `stormpath_priority('bulk')`.
+
+Calls go through an :class:`~flask_stormpath.concurrency.AdaptiveLimiter`,
+just like they do when STORMPATH_CONCURRENCY_LIMIT_ENABLED is set.  The limit
+is pinned to the backend's capacity, so the results only reflect scheduling.
+
+Usage::
+
+    $ python benchmarks/priorities.py
+"""
+
+
+from __future__ import print_function
+
+from os.path import abspath, dirname
+from sys import path
+from threading import BoundedSemaphore, Event, Thread
+from time import sleep, time
+
+path.insert(0, dirname(dirname(abspath(__file__))))
+
+from flask_stormpath.concurrency import PRIORITY_BULK, PRIORITY_INTERACTIVE, AdaptiveLimiter
+
+
+# How many calls the simulated backend serves at once, and how long each takes.
+BACKEND_CAPACITY = 8
+SERVICE_TIME = 0.01
+
+LOGIN_THREADS = 4
+LOGIN_THINK_TIME = 0.02
+BULK_THREADS = 32
+DURATION = 5
+
+
+class Backend(object):
+    """A simulated Stormpath backend, with a fixed capacity."""
+
+    def __init__(self, capacity, service_time):
+        self.slots = BoundedSemaphore(capacity)
+        self.service_time = service_time
+
+    def call(self):
+        with self.slots:
+            sleep(self.service_time)
+
+
+def run(bulk_priority=None):
+    """
+    Run a scenario, and return the latencies (in seconds) of every login.
+
+    :param str bulk_priority: The priority of bulk import calls, or None to
+        skip the bulk import.
+    """
+    backend = Backend(BACKEND_CAPACITY, SERVICE_TIME)
+    limiter = AdaptiveLimiter(
+        initial_limit = BACKEND_CAPACITY,
+        min_limit = BACKEND_CAPACITY,
+        max_limit = BACKEND_CAPACITY,
+        queue_size = LOGIN_THREADS + BULK_THREADS,
+        queue_timeout = DURATION,
+    )
+
+    stop = Event()
+    latencies = []
+
+    def call(priority):
+        start = time()
+        limiter.acquire(priority=priority)
+        try:
+            backend.call()
+        finally:
+            limiter.release(time() - start, priority=priority)
+
+        return time() - start
+
+    def login():
+        while not stop.is_set():
+            latencies.append(call(PRIORITY_INTERACTIVE))
+            sleep(LOGIN_THINK_TIME)
+
+    def bulk_import():
+        while not stop.is_set():
+            call(bulk_priority)
+
+    threads = [Thread(target=login) for i in range(LOGIN_THREADS)]
+    if bulk_priority is not None:
+        threads += [Thread(target=bulk_import) for i in range(BULK_THREADS)]
+
+    for thread in threads:
+        thread.start()
+
+    sleep(DURATION)
+    stop.set()
+
+    for thread in threads:
+        thread.join()
+
+    return latencies
+
+
+def percentile(values, quantile):
+    """Return the given quantile (0 - 1) of a list of values."""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(quantile * len(values)))]
+
+
+def main():
+    scenarios = [
+        ('no bulk import', None),
+        ('bulk import, same priority', PRIORITY_INTERACTIVE),
+        ('bulk import, bulk priority', PRIORITY_BULK),
+    ]
+
+    print('%-30s %8s %10s %10s' % ('scenario', 'logins', 'p50 (ms)', 'p99 (ms)'))
+
+    for name, bulk_priority in scenarios:
+        latencies = run(bulk_priority)
+        print('%-30s %8d %10.1f %10.1f' % (
+            name,
+            len(latencies),
+            percentile(latencies, 0.5) * 1000,
+            percentile(latencies, 0.99) * 1000,
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -22,11 +22,15 @@ __license__ = 'Apache'
 __copyright__ = '(c) 2012 - 2015 Stormpath, Inc.'
 
 
+from os import getpid
+from threading import Lock
+
 from flask import (
     Blueprint,
     __version__ as flask_version,
     _app_ctx_stack as stack,
     current_app,
+    has_request_context,
 )
 
 from flask.ext.login import (
@@ -43,10 +47,40 @@ from stormpath.error import Error as StormpathError
 
 from werkzeug.local import LocalProxy
 
+from .cache import (
+    RefreshPool,
+    SharedUserCache,
+    UserCache,
+    delete_cached_href,
+    load_cached_href,
+    store_cached_href,
+)
+from .concurrency import PRIORITY_REFRESH, AdaptiveLimiter, SingleFlight
 from .context_processors import user_context_processor
-from .decorators import groups_required
-from .models import User
+from .deadlines import start_request_deadline
+from .decorators import groups_required, request_deadline, shed_load, token_required
+from .errors import RateLimitExceededError, StormpathUnavailableError
+from .groups import GroupCatalog
+from .models import User, get_user_expansion, user_deleted, user_updated
+from .passwords import PasswordPolicy
+from .ratelimit import RateLimiter
+from .resilience import (
+    Bulkhead,
+    CircuitBreaker,
+    Hedger,
+    LoadShedder,
+    RetryPolicy,
+    is_failure,
+    read_stormpath,
+    stormpath_priority,
+)
 from .settings import check_settings, init_settings
+from .snapshots import (
+    invalidate_user_snapshot,
+    load_user_snapshot,
+    save_user_snapshot,
+)
+from .transport import configure_client, get_session
 from .views import (
     google_login,
     facebook_login,
@@ -54,7 +88,10 @@ from .views import (
     forgot_change,
     login,
     logout,
+    rate_limited,
     register,
+    token,
+    unavailable,
 )
 
 
@@ -77,6 +114,16 @@ class StormpathManager(object):
         """
         self.app = app
 
+        # Concurrent lookups of the same Stormpath resource (from different
+        # threads) share a single API call.
+        self.single_flight = SingleFlight()
+
+        # These locks guard the lazy creation of our Stormpath Client and
+        # Application (and the rebuilding of an app's state after a fork), and
+        # are recreated after a fork (see `check_fork`).
+        self._pid = getpid()
+        self._locks = {'client': Lock(), 'application': Lock(), 'state': Lock()}
+
         # If the user specifies an app, let's configure go ahead and handle all
         # configuration stuff for the user's app.
         if app is not None:
@@ -106,6 +153,26 @@ class StormpathManager(object):
         # Initialize the Flask-Login extension.
         self.init_login(app)
 
+        # Initialize our caches, Group catalog, password policy, resilience
+        # helpers, and rate limiters.
+        self.init_state(app)
+
+        # If we've been forked since, the first request a worker handles
+        # rebuilds all of that state (see `check_fork`).
+        app.before_request(self.check_fork)
+
+        # Render rejected Stormpath calls as 503s, and rate limited requests
+        # as 429s.
+        app.register_error_handler(StormpathUnavailableError, unavailable)
+        app.register_error_handler(RateLimitExceededError, rate_limited)
+
+        # Give every request a deadline for its Stormpath calls (if enabled).
+        app.before_request(start_request_deadline)
+
+        # Ensure session snapshots don't outlive changes to a user's account.
+        user_updated.connect(invalidate_user_snapshot)
+        user_deleted.connect(invalidate_user_snapshot)
+
         # Initialize all URL routes / views.
         self.init_routes(app)
 
@@ -122,6 +189,11 @@ class StormpathManager(object):
         # necessary!
         self.app = app
 
+        # If requested, resolve our Stormpath Application right away (instead
+        # of on the first request).
+        if app.config['STORMPATH_RESOLVE_APPLICATION_ON_INIT']:
+            self.warm_up(app)
+
     def init_login(self, app):
         """
         Initialize the Flask-Login extension.
@@ -144,6 +216,282 @@ class StormpathManager(object):
         # Make this Flask session expire automatically.
         app.config['PERMANENT_SESSION_LIFETIME'] = app.config['STORMPATH_COOKIE_DURATION']
 
+    def init_state(self, app):
+        """
+        Initialize the application's process-local state: our caches, Group
+        catalog, password policy, resilience helpers, and rate limiters.
+
+        This is called again in every forked worker (see `check_fork`).
+
+        :param obj app: The Flask app.
+        """
+        app.stormpath_pid = getpid()
+
+        # Initialize our local user caches (if enabled).
+        self.init_cache(app)
+        self.init_shared_cache(app)
+        self.init_negative_cache(app)
+        self.init_degraded_cache(app)
+
+        # Initialize the application's Group catalog.
+        self.init_group_catalog(app)
+
+        # Initialize the application's password policy (if enabled).
+        self.init_password_policy(app)
+
+        # Protect our Stormpath calls with a circuit breaker and bulkhead (if
+        # enabled).
+        self.init_resilience(app)
+
+        # Rate limit login and password reset attempts (if enabled).
+        self.init_rate_limits(app)
+
+    def init_cache(self, app):
+        """
+        Initialize the local user cache.
+
+        If enabled, this cache sits in front of :meth:`load_user` so that we
+        don't need to hit Stormpath on every authenticated request.  Cached
+        users are automatically evicted when they're updated or deleted.
+
+        :param obj app: The Flask app.
+        """
+        app.stormpath_user_cache = None
+        app.stormpath_refresh_pool = None
+
+        if not app.config['STORMPATH_USER_CACHE_ENABLED']:
+            return
+
+        hard_ttl = app.config['STORMPATH_USER_CACHE_HARD_TTL']
+
+        app.stormpath_user_cache = UserCache(
+            max_size = app.config['STORMPATH_USER_CACHE_MAX_SIZE'],
+            ttl = app.config['STORMPATH_USER_CACHE_TTL'].total_seconds(),
+            hard_ttl = hard_ttl.total_seconds() if hard_ttl else None,
+        )
+
+        # If stale users may be served, we'll refresh them in the background.
+        if hard_ttl:
+            app.stormpath_refresh_pool = RefreshPool(
+                size = app.config['STORMPATH_USER_CACHE_REFRESH_THREADS'],
+                max_queue = app.config['STORMPATH_USER_CACHE_REFRESH_QUEUE_SIZE'],
+            )
+
+        user_updated.connect(app.stormpath_user_cache.invalidate)
+        user_deleted.connect(app.stormpath_user_cache.invalidate)
+
+    def init_shared_cache(self, app):
+        """
+        Initialize the shared user cache tier.
+
+        If a store is configured (via `STORMPATH_USER_CACHE_STORE`), users are
+        cached there in a compact binary format, so they can be shared by every
+        worker process (and every server) using the same store.
+
+        :param obj app: The Flask app.
+        """
+        app.stormpath_shared_user_cache = None
+
+        store = app.config['STORMPATH_USER_CACHE_STORE']
+        if store is None:
+            return
+
+        app.stormpath_shared_user_cache = SharedUserCache(
+            store,
+            ttl = app.config['STORMPATH_USER_CACHE_TTL'].total_seconds(),
+        )
+
+        user_updated.connect(app.stormpath_shared_user_cache.invalidate)
+        user_deleted.connect(app.stormpath_shared_user_cache.invalidate)
+
+    def init_negative_cache(self, app):
+        """
+        Initialize the negative user cache.
+
+        If enabled, this cache remembers accounts which couldn't be loaded
+        (because they were deleted, disabled, or never existed), so that stale
+        sessions and remember-me cookies don't cost a Stormpath API call on
+        every request.
+
+        :param obj app: The Flask app.
+        """
+        app.stormpath_negative_user_cache = None
+
+        if not app.config['STORMPATH_USER_NEGATIVE_CACHE_ENABLED']:
+            return
+
+        app.stormpath_negative_user_cache = UserCache(
+            max_size = app.config['STORMPATH_USER_NEGATIVE_CACHE_MAX_SIZE'],
+            ttl = app.config['STORMPATH_USER_NEGATIVE_CACHE_TTL'].total_seconds(),
+        )
+
+        # Re-enabling a disabled account (through this app) makes it loadable
+        # again right away.
+        user_updated.connect(app.stormpath_negative_user_cache.invalidate)
+
+    def init_degraded_cache(self, app):
+        """
+        Initialize the last known good user cache, used in degraded mode.
+
+        If enabled, a snapshot of every user fetched from Stormpath is kept
+        for up to `STORMPATH_DEGRADED_MAX_STALENESS`.  When Stormpath is
+        unreachable (network errors, server errors, or an open circuit
+        breaker), already-authenticated users are served from these snapshots
+        instead of being logged out.
+
+        :param obj app: The Flask app.
+        """
+        app.stormpath_degraded_user_cache = None
+
+        if not app.config['STORMPATH_DEGRADED_MODE_ENABLED']:
+            return
+
+        app.stormpath_degraded_user_cache = UserCache(
+            max_size = app.config['STORMPATH_DEGRADED_CACHE_MAX_SIZE'],
+            ttl = app.config['STORMPATH_DEGRADED_MAX_STALENESS'].total_seconds(),
+        )
+
+        user_updated.connect(app.stormpath_degraded_user_cache.invalidate)
+        user_deleted.connect(app.stormpath_degraded_user_cache.invalidate)
+
+    def init_group_catalog(self, app):
+        """
+        Initialize the application's Group catalog.
+
+        The catalog maps Group names to hrefs (and back), so that Group names
+        used for authorization can be resolved locally.  It is loaded lazily,
+        and reloaded after `STORMPATH_GROUP_CATALOG_TTL`.
+
+        :param obj app: The Flask app.
+        """
+        app.stormpath_group_catalog = GroupCatalog(
+            ttl = app.config['STORMPATH_GROUP_CATALOG_TTL'].total_seconds(),
+        )
+
+    def init_password_policy(self, app):
+        """
+        Initialize the application's password policy.
+
+        If `STORMPATH_PASSWORD_POLICY_ENABLED` is set, the password strength
+        policy of the application's default Directory is loaded lazily (and
+        reloaded after `STORMPATH_PASSWORD_POLICY_TTL`), so that weak
+        passwords can be rejected without a Stormpath API call.
+
+        :param obj app: The Flask app.
+        """
+        app.stormpath_password_policy = None
+
+        if app.config['STORMPATH_PASSWORD_POLICY_ENABLED']:
+            app.stormpath_password_policy = PasswordPolicy(
+                ttl = app.config['STORMPATH_PASSWORD_POLICY_TTL'].total_seconds(),
+            )
+
+    def init_resilience(self, app):
+        """
+        Initialize the application's circuit breaker, bulkhead, concurrency
+        limiter, load shedder, retry policy, and hedger.
+
+        If `STORMPATH_CIRCUIT_BREAKER_ENABLED` is set, Stormpath calls are
+        rejected immediately once too many of them fail (or are too slow).  If
+        `STORMPATH_BULKHEAD_LIMITS` is set, concurrent calls of each operation
+        type are capped.  Rejected calls raise a `StormpathUnavailableError`,
+        which is rendered as a `503 Service Unavailable` response.
+
+        If `STORMPATH_CONCURRENCY_LIMIT_ENABLED` is set, the number of
+        concurrent Stormpath calls (of every type) is capped by an adaptive
+        limit, which follows Stormpath's observed latency.
+
+        If `STORMPATH_LOAD_SHEDDING_ENABLED` is set, authentication POSTs are
+        rejected up front once too many are in flight.
+
+        If `STORMPATH_RETRY_ENABLED` is set, idempotent reads are retried after
+        transient failures.  If `STORMPATH_HEDGING_ENABLED` is set, slow
+        idempotent reads are hedged.
+
+        :param obj app: The Flask app.
+        """
+        app.stormpath_circuit_breaker = None
+        app.stormpath_bulkhead = None
+        app.stormpath_retry_policy = None
+        app.stormpath_hedger = None
+        app.stormpath_concurrency_limiter = None
+        app.stormpath_load_shedder = None
+
+        if app.config['STORMPATH_CIRCUIT_BREAKER_ENABLED']:
+            slow_call_duration = app.config['STORMPATH_CIRCUIT_BREAKER_SLOW_CALL_DURATION']
+
+            app.stormpath_circuit_breaker = CircuitBreaker(
+                failure_rate = app.config['STORMPATH_CIRCUIT_BREAKER_FAILURE_RATE'],
+                slow_call_duration = slow_call_duration.total_seconds() if slow_call_duration is not None else None,
+                min_calls = app.config['STORMPATH_CIRCUIT_BREAKER_MIN_CALLS'],
+                window = app.config['STORMPATH_CIRCUIT_BREAKER_WINDOW'],
+                reset_timeout = app.config['STORMPATH_CIRCUIT_BREAKER_RESET_TIMEOUT'].total_seconds(),
+                half_open_calls = app.config['STORMPATH_CIRCUIT_BREAKER_HALF_OPEN_CALLS'],
+            )
+
+        if app.config['STORMPATH_BULKHEAD_LIMITS']:
+            app.stormpath_bulkhead = Bulkhead(app.config['STORMPATH_BULKHEAD_LIMITS'])
+
+        if app.config['STORMPATH_CONCURRENCY_LIMIT_ENABLED']:
+            app.stormpath_concurrency_limiter = AdaptiveLimiter(
+                initial_limit = app.config['STORMPATH_CONCURRENCY_LIMIT_INITIAL'],
+                min_limit = app.config['STORMPATH_CONCURRENCY_LIMIT_MIN'],
+                max_limit = app.config['STORMPATH_CONCURRENCY_LIMIT_MAX'],
+                latency_tolerance = app.config['STORMPATH_CONCURRENCY_LIMIT_LATENCY_TOLERANCE'],
+                backoff = app.config['STORMPATH_CONCURRENCY_LIMIT_BACKOFF'],
+                queue_size = app.config['STORMPATH_CONCURRENCY_LIMIT_QUEUE_SIZE'],
+                queue_timeout = app.config['STORMPATH_CONCURRENCY_LIMIT_QUEUE_TIMEOUT'].total_seconds(),
+                weights = app.config['STORMPATH_PRIORITY_WEIGHTS'],
+                shares = app.config['STORMPATH_PRIORITY_SHARES'],
+            )
+
+        if app.config['STORMPATH_LOAD_SHEDDING_ENABLED']:
+            app.stormpath_load_shedder = LoadShedder(
+                max_in_flight = app.config['STORMPATH_LOAD_SHEDDING_MAX_IN_FLIGHT'],
+                max_queued = app.config['STORMPATH_LOAD_SHEDDING_MAX_QUEUED'],
+                retry_after = app.config['STORMPATH_LOAD_SHEDDING_RETRY_AFTER'].total_seconds(),
+                limiter = app.stormpath_concurrency_limiter,
+            )
+
+        if app.config['STORMPATH_RETRY_ENABLED']:
+            app.stormpath_retry_policy = RetryPolicy(
+                max_attempts = app.config['STORMPATH_RETRY_MAX_ATTEMPTS'],
+                base_delay = app.config['STORMPATH_RETRY_BASE_DELAY'].total_seconds(),
+                max_delay = app.config['STORMPATH_RETRY_MAX_DELAY'].total_seconds(),
+                budget = app.config['STORMPATH_RETRY_BUDGET'].total_seconds(),
+            )
+
+        if app.config['STORMPATH_HEDGING_ENABLED']:
+            app.stormpath_hedger = Hedger(
+                quantile = app.config['STORMPATH_HEDGING_QUANTILE'],
+                min_samples = app.config['STORMPATH_HEDGING_MIN_SAMPLES'],
+            )
+
+    def init_rate_limits(self, app):
+        """
+        Initialize the application's rate limiters.
+
+        If `STORMPATH_RATE_LIMIT_BY_IP` or `STORMPATH_RATE_LIMIT_BY_LOGIN` is
+        set, login, access token, and forgot password attempts over the limit
+        are rejected with a `429 Too Many Requests` response, before Stormpath
+        is called.
+
+        :param obj app: The Flask app.
+        """
+        app.stormpath_ip_rate_limiter = None
+        app.stormpath_login_rate_limiter = None
+
+        store = app.config['STORMPATH_RATE_LIMIT_STORE']
+        max_keys = app.config['STORMPATH_RATE_LIMIT_MAX_KEYS']
+
+        if app.config['STORMPATH_RATE_LIMIT_BY_IP']:
+            rate, period = app.config['STORMPATH_RATE_LIMIT_BY_IP']
+            app.stormpath_ip_rate_limiter = RateLimiter(rate, period.total_seconds(), store=store, max_keys=max_keys, prefix='ratelimit:ip:')
+
+        if app.config['STORMPATH_RATE_LIMIT_BY_LOGIN']:
+            rate, period = app.config['STORMPATH_RATE_LIMIT_BY_LOGIN']
+            app.stormpath_login_rate_limiter = RateLimiter(rate, period.total_seconds(), store=store, max_keys=max_keys, prefix='ratelimit:login:')
+
     def init_routes(self, app):
         """
         Initialize our built-in routes.
@@ -171,6 +519,14 @@ class StormpathManager(object):
                 methods = ['GET', 'POST'],
             )
 
+        if app.config['STORMPATH_ENABLE_ACCESS_TOKENS']:
+            app.add_url_rule(
+                app.config['STORMPATH_ACCESS_TOKEN_URL'],
+                'stormpath.token',
+                token,
+                methods = ['POST'],
+            )
+
         if app.config['STORMPATH_ENABLE_FORGOT_PASSWORD']:
             app.add_url_rule(
                 app.config['STORMPATH_FORGOT_PASSWORD_URL'],
@@ -206,41 +562,137 @@ class StormpathManager(object):
                 facebook_login,
             )
 
+    def check_fork(self, app=None):
+        """
+        Reset this extension's process-wide state if we've been forked.
+
+        Pre-forking servers (like gunicorn with `--preload`) create the Flask
+        app in a parent process, then fork workers.  Locks held by other
+        threads at fork time would never be released in the worker, background
+        threads (like the refresh pool's) don't survive the fork, and the
+        parent's HTTP connections must never be shared with it.  So a worker
+        gets fresh locks, a fresh copy of the app's state (see `init_state`:
+        its caches, resilience helpers, and rate limiters), and (see
+        `get_lazy`) fresh Stormpath Client and Application objects.
+
+        This is called before every request, and whenever the Client or
+        Application is used.
+
+        :param obj app: (optional) The Flask app (the current app by default).
+        """
+        pid = getpid()
+        if self._pid != pid:
+            self.single_flight = SingleFlight()
+            self._locks = {'client': Lock(), 'application': Lock(), 'state': Lock()}
+            self._pid = pid
+
+        if app is None:
+            app = stack.top.app if stack.top is not None else None
+
+        if app is not None and getattr(app, 'stormpath_pid', pid) != pid:
+            with self._locks['state']:
+                if app.stormpath_pid != pid:
+                    self.init_state(app)
+
+    def get_lazy(self, name, factory):
+        """
+        Return the lazily created `stormpath_<name>` attribute of the current
+        Flask app, creating it with `factory` if needed.
+
+        Creation is lock-protected, so no matter how many threads ask for it at
+        once, `factory` is only called once per process.  Anything created in
+        another process (before a fork) is discarded and recreated.
+
+        :param str name: The attribute name (either 'client' or 'application').
+        :param func factory: The function which creates the attribute value.
+        """
+        ctx = stack.top.app
+        if ctx is None:
+            return None
+
+        self.check_fork(ctx)
+
+        attr = 'stormpath_' + name
+        pid_attr = attr + '_pid'
+
+        value = getattr(ctx, attr, None)
+        if value is not None and getattr(ctx, pid_attr, None) == self._pid:
+            return value
+
+        with self._locks[name]:
+            value = getattr(ctx, attr, None)
+            if value is None or getattr(ctx, pid_attr, None) != self._pid:
+
+                # Users cached before a fork hold references to the parent's
+                # Client (and its connections), so they're discarded too.
+                if value is not None and getattr(ctx, 'stormpath_user_cache', None) is not None:
+                    ctx.stormpath_user_cache.clear()
+
+                value = factory()
+                setattr(ctx, attr, value)
+                setattr(ctx, pid_attr, self._pid)
+
+        return value
+
     @property
     def client(self):
         """
         Lazily load the Stormpath Client object we need to access the raw
         Stormpath SDK.
         """
-        ctx = stack.top.app
-        if ctx is not None:
-            if not hasattr(ctx, 'stormpath_client'):
-
-                # Create our custom user agent.  This allows us to see which
-                # version of this SDK are out in the wild!
-                user_agent = 'stormpath-flask/%s flask/%s' % (__version__, flask_version)
-
-                # If the user is specifying their credentials via a file path,
-                # we'll use this.
-                if self.app.config['STORMPATH_API_KEY_FILE']:
-                    ctx.stormpath_client = Client(
-                        api_key_file_location = self.app.config['STORMPATH_API_KEY_FILE'],
-                        user_agent = user_agent,
-                        cache_options = self.app.config['STORMPATH_CACHE'],
-                    )
-
-                # If the user isn't specifying their credentials via a file
-                # path, it means they're using environment variables, so we'll
-                # try to grab those values.
-                else:
-                    ctx.stormpath_client = Client(
-                        id = self.app.config['STORMPATH_API_KEY_ID'],
-                        secret = self.app.config['STORMPATH_API_KEY_SECRET'],
-                        user_agent = user_agent,
-                        cache_options = self.app.config['STORMPATH_CACHE'],
-                    )
+        return self.get_lazy('client', self.create_client)
+
+    def create_client(self):
+        """Create a new Stormpath Client object."""
+
+        # Create our custom user agent.  This allows us to see which version of
+        # this SDK are out in the wild!
+        user_agent = 'stormpath-flask/%s flask/%s' % (__version__, flask_version)
+
+        # If the user is specifying their credentials via a file path, we'll use
+        # this.
+        if self.app.config['STORMPATH_API_KEY_FILE']:
+            client = Client(
+                api_key_file_location = self.app.config['STORMPATH_API_KEY_FILE'],
+                user_agent = user_agent,
+                cache_options = self.app.config['STORMPATH_CACHE'],
+            )
+
+        # If the user isn't specifying their credentials via a file path, it
+        # means they're using environment variables, so we'll try to grab those
+        # values.
+        else:
+            client = Client(
+                id = self.app.config['STORMPATH_API_KEY_ID'],
+                secret = self.app.config['STORMPATH_API_KEY_SECRET'],
+                user_agent = user_agent,
+                cache_options = self.app.config['STORMPATH_CACHE'],
+            )
+
+        # Pool (and keep alive) our connections to Stormpath.
+        configure_client(client, self.app.config)
+
+        return client
+
+    @property
+    def http_stats(self):
+        """
+        Return statistics about our pool of HTTP connections to Stormpath (see
+        :class:`flask_stormpath.transport.PooledHTTPAdapter`).
+        """
+        return get_session(self.client).adapters['https://'].stats
 
-            return ctx.stormpath_client
+    @property
+    def concurrency_stats(self):
+        """
+        Return statistics about our adaptive concurrency limiter (see
+        :class:`flask_stormpath.concurrency.AdaptiveLimiter`): the current
+        limit, and how many calls were accepted, queued, or rejected.
+
+        This is None unless `STORMPATH_CONCURRENCY_LIMIT_ENABLED` is set.
+        """
+        limiter = current_app.stormpath_concurrency_limiter
+        return limiter.stats if limiter is not None else None
 
     @property
     def login_view(self):
@@ -263,14 +715,69 @@ class StormpathManager(object):
         Lazily load the Stormpath Application object we need to handle user
         authentication, etc.
         """
-        ctx = stack.top.app
-        if ctx is not None:
-            if not hasattr(ctx, 'stormpath_application'):
-                ctx.stormpath_application = self.client.applications.search(
-                    self.app.config['STORMPATH_APPLICATION']
-                )[0]
+        return self.get_lazy('application', self.load_application)
 
-            return ctx.stormpath_application
+    def load_application(self):
+        """
+        Load the Stormpath Application object from Stormpath.
+
+        If `STORMPATH_APPLICATION` is an Application href, we'll use it
+        directly.  Otherwise, we'll search for the Application by name -- unless
+        its href was already persisted to `STORMPATH_APPLICATION_HREF_FILE` (by
+        an earlier search in this, or another, process).
+
+        Persisted hrefs are keyed by API key ID and Application name, and are
+        dropped (and searched for again) if the Application no longer exists.
+        """
+        application = self.app.config['STORMPATH_APPLICATION']
+        href_file = self.app.config['STORMPATH_APPLICATION_HREF_FILE']
+
+        if application.startswith(('http://', 'https://')):
+            return self.client.applications.get(application)
+
+        key = '%s:%s' % (self.client.auth.id, application)
+
+        href = load_cached_href(href_file, key) if href_file else None
+        if href is not None:
+            try:
+                return read_stormpath('application', self._fetch_application, href)
+            except StormpathError as err:
+                if err.status != 404:
+                    raise
+
+                delete_cached_href(href_file, key)
+
+        application = read_stormpath('application', lambda name: self.client.applications.search(name)[0], application)
+
+        if href_file:
+            store_cached_href(href_file, key, application.href)
+
+        return application
+
+    def _fetch_application(self, href):
+        """Fetch the Application with the given href (not lazily)."""
+        application = self.client.applications.get(href)
+        application._ensure_data()
+
+        return application
+
+    def warm_up(self, app=None):
+        """
+        Eagerly create the Stormpath Client and fetch the Stormpath
+        Application, so the first request doesn't have to.
+
+        This is useful in a pre-forking server: calling this from gunicorn's
+        `post_fork` hook, for instance, ensures each worker is ready before it
+        takes any traffic::
+
+            def post_fork(server, worker):
+                app.stormpath_manager.warm_up()
+
+        :param obj app: (optional) The Flask app.  Defaults to the app this
+            extension was initialized with.
+        """
+        with (app or self.app).app_context():
+            self.application.name
 
     @staticmethod
     def load_user(account_href):
@@ -278,14 +785,224 @@ class StormpathManager(object):
         Given an Account href (a valid Stormpath Account URL), return the
         associated User account object (or None).
 
+        If the local user cache is enabled, we'll try to serve the User from
+        the cache before asking Stormpath.  Stale users (older than
+        `STORMPATH_USER_CACHE_TTL`, but not `STORMPATH_USER_CACHE_HARD_TTL`) are
+        served immediately, and refreshed in the background.
+
+        If `STORMPATH_LAZY_USER` is enabled, the returned User is built from
+        the href alone, and the account is only fetched from Stormpath the
+        first time a real field (`email`, `status`, etc.) is read, or the user
+        is checked with `is_authenticated` (by `login_required`, for instance).
+        Deleted or disabled accounts are then logged out.
+
+        If `STORMPATH_ENABLE_SESSION_SNAPSHOT` is enabled, we'll rebuild a
+        read-only User from the signed snapshot stored in the session, and only
+        ask Stormpath once the snapshot is too old.
+
+        If a shared user cache store is configured, we'll then look there.
+        Users served from the shared cache are built from their snapshot, but
+        (unlike users restored from a session snapshot) they can be saved.
+
+        If the negative user cache is enabled, accounts which recently failed
+        to load are answered locally (with None).
+
+        If Stormpath is unreachable, and degraded mode is enabled, we'll serve
+        the last known good copy of the user (see `load_degraded_user`).
+
         :returns: The User object or None.
         """
-        user = current_app.stormpath_manager.client.accounts.get(account_href)
+        negative_cache = current_app.stormpath_negative_user_cache
+        if negative_cache is not None and negative_cache.get(account_href):
+            return None
+
+        snapshots = current_app.config['STORMPATH_ENABLE_SESSION_SNAPSHOT'] and has_request_context()
+        if snapshots:
+            user = load_user_snapshot(account_href)
+            if user is not None:
+                return user
+
+        cache = current_app.stormpath_user_cache
+        if cache is not None:
+            user, stale = cache.lookup(account_href)
+            if user is not None:
+                if stale:
+                    current_app.stormpath_manager.refresh_user(account_href)
+
+                return user
 
+        generation = cache.generation(account_href) if cache is not None else None
+
+        shared_cache = current_app.stormpath_shared_user_cache
+        if shared_cache is not None:
+            snapshot = shared_cache.get(account_href)
+            if snapshot is not None:
+                user = User.from_snapshot(snapshot, read_only=False)
+
+                if cache is not None:
+                    cache.set(account_href, user, generation=generation)
+
+                return user
+
+        lazy = current_app.config['STORMPATH_LAZY_USER']
+
+        # If Stormpath is unreachable, we'll fail fast, and serve the last
+        # known good copy of this user (in degraded mode), or treat this
+        # request as anonymous (rather than failing every page which looks at
+        # the current user).
         try:
+            user = StormpathManager.fetch_user(account_href, lazy=lazy)
+        except Exception as err:
+            if not (isinstance(err, StormpathUnavailableError) or is_failure(err)):
+                raise
+
+            return StormpathManager.load_degraded_user(account_href)
+
+        if user is None:
+            return None
+
+        if cache is not None:
+            cache.set(account_href, user, generation=generation)
+
+        # Snapshotting a user reads every field (and lists their Groups), which
+        # would defeat lazy loading -- so lazy users are never snapshotted.
+        degraded_cache = current_app.stormpath_degraded_user_cache
+        if lazy or (degraded_cache is None and shared_cache is None and not snapshots):
+            return user
+
+        # The snapshot is built once, and shared by every tier which keeps one.
+        # Snapshots are only an optimization, so if the user's Groups can't be
+        # listed, we'll just go without them.
+        try:
+            snapshot = user.to_snapshot()
+        except Exception:
+            return user
+
+        if degraded_cache is not None:
+            degraded_cache.set(account_href, snapshot)
+
+        if shared_cache is not None:
+            shared_cache.set(account_href, snapshot)
+
+        if snapshots:
+            save_user_snapshot(user, snapshot)
+
+        return user
+
+    @staticmethod
+    def fetch_user(account_href, lazy=False):
+        """
+        Given an Account href, fetch the associated User account object from
+        Stormpath (or return None), bypassing all local caches.
+
+        Concurrent fetches of the same account (from different threads) share
+        a single Stormpath API call.
+
+        Disabled accounts are never returned.  If the negative user cache is
+        enabled, accounts which don't exist (or are disabled) are remembered
+        there.
+
+        :param str account_href: The Account href.
+        :param bool lazy: (optional) If True, the account won't actually be
+            fetched until a field is read.
+        :returns: The User object or None.
+        :raises: The underlying error if Stormpath is unreachable (see
+            `flask_stormpath.resilience.is_failure`).
+        """
+        manager = current_app.stormpath_manager
+        expansion = get_user_expansion()
+
+        # Lazy users are checked (and remembered in the negative cache, if
+        # they're deleted or disabled) once they're first used -- see
+        # `User.is_authenticated`.
+        if lazy:
+            user = manager.client.accounts.get(account_href, expand=expansion)
+            user.__class__ = User
+            user._lazy = True
+
+            return user
+
+        def fetch():
+            user = manager.client.accounts.get(account_href, expand=expansion)
             user._ensure_data()
             user.__class__ = User
 
             return user
-        except StormpathError:
+
+        negative_cache = current_app.stormpath_negative_user_cache
+
+        try:
+            user = manager.single_flight.do(('account', account_href), read_stormpath, 'load_user', fetch)
+        except StormpathError as err:
+            if is_failure(err):
+                raise
+
+            if negative_cache is not None and err.status == 404:
+                negative_cache.set(account_href, True)
+
+            return None
+
+        if user.status == User.STATUS_DISABLED:
+            if negative_cache is not None:
+                negative_cache.set(account_href, True)
+
+            return None
+
+        return user
+
+    @staticmethod
+    def load_degraded_user(account_href):
+        """
+        Return the last known good copy of a User (or None), for use when
+        Stormpath is unreachable.
+
+        The returned User is read-only, and flagged as degraded (see
+        :meth:`User.is_degraded`).  This always returns None unless
+        `STORMPATH_DEGRADED_MODE_ENABLED` is set.
+
+        :param str account_href: The Account href.
+        """
+        degraded_cache = current_app.stormpath_degraded_user_cache
+        if degraded_cache is None:
             return None
+
+        snapshot = degraded_cache.get(account_href)
+        if snapshot is None:
+            return None
+
+        user = User.from_snapshot(snapshot)
+        user._degraded = True
+
+        return user
+
+    def refresh_user(self, account_href):
+        """
+        Refresh a cached user in the background.
+
+        This is a no-op unless stale-while-revalidate is enabled (by setting
+        `STORMPATH_USER_CACHE_HARD_TTL`).
+
+        :param str account_href: The Account href.
+        :rtype: bool
+        :returns: True if a refresh was scheduled, False otherwise.
+        """
+        pool = current_app.stormpath_refresh_pool
+        if pool is None:
+            return False
+
+        app = current_app._get_current_object()
+        cache = app.stormpath_user_cache
+
+        # If the user is updated (or deleted) while we're refreshing it, our
+        # copy is out of date, and mustn't be cached.
+        generation = cache.generation(account_href)
+
+        def refresh():
+            with app.app_context(), stormpath_priority(PRIORITY_REFRESH):
+                user = StormpathManager.fetch_user(account_href)
+                if user is None:
+                    cache.delete(account_href)
+                else:
+                    cache.set(account_href, user, generation=generation)
+
+        return pool.submit(account_href, refresh)
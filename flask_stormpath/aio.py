@@ -0,0 +1,122 @@
+"""
+Asyncio support for Flask-Stormpath (Python 3.5+ only).
+
+The Stormpath SDK is blocking, so every call here runs on a bounded pool of
+threads (sized by STORMPATH_ASYNC_MAX_WORKERS), and is awaited from the event
+loop.  This lets a single process keep many slow Stormpath calls in flight,
+without tying up the event loop (or a request worker) for the full Stormpath
+latency.
+
+These coroutines can be awaited from any asyncio code running inside a Flask
+app (or request) context.
+
+Usage::
+
+    from flask.ext.stormpath import aio
+
+    user = await aio.from_login('r@rdegges.com', 'woot1LoveCookies!')
+
+.. note::
+    This module isn't imported by `flask_stormpath` itself, since Python 2
+    doesn't support `async` / `await`.
+"""
+
+
+from concurrent.futures import ThreadPoolExecutor
+from os import getpid
+from threading import Lock
+
+try:
+    from asyncio import get_running_loop
+except ImportError:
+    # Python 3.5 and 3.6 don't have get_running_loop, but get_event_loop is
+    # equivalent when it's called from a coroutine.
+    from asyncio import get_event_loop as get_running_loop
+
+from flask import copy_current_request_context, current_app, has_request_context
+
+from .models import User
+
+
+_executor_lock = Lock()
+
+
+def get_executor(app):
+    """
+    Return the given Flask app's bounded thread pool, creating it if needed.
+
+    Like our Stormpath Client, the pool is recreated after a fork.
+
+    :param obj app: The Flask app.
+    """
+    executor = getattr(app, 'stormpath_executor', None)
+    if executor is not None and app.stormpath_executor_pid == getpid():
+        return executor
+
+    with _executor_lock:
+        executor = getattr(app, 'stormpath_executor', None)
+        if executor is None or app.stormpath_executor_pid != getpid():
+            executor = ThreadPoolExecutor(max_workers=app.config['STORMPATH_ASYNC_MAX_WORKERS'])
+            app.stormpath_executor = executor
+            app.stormpath_executor_pid = getpid()
+
+    return executor
+
+
+async def run(func, *args, **kwargs):
+    """
+    Run a blocking function on our thread pool, and await its result.
+
+    The function runs in a copy of the current request context (or the current
+    app context, outside of requests), so it can use `current_app`, `request`,
+    etc. as usual.  The copy has a session of its own, however, so changes the
+    function makes to the session (like logging a user in) are lost.
+
+    :param func func: The function to call.
+    :returns: Whatever `func` returns.
+    """
+    app = current_app._get_current_object()
+
+    if has_request_context():
+        call = copy_current_request_context(lambda: func(*args, **kwargs))
+    else:
+        def call():
+            with app.app_context():
+                return func(*args, **kwargs)
+
+    return await get_running_loop().run_in_executor(get_executor(app), call)
+
+
+async def create_user(*args, **kwargs):
+    """Create a new User (see :meth:`User.create`)."""
+    return await run(User.create, *args, **kwargs)
+
+
+async def from_login(login, password):
+    """Authenticate a User (see :meth:`User.from_login`)."""
+    return await run(User.from_login, login, password)
+
+
+async def from_google(code):
+    """Create or retrieve a Google User (see :meth:`User.from_google`)."""
+    return await run(User.from_google, code)
+
+
+async def from_facebook(access_token):
+    """Create or retrieve a Facebook User (see :meth:`User.from_facebook`)."""
+    return await run(User.from_facebook, access_token)
+
+
+async def save_user(user):
+    """Save a User's changes (see :meth:`User.save`)."""
+    return await run(user.save)
+
+
+async def delete_user(user):
+    """Delete a User (see :meth:`User.delete`)."""
+    return await run(user.delete)
+
+
+async def load_user(account_href):
+    """Load a User by account href (see :meth:`StormpathManager.load_user`)."""
+    return await run(current_app.stormpath_manager.load_user, account_href)
@@ -0,0 +1,724 @@
+"""Local caching helpers, used to avoid unnecessary Stormpath API calls."""
+
+
+from collections import OrderedDict
+from json import dump, load
+from os import path, remove
+from struct import error as struct_error, pack, unpack_from
+from tempfile import NamedTemporaryFile
+from threading import Lock, RLock, Thread
+from time import time
+
+from six import text_type
+from six.moves import queue
+
+from .errors import ConfigurationError
+
+try:
+    from os import replace
+except ImportError:
+    # Python 2 doesn't have replace, but rename does the same thing on POSIX.
+    from os import rename as replace
+
+try:
+    from fcntl import LOCK_EX, flock
+except ImportError:
+    # Windows doesn't have fcntl, so href file updates made by different
+    # processes at the same time may overwrite each other there.
+    flock = None
+
+
+class UserCache(object):
+    """
+    A size-bounded, thread-safe LRU cache with a per-entry TTL.
+
+    This is used to hold :class:`User` objects (keyed by their Stormpath
+    href) in front of :meth:`StormpathManager.load_user`, so that we don't
+    need to make a Stormpath API call on every authenticated request.
+
+    Every key has a generation, which changes whenever its entry is removed.
+    A fetch which started before a removal (a background refresh racing with
+    `user_updated`, for instance) passes the generation it saw to :meth:`set`,
+    so it can never re-insert the stale (or deleted) user.
+
+    Generations are remembered for up to `max_size` keys.  Forgetting one
+    would reset its key to the starting generation, so whenever that happens
+    the cache moves to a new epoch instead, which every fetch in flight (for
+    any key) then fails to match.
+    """
+    def __init__(self, max_size=1000, ttl=300, hard_ttl=None):
+        """
+        Initialize this cache.
+
+        :param int max_size: (optional) The maximum number of entries to keep
+            around.  Once this is exceeded, the least recently used entries
+            will be evicted.
+        :param int ttl: (optional) How long (in seconds) an entry is fresh for.
+        :param int hard_ttl: (optional) How long (in seconds) a stale entry may
+            still be served (while it is refreshed in the background).  If not
+            specified, entries are never served once they're stale.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hard_ttl = max(hard_ttl or ttl, ttl)
+        self._entries = OrderedDict()
+        self._generations = OrderedDict()
+        self._epoch = 0
+        self._lock = RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key):
+        """
+        Return the cached value for `key`, or None if there is no fresh entry.
+
+        :param str key: The cache key (a Stormpath href).
+        """
+        value, stale = self.lookup(key)
+        return None if stale else value
+
+    def lookup(self, key):
+        """
+        Return a `(value, stale)` tuple for `key`.
+
+        `value` is None if there is no entry, or if the entry is older than the
+        hard TTL.  `stale` is True if the entry is older than the (soft) TTL,
+        which means it should be refreshed.
+
+        :param str key: The cache key (a Stormpath href).
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None, False
+
+            value, stored_at = entry
+            age = time() - stored_at
+            if age >= self.hard_ttl:
+                return None, False
+
+            # Re-insert the entry so it is marked as the most recently used.
+            self._entries[key] = entry
+            return value, age >= self.ttl
+
+    def generation(self, key):
+        """
+        Return the current generation of `key`.
+
+        :param str key: The cache key (a Stormpath href).
+        """
+        with self._lock:
+            return self._epoch, self._generations.get(key, 0)
+
+    def set(self, key, value, generation=None):
+        """
+        Store `value` in the cache, evicting the least recently used entries if
+        the cache is full.
+
+        :param str key: The cache key (a Stormpath href).
+        :param obj value: The value to store.
+        :param tuple generation: (optional) The generation of `key` (see
+            :meth:`generation`) from before `value` was fetched.  If the entry
+            was removed since, `value` is out of date, and isn't stored.
+        :rtype: bool
+        :returns: True if `value` was stored, False otherwise.
+        """
+        with self._lock:
+            if generation is not None and generation != (self._epoch, self._generations.get(key, 0)):
+                return False
+
+            self._entries.pop(key, None)
+            self._entries[key] = (value, time())
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+            return True
+
+    def delete(self, key):
+        """
+        Remove the entry for `key` (if there is one), and move `key` to its
+        next generation.
+
+        :param str key: The cache key (a Stormpath href).
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+            generation = self._generations.pop(key, 0) + 1
+            self._generations[key] = generation
+
+            while len(self._generations) > self.max_size:
+                self._generations.popitem(last=False)
+                self._epoch += 1
+
+    def clear(self):
+        """Remove all entries from the cache (moving every key to its next generation)."""
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self._epoch += 1
+
+    def invalidate(self, sender, user=None):
+        """
+        A signal receiver which removes the given user from the cache.
+
+        This is connected to the `user_updated` and `user_deleted` signals so
+        cached users never outlive a local change to their account.
+        """
+        if user is not None:
+            self.delete(user.href)
+
+
+class RefreshPool(object):
+    """
+    A bounded pool of background threads used to refresh stale cache entries.
+
+    Refreshes are queued by key, so a key that is already waiting to be
+    refreshed is never queued twice.  If the queue is full, new refreshes are
+    dropped (the stale entry will simply be refreshed on a later request, or
+    fetched synchronously once it passes its hard TTL).
+    """
+    def __init__(self, size=2, max_queue=100):
+        """
+        Initialize this pool.
+
+        :param int size: (optional) The number of worker threads.
+        :param int max_queue: (optional) The maximum number of queued
+            refreshes.
+        """
+        self.size = size
+        self.max_queue = max_queue
+        self.refreshed = 0
+        self.failed = 0
+        self.dropped = 0
+        self._queue = queue.Queue(max_queue)
+        self._pending = set()
+        self._threads = []
+        self._lock = Lock()
+
+    @property
+    def stats(self):
+        """Return a dict of statistics about this pool."""
+        return {
+            'pool_size': self.size,
+            'queue_depth': self._queue.qsize(),
+            'pending': len(self._pending),
+            'refreshed': self.refreshed,
+            'failed': self.failed,
+            'dropped': self.dropped,
+        }
+
+    def submit(self, key, func):
+        """
+        Schedule `func` to be called in the background to refresh `key`.
+
+        :param str key: The cache key being refreshed.
+        :param func func: A callable (taking no arguments) which does the
+            refresh.
+        :rtype: bool
+        :returns: True if the refresh was scheduled, False otherwise.
+        """
+        with self._lock:
+            if key in self._pending:
+                return False
+
+            try:
+                self._queue.put_nowait((key, func))
+            except queue.Full:
+                self.dropped += 1
+                return False
+
+            self._pending.add(key)
+            self._start_workers()
+
+        return True
+
+    def _start_workers(self):
+        """
+        Ensure all of our worker threads are running.
+
+        Threads are started lazily (and restarted if they're gone), since
+        threads don't survive a fork.
+        """
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+
+        while len(self._threads) < self.size:
+            thread = Thread(target=self._work, name='flask-stormpath-refresh')
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        """Process queued refreshes forever."""
+        while True:
+            key, func = self._queue.get()
+
+            try:
+                func()
+                succeeded = True
+            except Exception:
+                succeeded = False
+
+            with self._lock:
+                self._pending.discard(key)
+
+                if succeeded:
+                    self.refreshed += 1
+                else:
+                    self.failed += 1
+
+            self._queue.task_done()
+
+
+# The version of our binary user encoding.  This must be bumped whenever the
+# format changes, so that old entries in a shared store are ignored.
+USER_ENCODING_VERSION = 2
+
+# The order in which user fields are encoded.
+USER_ENCODING_FIELDS = (
+    'href',
+    'email',
+    'username',
+    'given_name',
+    'middle_name',
+    'surname',
+    'status',
+    'modified_at',
+)
+
+# The length marker used to encode a missing (None) field.
+_NULL_LENGTH = 0xFFFFFFFF
+
+
+def _pack_string(value):
+    """Encode a string (or None) as a length-prefixed UTF-8 byte string."""
+    if value is None:
+        return pack('>I', _NULL_LENGTH)
+
+    data = text_type(value).encode('utf-8')
+    if len(data) >= _NULL_LENGTH:
+        raise ValueError('String too long to encode.')
+
+    return pack('>I', len(data)) + data
+
+
+def _unpack_string(data, offset):
+    """Decode a string encoded by `_pack_string`, returning (value, offset)."""
+    length, = unpack_from('>I', data, offset)
+    offset += 4
+
+    if length == _NULL_LENGTH:
+        return None, offset
+
+    if offset + length > len(data):
+        raise struct_error('Truncated string.')
+
+    return data[offset:offset + length].decode('utf-8'), offset + length
+
+
+def encode_user(snapshot):
+    """
+    Encode a user snapshot (see :meth:`User.to_snapshot`) in our compact,
+    versioned binary format.
+
+    :param dict snapshot: The user snapshot.
+    :rtype: bytes
+    """
+    groups = snapshot.get('groups') or []
+
+    parts = [pack('>B', USER_ENCODING_VERSION)]
+    parts.extend(_pack_string(snapshot.get(field)) for field in USER_ENCODING_FIELDS)
+    parts.append(pack('>H', len(groups)))
+    parts.extend(_pack_string(group) for group in groups)
+
+    return b''.join(parts)
+
+
+def decode_user(data):
+    """
+    Decode a user snapshot encoded by :func:`encode_user`.
+
+    :param bytes data: The encoded user.
+    :rtype: dict
+    :returns: The user snapshot, or None if the data was encoded with a
+        different version of our format (or is corrupt).
+    """
+    try:
+        version, = unpack_from('>B', data, 0)
+        if version != USER_ENCODING_VERSION:
+            return None
+
+        offset = 1
+        snapshot = {}
+        for field in USER_ENCODING_FIELDS:
+            snapshot[field], offset = _unpack_string(data, offset)
+
+        count, = unpack_from('>H', data, offset)
+        offset += 2
+
+        groups = []
+        for _ in range(count):
+            group, offset = _unpack_string(data, offset)
+            groups.append(group)
+    except (struct_error, UnicodeDecodeError):
+        return None
+
+    snapshot['groups'] = groups
+    return snapshot
+
+
+class MemoryStore(object):
+    """
+    A simple in-memory store for the shared user cache.
+
+    This is only shared by threads in the same process, so it's mostly useful
+    for development and testing.
+
+    The store holds at most `max_size` entries.  Once it is full, the least
+    recently set entries are dropped first (whether or not they've expired).
+    """
+    def __init__(self, max_size=10000):
+        """
+        Initialize this store.
+
+        :param int max_size: (optional) The maximum number of entries to keep.
+        """
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def _get(self, key):
+        """Return the value stored for `key` (or None).  The lock must be held."""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+
+        value, expires_at = entry
+        if expires_at <= time():
+            del self._data[key]
+            return None
+
+        return value
+
+    def _set(self, key, value, ttl):
+        """Store `value` for `key`, for `ttl` seconds.  The lock must be held."""
+        # Move the key to the end, so the oldest entries are dropped first.
+        self._data.pop(key, None)
+        self._data[key] = (value, time() + ttl)
+
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def get(self, key):
+        """Return the value stored for `key` (or None)."""
+        with self._lock:
+            return self._get(key)
+
+    def set(self, key, value, ttl):
+        """Store `value` for `key`, for `ttl` seconds."""
+        with self._lock:
+            self._set(key, value, ttl)
+
+    def compare_and_set(self, key, expected, value, ttl):
+        """
+        Atomically store `value` for `key` (for `ttl` seconds), but only if
+        the value stored for `key` is still `expected` (None meaning there
+        isn't one).
+
+        :returns: True if `value` was stored, False if `key` had changed.
+        """
+        with self._lock:
+            if self._get(key) != expected:
+                return False
+
+            self._set(key, value, ttl)
+            return True
+
+    def delete(self, key):
+        """Remove the value stored for `key` (if there is one)."""
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class RedisStore(object):
+    """
+    A store for the shared user cache which speaks the Redis protocol.
+
+    This requires the `redis` package to be installed, unless a ready-made
+    client is passed in.
+    """
+    # Sets a key to ARGV[2] (for ARGV[3] seconds) if it still holds ARGV[1]
+    # (an empty string meaning it doesn't exist), in a single atomic step.
+    COMPARE_AND_SET_SCRIPT = """
+        if (redis.call('GET', KEYS[1]) or '') ~= ARGV[1] then
+            return 0
+        end
+        redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+        return 1
+    """
+
+    def __init__(self, url='redis://localhost:6379/0', client=None, prefix='flask-stormpath:user:'):
+        """
+        Initialize this store.
+
+        :param str url: (optional) The Redis URL to connect to.
+        :param obj client: (optional) An existing Redis client to use instead
+            of connecting to `url`.  This can be anything which provides the
+            `get`, `set`, `delete` and `eval` methods of a `redis.StrictRedis`
+            client.
+        :param str prefix: (optional) A prefix for all of our keys.
+        """
+        if client is None:
+            try:
+                from redis import StrictRedis
+            except ImportError:
+                raise ConfigurationError('You must install the redis package to use the RedisStore.')
+
+            client = StrictRedis.from_url(url)
+
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        """Return the value stored for `key` (or None)."""
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl):
+        """Store `value` for `key`, for `ttl` seconds."""
+        self.client.set(self.prefix + key, value, ex=max(int(ttl), 1))
+
+    def delete(self, key):
+        """Remove the value stored for `key` (if there is one)."""
+        self.client.delete(self.prefix + key)
+
+    def compare_and_set(self, key, expected, value, ttl):
+        """
+        Atomically store `value` for `key` (for `ttl` seconds), but only if
+        the value stored for `key` is still `expected` (None meaning there
+        isn't one).
+
+        :returns: True if `value` was stored, False if `key` had changed.
+        """
+        return bool(self.client.eval(
+            self.COMPARE_AND_SET_SCRIPT,
+            1,
+            self.prefix + key,
+            b'' if expected is None else expected,
+            value,
+            max(int(ttl), 1),
+        ))
+
+
+class SharedUserCache(object):
+    """
+    A user cache tier backed by a pluggable store (shared by all processes).
+
+    Users are stored as snapshots (see :meth:`User.to_snapshot`) in our compact
+    binary format, never as pickled Stormpath resources.  Store failures are
+    treated as cache misses, so an unavailable store never breaks logins.
+    """
+    def __init__(self, store, ttl=300):
+        """
+        Initialize this cache.
+
+        :param obj store: The store to use (a :class:`MemoryStore`,
+            :class:`RedisStore`, or anything with the same interface).
+        :param int ttl: (optional) How long (in seconds) an entry is valid for.
+        """
+        self.store = store
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.latency = 0.0
+        self._lock = Lock()
+
+    @property
+    def stats(self):
+        """Return a dict of statistics about this cache."""
+        lookups = self.hits + self.misses
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors,
+            'total_latency': self.latency,
+            'average_latency': self.latency / lookups if lookups else 0.0,
+        }
+
+    def get(self, key):
+        """
+        Return the user snapshot stored for `key`, or None.
+
+        :param str key: The cache key (a Stormpath href).
+        """
+        start = time()
+        error = False
+
+        try:
+            data = self.store.get(key)
+        except Exception:
+            data = None
+            error = True
+
+        snapshot = decode_user(data) if data else None
+
+        with self._lock:
+            self.latency += time() - start
+
+            if error:
+                self.errors += 1
+
+            if snapshot is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        return snapshot
+
+    def set(self, key, snapshot):
+        """
+        Store a user snapshot for `key`.
+
+        :param str key: The cache key (a Stormpath href).
+        :param dict snapshot: The user snapshot.
+        """
+        try:
+            self.store.set(key, encode_user(snapshot), self.ttl)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+
+    def delete(self, key):
+        """
+        Remove the entry for `key` (if there is one).
+
+        :param str key: The cache key (a Stormpath href).
+        """
+        try:
+            self.store.delete(key)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+
+    def invalidate(self, sender, user=None):
+        """
+        A signal receiver which removes the given user from the cache.
+
+        This is connected to the `user_updated` and `user_deleted` signals.
+        """
+        if user is not None:
+            self.delete(user.href)
+
+
+def load_cached_href(filename, name):
+    """
+    Return the href stored for `name` in the given href file (or None).
+
+    Href files are small JSON files which map resource names to hrefs, so that
+    a slow Stormpath search only ever needs to be done once.
+
+    :param str filename: The path to the href file.
+    :param str name: The resource name.
+    """
+    try:
+        with open(filename) as f:
+            return load(f).get(name)
+    except (IOError, OSError, ValueError, AttributeError):
+        return None
+
+
+def _update_href_file(filename, name, href):
+    """
+    Store (or, if `href` is None, remove) the href for `name` in the given href
+    file.
+
+    The file is replaced atomically, so concurrent readers (in other processes)
+    never see a partially written file, and updates hold an exclusive lock on
+    a `.lock` file next to it, so concurrent writers never lose each other's
+    changes.  Failures are silently ignored -- the href will just be looked up
+    again next time.
+    """
+    try:
+        lock = open(filename + '.lock', 'a')
+    except (IOError, OSError):
+        return
+
+    # The lock is released when the lock file is closed.
+    with lock:
+        if flock is not None:
+            try:
+                flock(lock.fileno(), LOCK_EX)
+            except (IOError, OSError):
+                return
+
+        _replace_href_file(filename, name, href)
+
+
+def _replace_href_file(filename, name, href):
+    """
+    Read the given href file, update the href for `name`, and atomically
+    replace the file.  The caller must hold the file's lock.
+    """
+    try:
+        with open(filename) as f:
+            hrefs = load(f)
+    except (IOError, OSError, ValueError):
+        hrefs = {}
+
+    if not isinstance(hrefs, dict):
+        hrefs = {}
+
+    if href is None:
+        if hrefs.pop(name, None) is None:
+            return
+    else:
+        hrefs[name] = href
+
+    temp = None
+    try:
+        with NamedTemporaryFile('w', dir=path.dirname(path.abspath(filename)), delete=False) as f:
+            temp = f.name
+            dump(hrefs, f)
+
+        replace(temp, filename)
+        temp = None
+    except (IOError, OSError):
+        pass
+    finally:
+        if temp is not None:
+            try:
+                remove(temp)
+            except OSError:
+                pass
+
+
+def store_cached_href(filename, name, href):
+    """
+    Store the href for `name` in the given href file.
+
+    The file is replaced atomically, so concurrent readers (in other processes)
+    never see a partially written file.  Failures are silently ignored -- the
+    href will just be looked up again next time.
+
+    :param str filename: The path to the href file.
+    :param str name: The resource name.
+    :param str href: The resource href.
+    """
+    _update_href_file(filename, name, href)
+
+
+def delete_cached_href(filename, name):
+    """
+    Remove the href stored for `name` from the given href file (if there is
+    one), because the resource it points to no longer exists.
+
+    :param str filename: The path to the href file.
+    :param str name: The resource name.
+    """
+    _update_href_file(filename, name, None)
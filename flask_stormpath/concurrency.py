@@ -0,0 +1,327 @@
+"""Concurrency helpers, used to control how we talk to Stormpath."""
+
+
+from collections import deque
+from sys import exc_info
+from threading import Condition, Event, Lock
+from time import time
+
+from six import reraise
+
+from .errors import ConcurrencyLimitError
+
+
+class _Call(object):
+    """A single in-flight call, shared by every thread waiting on it."""
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Coalesce concurrent calls which share the same key.
+
+    If several threads ask for the same key at once (the same account href,
+    for instance), only the first thread actually makes the call -- every other
+    thread waits for it to finish, and gets the same result (or exception).
+
+    Usage::
+
+        flights = SingleFlight()
+        account = flights.do(href, client.accounts.get, href)
+    """
+    def __init__(self):
+        self._calls = {}
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._calls)
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        Call `func(*args, **kwargs)`, unless a call for `key` is already in
+        flight, in which case we'll wait for that call and share its result.
+
+        :param key: Any hashable key identifying this call.
+        :param func func: The function to call.
+        :returns: Whatever `func` returns.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                reraise(*call.error)
+
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+        except Exception:
+            call.error = exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+            call.done.set()
+
+        return call.result
+
+
+# Priority classes for Stormpath calls: interactive auth (logins, and loading
+# the current user), background session refreshes, and admin / bulk work.
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_REFRESH = 'refresh'
+PRIORITY_BULK = 'bulk'
+
+# How many queued calls of each priority class are let through, relative to
+# the others, when they're competing for slots.
+DEFAULT_PRIORITY_WEIGHTS = {
+    PRIORITY_INTERACTIVE: 8,
+    PRIORITY_REFRESH: 2,
+    PRIORITY_BULK: 1,
+}
+
+# The share (0 - 1) of the concurrency limit each priority class may use at
+# once.  This keeps some slots free for interactive calls, no matter how much
+# background or bulk work is going on.
+DEFAULT_PRIORITY_SHARES = {
+    PRIORITY_INTERACTIVE: 1.0,
+    PRIORITY_REFRESH: 0.75,
+    PRIORITY_BULK: 0.5,
+}
+
+
+class _Waiter(object):
+    """A call waiting in the limiter's queue."""
+
+    def __init__(self, priority):
+        self.priority = priority
+        self.granted = False
+
+
+class AdaptiveLimiter(object):
+    """
+    An adaptive (AIMD) concurrency limiter, with priority classes.
+
+    Rather than guessing how many concurrent calls Stormpath can handle, we
+    discover it: the limit grows additively (by roughly one call per "round"
+    of calls) while latency stays healthy, and is cut multiplicatively as soon
+    as latency grows past `latency_tolerance` times the best recent latency of
+    the same operation type, or calls fail.  This is the same approach TCP uses
+    for congestion control.  Each operation type has its own baseline, since a
+    login is normally much slower than a cached read.
+
+    Every call has a priority class (see `PRIORITY_INTERACTIVE`, etc.).  Each
+    class may only use its share of the limit, and when calls are queued, free
+    slots are handed out by weighted round robin -- so interactive calls get
+    most slots, but no class is ever starved.
+
+    Calls beyond the limit wait in a bounded queue (for up to `queue_timeout`
+    seconds), or are rejected immediately if the queue is full.
+
+    Usage::
+
+        limiter = AdaptiveLimiter()
+
+        limiter.acquire(priority=PRIORITY_BULK)
+        start = time()
+        try:
+            result = call()
+        except Exception:
+            limiter.release(time() - start, failed=True, priority=PRIORITY_BULK)
+            raise
+
+        limiter.release(time() - start, priority=PRIORITY_BULK)
+    """
+    def __init__(self, initial_limit=20, min_limit=1, max_limit=200, latency_tolerance=2.0, backoff=0.9, queue_size=50, queue_timeout=0.5, window=100, weights=None, shares=None):
+        """
+        Initialize this limiter.
+
+        :param int initial_limit: (optional) The initial concurrency limit.
+        :param int min_limit: (optional) The lowest the limit may go.
+        :param int max_limit: (optional) The highest the limit may go.
+        :param float latency_tolerance: (optional) Calls slower than this
+            multiple of the best recent latency (of their operation type)
+            shrink the limit.
+        :param float backoff: (optional) The factor (0 - 1) the limit is
+            multiplied by when it shrinks.
+        :param int queue_size: (optional) How many calls may wait for a slot.
+        :param float queue_timeout: (optional) How long (in seconds) calls may
+            wait for a slot.
+        :param int window: (optional) How many recent latencies (per
+            operation type) are used to find the best recent latency.
+        :param dict weights: (optional) Scheduling weights, per priority class
+            (see `DEFAULT_PRIORITY_WEIGHTS`).
+        :param dict shares: (optional) The share of the limit each priority
+            class may use (see `DEFAULT_PRIORITY_SHARES`).
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_tolerance = latency_tolerance
+        self.backoff = backoff
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.weights = dict(DEFAULT_PRIORITY_WEIGHTS, **(weights or {}))
+        self.shares = dict(DEFAULT_PRIORITY_SHARES, **(shares or {}))
+
+        self.window = window
+
+        self.limit = float(initial_limit)
+        self._latencies = {}
+        self._in_flight = 0
+        self._in_flight_by_priority = dict((priority, 0) for priority in self.weights)
+        self._waiting = dict((priority, deque()) for priority in self.weights)
+        self._credits = dict((priority, 0) for priority in self.weights)
+        self._queued = 0
+        self._accepted = 0
+        self._rejected = 0
+        self._decreased_at = 0
+        self._condition = Condition(Lock())
+
+    def _has_slot(self, priority):
+        """Return True if a call of the given priority may start now (the lock must be held)."""
+        limit = int(self.limit)
+        capacity = max(1, int(limit * self.shares.get(priority, 1.0)))
+
+        return self._in_flight < limit and self._in_flight_by_priority[priority] < capacity
+
+    def _grant(self, priority):
+        """Give a slot to a call of the given priority (the lock must be held)."""
+        self._in_flight += 1
+        self._in_flight_by_priority[priority] += 1
+        self._accepted += 1
+
+    def _dispatch(self):
+        """
+        Hand free slots to queued calls (the lock must be held).
+
+        Slots are handed out by smooth weighted round robin: every priority
+        class with queued calls (which is under its share of the limit) earns
+        credits in proportion to its weight, and the class with the most
+        credits goes next.
+        """
+        granted = False
+
+        while True:
+            eligible = [priority for priority, waiters in self._waiting.items() if waiters and self._has_slot(priority)]
+            if not eligible:
+                break
+
+            for priority in eligible:
+                self._credits[priority] += self.weights[priority]
+
+            chosen = max(eligible, key=lambda priority: self._credits[priority])
+            self._credits[chosen] -= sum(self.weights[priority] for priority in eligible)
+
+            self._waiting[chosen].popleft().granted = True
+            self._grant(chosen)
+            granted = True
+
+        if granted:
+            self._condition.notify_all()
+
+    def acquire(self, timeout=None, priority=PRIORITY_INTERACTIVE):
+        """
+        Reserve a slot for a call, waiting in the queue if needed.
+
+        :param float timeout: (optional) The longest (in seconds) we may wait
+            for a slot.  This is capped to the limiter's `queue_timeout`.
+        :param str priority: (optional) The call's priority class.
+        :raises: ConcurrencyLimitError if no slot is available in time.
+        """
+        if priority not in self.weights:
+            raise ValueError('Unknown priority class %r.' % priority)
+
+        timeout = self.queue_timeout if timeout is None else min(timeout, self.queue_timeout)
+
+        with self._condition:
+            self._dispatch()
+
+            if not self._waiting[priority] and self._has_slot(priority):
+                self._grant(priority)
+                return
+
+            if self._queued >= self.queue_size or timeout <= 0:
+                self._rejected += 1
+                raise ConcurrencyLimitError('Too many concurrent calls to Stormpath.', retry_after=1)
+
+            waiter = _Waiter(priority)
+            self._waiting[priority].append(waiter)
+            self._queued += 1
+            deadline = time() + timeout
+
+            try:
+                while not waiter.granted:
+                    remaining = deadline - time()
+                    if remaining <= 0:
+                        self._waiting[priority].remove(waiter)
+                        self._rejected += 1
+                        raise ConcurrencyLimitError('Timed out waiting for a Stormpath connection slot.', retry_after=1)
+
+                    self._condition.wait(remaining)
+            finally:
+                self._queued -= 1
+
+    def release(self, latency=None, failed=False, priority=PRIORITY_INTERACTIVE, operation=None):
+        """
+        Release a slot reserved by :meth:`acquire`, and adjust the limit.
+
+        :param float latency: (optional) How long (in seconds) the call took.
+            If this is None (the call was never made), the limit is left as-is.
+        :param bool failed: (optional) Whether the call failed.
+        :param str priority: (optional) The call's priority class.
+        :param str operation: (optional) The call's operation type.  Its
+            latency is only compared to recent calls of the same type.
+        """
+        with self._condition:
+            self._in_flight -= 1
+            self._in_flight_by_priority[priority] -= 1
+
+            if latency is not None:
+                latencies = self._latencies.get(operation)
+                if latencies is None:
+                    latencies = self._latencies[operation] = deque(maxlen=self.window)
+
+                latencies.append(latency)
+                best = min(latencies)
+
+                if failed or latency > best * self.latency_tolerance:
+
+                    # Concurrent calls usually see the same congestion, so we
+                    # only shrink the limit once per "round" of calls.
+                    now = time()
+                    if now - self._decreased_at >= latency:
+                        self.limit = max(self.min_limit, self.limit * self.backoff)
+                        self._decreased_at = now
+                else:
+                    self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+            self._dispatch()
+
+    @property
+    def stats(self):
+        """
+        Return the current limit, and how many calls were accepted, queued, or
+        rejected (along with in flight and queued calls per priority class).
+        """
+        with self._condition:
+            return {
+                'limit': int(self.limit),
+                'in_flight': self._in_flight,
+                'queued': self._queued,
+                'accepted': self._accepted,
+                'rejected': self._rejected,
+                'best_latencies': dict((operation, min(latencies)) for operation, latencies in self._latencies.items()),
+                'in_flight_by_priority': dict(self._in_flight_by_priority),
+                'queued_by_priority': dict((priority, len(waiters)) for priority, waiters in self._waiting.items()),
+            }
@@ -0,0 +1,103 @@
+"""
+Per-request deadlines for Stormpath calls.
+
+A deadline is the time by which every Stormpath call made while handling the
+current request must be done.  Each call's socket timeouts are capped to the
+time remaining (see :class:`flask_stormpath.transport.PooledHTTPAdapter`), and
+once the deadline has passed, calls fail immediately with a
+:class:`~flask_stormpath.errors.DeadlineExceededError` -- so a single request
+can never wait out several full timeouts back to back.
+
+Deadlines are stored on the current app context, which Flask pushes for every
+request.
+"""
+
+
+from time import time
+
+from flask import _app_ctx_stack as stack, current_app
+from stormpath.error import Error as StormpathError
+
+from .errors import DeadlineExceededError
+
+
+def set_deadline(budget):
+    """
+    Set the deadline of the current request.
+
+    :param float budget: How long (in seconds, from now) Stormpath calls may
+        take.  If this is None, the deadline is removed.
+    """
+    ctx = stack.top
+    if ctx is not None:
+        ctx.stormpath_deadline = time() + budget if budget is not None else None
+
+
+def get_deadline():
+    """Return the deadline of the current request (as a timestamp), or None."""
+    ctx = stack.top
+    return getattr(ctx, 'stormpath_deadline', None) if ctx is not None else None
+
+
+def remaining_time():
+    """
+    Return how long (in seconds) the current request has left before its
+    deadline, or None if it has no deadline.
+    """
+    deadline = get_deadline()
+    if deadline is None:
+        return None
+
+    return deadline - time()
+
+
+def check_deadline():
+    """
+    Ensure the current request's deadline hasn't passed.
+
+    :raises: DeadlineExceededError if it has.
+    """
+    remaining = remaining_time()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceededError('The request deadline was exceeded.')
+
+
+def call_within_deadline(func, *args, **kwargs):
+    """
+    Call `func(*args, **kwargs)`, turning any error raised after the current
+    request's deadline has passed into a :class:`DeadlineExceededError`.
+
+    The Stormpath SDK wraps network errors (including timeouts caused by our
+    capped socket timeouts) in its own errors -- this ensures they're reported
+    as what they really are.  Real client error responses from Stormpath
+    (like a wrong password) are left alone, however late they arrive.
+    """
+    try:
+        return func(*args, **kwargs)
+    except DeadlineExceededError:
+        raise
+    except StormpathError as err:
+        if err.status is not None and 400 <= err.status < 500:
+            raise
+
+        remaining = remaining_time()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceededError('The request deadline was exceeded.')
+
+        raise
+    except Exception:
+        remaining = remaining_time()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceededError('The request deadline was exceeded.')
+
+        raise
+
+
+def start_request_deadline():
+    """
+    Start the current request's deadline (`STORMPATH_REQUEST_DEADLINE`).
+
+    This is registered as a `before_request` handler.
+    """
+    budget = current_app.config['STORMPATH_REQUEST_DEADLINE']
+    set_deadline(budget.total_seconds() if budget is not None else None)
@@ -6,11 +6,18 @@ simpler.
 
 from functools import wraps
 
-from flask import current_app
+from flask import _request_ctx_stack, abort, current_app, request, session
 from flask.ext.login import current_user
+from six import string_types
 
+from .deadlines import set_deadline
+from .expressions import compile_policy
+from .groups import get_group_hrefs, normalize_groups
+from .models import User
+from .tokens import verify_access_token
 
-def groups_required(groups, all=True):
+
+def groups_required(groups=None, all=True, policy=None):
     """
     This decorator requires that a user be part of one or more Groups before
     they are granted access.
@@ -26,6 +33,15 @@ def groups_required(groups, all=True):
         group listed?  Default: True.  If this is set to False, we'll let the
         user into the view if the user is part of at least one of the specified
         groups.
+    :param str policy: (optional) Instead of a list of Groups, a policy
+        expression (or a compiled :class:`~flask_stormpath.expressions.Policy`),
+        which combines Group names or hrefs with `&` (and), `|` (or), `!` (not)
+        and parentheses -- for instance: `'admins | (developers & !contractors)'`.
+        Names containing spaces can be quoted.
+
+    The list of groups (or policy) is compiled once (when the view is
+    decorated), and the user's group memberships are only fetched once per
+    request, no matter how many views or decorators check them.
 
     Usage::
 
@@ -33,7 +49,23 @@ def groups_required(groups, all=True):
         def private_view():
             '''Only admins and developers will be able to visit this page.'''
             return 'hi!'
+
+        @groups_required(policy='admins | (developers & !contractors)')
+        def another_private_view():
+            '''Only admins, and developers who aren't contractors.'''
+            return 'hi!'
     """
+    # Plain strings are always Group names (or hrefs), even if they contain
+    # characters like `&` -- policies must be passed explicitly.
+    if (groups is None) == (policy is None):
+        raise TypeError('groups_required needs either a list of groups, or a policy.')
+
+    if policy is not None:
+        if isinstance(policy, string_types):
+            policy = compile_policy(policy)
+    else:
+        required = normalize_groups(groups)
+
     def decorator(func):
 
         @wraps(func)
@@ -47,14 +79,24 @@ def groups_required(groups, all=True):
             elif not current_user.is_authenticated():
                 return current_app.login_manager.unauthorized()
 
-            # If the user authenticated, and the all flag is set, we need to
-            # see if the user is a member of *ALL* groups.
-            if all and not current_user.has_groups(groups):
-                return current_app.login_manager.unauthorized()
+            catalog = current_app.stormpath_group_catalog
+            memberships = get_group_hrefs(current_user)
 
-            # If the all flag is NOT set, we need to make sure the user is a
+            # If we have a policy, we'll resolve each Group it refers to into
+            # hrefs (locally, using the Group catalog), and evaluate the
+            # policy against the Groups the user is a member of.
+            if policy is not None:
+                authorized = policy.evaluate(set(
+                    group for group in policy.groups if catalog.is_member(group, memberships)
+                ))
+
+            # If the all flag is set, we need to see if the user is a member of
+            # *ALL* groups.  Otherwise, we need to make sure the user is a
             # member of at least one group.
-            elif not current_user.has_groups(groups, all=False):
+            else:
+                authorized = catalog.check(required, memberships, all=all)
+
+            if not authorized:
                 return current_app.login_manager.unauthorized()
 
             # Lastly, if the user has successfully passsed all authentication /
@@ -64,3 +106,113 @@ def groups_required(groups, all=True):
         return wrapper
 
     return decorator
+
+
+def token_required(func):
+    """
+    This decorator requires that a request carry a valid access token (issued
+    by the built-in token view) before access is granted.
+
+    The token must be passed in the `Authorization` header, as a bearer token::
+
+        Authorization: Bearer <token>
+
+    Tokens are verified locally (no Stormpath API calls are made).  If the
+    token is valid, `current_user` is set to a read-only :class:`User` built
+    from the token's claims, otherwise a 401 UNAUTHORIZED is returned.
+
+    Usage::
+
+        @app.route('/api/me')
+        @token_required
+        def api_me():
+            return jsonify(href=current_user.href)
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+
+        # If authentication stuff is disabled, do nothing.
+        if current_app.login_manager._login_disabled:
+            return func(*args, **kwargs)
+
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not token:
+            abort(401)
+
+        claims = verify_access_token(token.strip())
+        if not claims or claims.get('status') != 'ENABLED':
+            abort(401)
+
+        # Make the token's user available as `current_user` for the rest of
+        # this request.
+        _request_ctx_stack.top.user = User.from_snapshot(claims)
+
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def request_deadline(budget):
+    """
+    This decorator overrides the request deadline (`STORMPATH_REQUEST_DEADLINE`)
+    for a view.
+
+    Every Stormpath call made while handling the view must finish within the
+    given budget (counted from when the view is called), or it will fail with a
+    `DeadlineExceededError`.
+
+    Usage::
+
+        @app.route('/dashboard')
+        @request_deadline(timedelta(milliseconds=300))
+        @login_required
+        def dashboard():
+            return render_template('dashboard.html')
+
+    :param obj budget: A timedelta object, or None to remove the deadline.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            set_deadline(budget.total_seconds() if budget is not None else None)
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def shed_load(func):
+    """
+    This decorator sheds a view's POST requests when too many authentication
+    requests are already in flight (see `STORMPATH_LOAD_SHEDDING_ENABLED`).
+
+    Shed requests are rejected with a `503 Service Unavailable` response (and
+    a `Retry-After` header) before the view is called.  GET requests, and
+    requests from sessions which are already logged in, are always let
+    through.
+
+    This is applied to the built-in login, registration, and password reset
+    views.
+
+    Usage::
+
+        @app.route('/signup', methods=['GET', 'POST'])
+        @shed_load
+        def signup():
+            ...
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        shedder = current_app.stormpath_load_shedder
+
+        # We only look at the session (rather than `current_user`), since
+        # loading the current user may itself call Stormpath.
+        if shedder is None or request.method != 'POST' or session.get('user_id'):
+            return func(*args, **kwargs)
+
+        shedder.enter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            shedder.exit()
+
+    return wrapper
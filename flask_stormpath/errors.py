@@ -6,3 +6,88 @@ class ConfigurationError(Exception):
     This exception is raised if a user has misconfigured Flask-Stormpath.
     """
     pass
+
+
+class ReadOnlyUserError(Exception):
+    """
+    This exception is raised if a user attempts to modify a User which was
+    restored from a session snapshot (these users are read-only).
+    """
+    pass
+
+
+class InvalidPolicyError(Exception):
+    """
+    This exception is raised if an authorization policy expression (passed to
+    `groups_required`) is invalid.
+    """
+    pass
+
+
+class RateLimitExceededError(Exception):
+    """
+    This exception is raised if a client (or login) has made too many
+    requests, and is rejected locally (see `STORMPATH_RATE_LIMIT_BY_IP` and
+    `STORMPATH_RATE_LIMIT_BY_LOGIN`).
+
+    :attr float retry_after: How long (in seconds) the client should wait
+        before trying again.
+    """
+    def __init__(self, message, retry_after=None):
+        super(RateLimitExceededError, self).__init__(message)
+        self.retry_after = retry_after
+
+
+class StormpathUnavailableError(Exception):
+    """
+    This exception is raised if a Stormpath call is rejected locally (without
+    being attempted), because Stormpath is unavailable or overloaded.
+
+    :attr float retry_after: How long (in seconds) callers should wait before
+        trying again.
+    """
+    def __init__(self, message, retry_after=None):
+        super(StormpathUnavailableError, self).__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(StormpathUnavailableError):
+    """
+    This exception is raised if a Stormpath call is rejected because our
+    circuit breaker is open.
+    """
+    pass
+
+
+class BulkheadFullError(StormpathUnavailableError):
+    """
+    This exception is raised if a Stormpath call is rejected because too many
+    calls of the same type are already in flight.
+    """
+    pass
+
+
+class DeadlineExceededError(StormpathUnavailableError):
+    """
+    This exception is raised if a Stormpath call couldn't be completed before
+    the current request's deadline (see `STORMPATH_REQUEST_DEADLINE`).
+    """
+    pass
+
+
+class ConcurrencyLimitError(StormpathUnavailableError):
+    """
+    This exception is raised if a Stormpath call is rejected because our
+    adaptive concurrency limit was reached (see
+    `STORMPATH_CONCURRENCY_LIMIT_ENABLED`).
+    """
+    pass
+
+
+class OverloadedError(StormpathUnavailableError):
+    """
+    This exception is raised if an authentication request is shed (rejected
+    before it's handled), because too many are already in flight (see
+    `STORMPATH_LOAD_SHEDDING_ENABLED`).
+    """
+    pass
@@ -0,0 +1,180 @@
+"""
+A tiny authorization policy language, used to express Group requirements.
+
+Policies combine Group names (or hrefs) with the operators `&` (and), `|` (or),
+and `!` (not), and may use parentheses for grouping.  Names containing spaces
+can be quoted.  For example::
+
+    admins | (developers & !contractors)
+    "paid users" & !banned
+
+Policies are compiled once into a plain Python function, and evaluated against
+the set of Groups a user is a member of.
+"""
+
+
+from re import compile as compile_regex
+from threading import Lock
+
+from .errors import InvalidPolicyError
+
+
+_TOKEN_REGEX = compile_regex(r'''\s*(?:([&|!()])|"([^"]*)"|'([^']*)'|([^\s&|!()"']+))''')
+
+_compiled = {}
+_compiled_lock = Lock()
+
+
+class Policy(object):
+    """
+    A compiled authorization policy.
+
+    :attr str expression: The policy expression.
+    :attr frozenset groups: Every Group (name or href) the policy refers to.
+    """
+    def __init__(self, expression, groups, evaluate):
+        self.expression = expression
+        self.groups = groups
+        self._evaluate = evaluate
+
+    def __repr__(self):
+        return 'Policy <%r>' % self.expression
+
+    def evaluate(self, groups):
+        """
+        Evaluate this policy.
+
+        :param set groups: The Groups (names or hrefs, as they're written in
+            the policy) the user is a member of.
+        :rtype: bool
+        """
+        return self._evaluate(groups)
+
+
+def _tokenize(expression):
+    """
+    Split a policy expression into a list of `(kind, value)` tokens, where kind
+    is either 'op' or 'name'.
+    """
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+
+    while position < len(expression):
+        match = _TOKEN_REGEX.match(expression, position)
+        if not match:
+            raise InvalidPolicyError('Invalid policy %r (at position %d).' % (expression, position))
+
+        operator, double_quoted, single_quoted, name = match.groups()
+        if operator:
+            tokens.append(('op', operator))
+        else:
+            value = name if name is not None else (double_quoted if double_quoted is not None else single_quoted)
+            tokens.append(('name', value))
+
+        position = match.end()
+
+    return tokens
+
+
+class _Parser(object):
+    """A recursive descent parser which compiles policy tokens to a function."""
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = _tokenize(expression)
+        self.position = 0
+        self.groups = set()
+
+    def error(self, message):
+        raise InvalidPolicyError('Invalid policy %r: %s.' % (self.expression, message))
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+
+        return None, None
+
+    def take(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            self.error('policy is empty')
+
+        func = self.parse_or()
+        if self.position != len(self.tokens):
+            self.error('unexpected %r' % self.peek()[1])
+
+        return func
+
+    def parse_or(self):
+        funcs = [self.parse_and()]
+        while self.peek() == ('op', '|'):
+            self.take()
+            funcs.append(self.parse_and())
+
+        if len(funcs) == 1:
+            return funcs[0]
+
+        return lambda groups: any(func(groups) for func in funcs)
+
+    def parse_and(self):
+        funcs = [self.parse_not()]
+        while self.peek() == ('op', '&'):
+            self.take()
+            funcs.append(self.parse_not())
+
+        if len(funcs) == 1:
+            return funcs[0]
+
+        return lambda groups: all(func(groups) for func in funcs)
+
+    def parse_not(self):
+        if self.peek() == ('op', '!'):
+            self.take()
+            func = self.parse_not()
+            return lambda groups: not func(groups)
+
+        return self.parse_atom()
+
+    def parse_atom(self):
+        kind, value = self.take()
+
+        if kind == 'name':
+            self.groups.add(value)
+            return lambda groups: value in groups
+
+        if (kind, value) == ('op', '('):
+            func = self.parse_or()
+            if self.take() != ('op', ')'):
+                self.error('missing closing parenthesis')
+
+            return func
+
+        self.error('unexpected %r' % value if value else 'unexpected end of policy')
+
+
+def compile_policy(expression):
+    """
+    Compile a policy expression.
+
+    Policies are cached, so compiling the same expression twice returns the
+    same :class:`Policy`.
+
+    :param str expression: The policy expression.
+    :rtype: obj
+    :returns: A :class:`Policy`.
+    :raises: InvalidPolicyError if the expression is invalid.
+    """
+    policy = _compiled.get(expression)
+    if policy is not None:
+        return policy
+
+    parser = _Parser(expression)
+    evaluate = parser.parse()
+
+    with _compiled_lock:
+        return _compiled.setdefault(expression, Policy(expression, frozenset(parser.groups), evaluate))
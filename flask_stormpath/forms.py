@@ -1,11 +1,33 @@
 """Helper forms which make handling common operations simpler."""
 
 
+from flask import current_app
 from flask.ext.wtf import Form
 from wtforms.fields import PasswordField, StringField
 from wtforms.validators import InputRequired, ValidationError
 
 
+def check_password_policy(field, account=None):
+    """
+    Ensure a password satisfies the password policy of the application's
+    default Directory (see `STORMPATH_PASSWORD_POLICY_ENABLED`), otherwise
+    raise a ValidationError.
+
+    This lets us reject weak passwords without a round trip to Stormpath.
+
+    :param obj account: (optional) The Stormpath Account whose password this
+        is.  If given, its own Directory's policy is checked instead.
+    :raises: ValidationError if the password breaks the policy.
+    """
+    policy = current_app.stormpath_password_policy
+    if policy is None:
+        return
+
+    errors = policy.check(field.data, account)
+    if errors:
+        raise ValidationError(errors[0])
+
+
 class RegistrationForm(Form):
     """
     Register a new user.
@@ -30,6 +52,15 @@ class RegistrationForm(Form):
     email = StringField('Email', validators=[InputRequired()])
     password = PasswordField('Password', validators=[InputRequired()])
 
+    def validate_password(self, field):
+        """
+        Ensure the password satisfies the Directory's password policy,
+        otherwise raise a ValidationError.
+
+        :raises: ValidationError if the password is too weak.
+        """
+        check_password_policy(field)
+
 
 class LoginForm(Form):
     """
@@ -68,10 +99,26 @@ class ChangePasswordForm(Form):
 
     This class is used to retrieve a user's password twice to ensure it's valid
     before making a change.
+
+    If an `account` keyword argument is given, the password is checked against
+    the password policy of that Account's Directory.
     """
     password = PasswordField('Password', validators=[InputRequired()])
     password_again = PasswordField('Password (again)', validators=[InputRequired()])
 
+    def __init__(self, *args, **kwargs):
+        self.account = kwargs.pop('account', None)
+        super(ChangePasswordForm, self).__init__(*args, **kwargs)
+
+    def validate_password(self, field):
+        """
+        Ensure the password satisfies the Directory's password policy,
+        otherwise raise a ValidationError.
+
+        :raises: ValidationError if the password is too weak.
+        """
+        check_password_policy(field, self.account)
+
     def validate_password_again(self, field):
         """
         Ensure both password fields match, otherwise raise a ValidationError.
@@ -0,0 +1,193 @@
+"""Helpers for resolving Groups and Group memberships locally."""
+
+
+from threading import Lock
+from time import time
+
+from flask import current_app, g
+from six import string_types
+
+from .resilience import read_stormpath
+
+
+def normalize_groups(groups):
+    """
+    Normalize a list of Groups (Group objects, names, or hrefs) into a set of
+    group names and hrefs.
+
+    Since Group hrefs are always URLs, they can never be confused with Group
+    names.
+
+    :param list groups: A list of Groups (or a single Group).
+    :rtype: frozenset
+    """
+    if isinstance(groups, string_types) or hasattr(groups, 'href'):
+        groups = [groups]
+
+    return frozenset(getattr(group, 'href', group) for group in groups)
+
+
+def get_group_hrefs(user):
+    """
+    Return the set of hrefs of every Group the given user is a member of.
+
+    The result is cached for the rest of the current request, so no matter how
+    many views, decorators, or `has_groups` calls check a user's memberships,
+    they're only fetched once.
+
+    :param obj user: The User.
+    :rtype: frozenset
+    """
+    cached = getattr(g, '_stormpath_group_hrefs', None)
+    if cached is not None and cached[0] == user.href:
+        return cached[1]
+
+    hrefs = user.get_group_hrefs()
+    g._stormpath_group_hrefs = (user.href, hrefs)
+
+    return hrefs
+
+
+class GroupCatalog(object):
+    """
+    An application-level catalog of Groups, which maps Group names to hrefs
+    (and hrefs to names).
+
+    Group names are only unique within a Directory, so each name maps to the
+    hrefs of *every* Group with that name -- being a member of any of them
+    counts as being a member of the named Group.
+
+    The catalog is loaded lazily (the first time it's used), and reloaded once
+    it is older than its TTL, or after :meth:`refresh` is called.  Looking up
+    a name which isn't in the catalog (a Group created since it was loaded,
+    for instance) also reloads it, at most once every `miss_interval` seconds.
+    This lets us turn Group names into hrefs locally, instead of searching
+    Stormpath.
+    """
+    def __init__(self, ttl=300, miss_interval=10):
+        """
+        Initialize this catalog.
+
+        :param int ttl: (optional) How long (in seconds) the catalog is valid
+            for before being reloaded.
+        :param int miss_interval: (optional) How long (in seconds) the catalog
+            must have been loaded for before an unknown Group name reloads it.
+        """
+        self.ttl = ttl
+        self.miss_interval = miss_interval
+        self._hrefs = {}
+        self._names = {}
+        self._loaded_at = None
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._names)
+
+    def refresh(self):
+        """Force the catalog to be reloaded the next time it is used."""
+        with self._lock:
+            self._loaded_at = None
+
+    def load(self, application):
+        """
+        Load every Group of the given Application into the catalog.
+
+        :param obj application: The Stormpath Application.
+        """
+        hrefs = {}
+        names = {}
+        for group in application.groups:
+            hrefs.setdefault(group.name, set()).add(group.href)
+            names[group.href] = group.name
+
+        with self._lock:
+            self._hrefs = dict((name, frozenset(group_hrefs)) for name, group_hrefs in hrefs.items())
+            self._names = names
+            self._loaded_at = time()
+
+    def ensure_loaded(self):
+        """
+        Load the catalog if it hasn't been loaded yet, or is older than its
+        TTL.
+
+        Concurrent loads share a single Stormpath API call.
+        """
+        loaded_at = self._loaded_at
+        if loaded_at is not None and time() - loaded_at < self.ttl:
+            return
+
+        manager = current_app.stormpath_manager
+        application = manager.application
+        manager.single_flight.do(('group-catalog', application.href), read_stormpath, 'application', self.load, application)
+
+    def get_hrefs(self, name):
+        """
+        Return the hrefs of every Group with the given name (an empty set if
+        there are none).
+
+        :param str name: The Group name.
+        :rtype: frozenset
+        """
+        self.ensure_loaded()
+
+        hrefs = self._hrefs.get(name)
+        if hrefs is None:
+            loaded_at = self._loaded_at
+            if loaded_at is not None and time() - loaded_at >= self.miss_interval:
+                self.refresh()
+                self.ensure_loaded()
+                hrefs = self._hrefs.get(name)
+
+        return hrefs or frozenset()
+
+    def get_name(self, href):
+        """
+        Return the name of the Group with the given href (or None).
+
+        :param str href: The Group href.
+        """
+        self.ensure_loaded()
+        return self._names.get(href)
+
+    def resolve_one(self, group):
+        """
+        Resolve a single Group name or href into a set of hrefs.
+
+        Hrefs resolve to themselves, and names resolve to every Group with that
+        name (see :meth:`get_hrefs`).
+
+        :param str group: The Group name or href.
+        :rtype: frozenset
+        """
+        if group.startswith(('http://', 'https://')):
+            return frozenset([group])
+
+        return self.get_hrefs(group)
+
+    def is_member(self, group, memberships):
+        """
+        Check whether a Group name or href matches any of the given Group
+        memberships.
+
+        :param str group: The Group name or href.
+        :param frozenset memberships: The hrefs of a user's Groups.
+        :rtype: bool
+        """
+        return not self.resolve_one(group).isdisjoint(memberships)
+
+    def check(self, groups, memberships, all=True):
+        """
+        Check whether the given Group memberships satisfy a set of Group names
+        and hrefs (see :func:`normalize_groups`).
+
+        :param frozenset groups: The normalized Groups.
+        :param frozenset memberships: The hrefs of a user's Groups.
+        :param bool all: (optional) Whether every Group must match (the
+            default), or just one of them.
+        :rtype: bool
+        """
+        for group in groups:
+            if self.is_member(group, memberships) != all:
+                return not all
+
+        return all
@@ -1,19 +1,61 @@
 """Custom data models."""
 
 
-from flask import current_app
+from flask import current_app, has_app_context, has_request_context, session
+from flask.ext.login import logout_user
 from six import text_type
 
-from blinker import Namespace
-
+from stormpath.error import Error as StormpathError
 from stormpath.resources.account import Account
+from stormpath.resources.base import Expansion
 from stormpath.resources.provider import Provider
 
+from .concurrency import PRIORITY_BULK
+from .errors import ReadOnlyUserError
+from .groups import get_group_hrefs, normalize_groups
+from .resilience import call_stormpath, get_priority, is_failure, read_stormpath
+from .signals import stormpath_signals, user_created, user_deleted, user_updated
+
+
+# The User fields stored in session snapshots, mapped to their Stormpath
+# property names.
+SNAPSHOT_FIELDS = {
+    'href': 'href',
+    'email': 'email',
+    'username': 'username',
+    'given_name': 'givenName',
+    'middle_name': 'middleName',
+    'surname': 'surname',
+    'status': 'status',
+}
+
+
+def get_user_expansion():
+    """
+    Return the Expansion used when fetching user accounts from Stormpath (or
+    None).
+
+    This is controlled by the `STORMPATH_USER_EXPAND` setting, which lists the
+    account properties (like `groups` and `customData`) which should be
+    expanded -- that is, returned in the same API call as the account itself.
+    """
+    properties = current_app.config['STORMPATH_USER_EXPAND']
+    if not properties:
+        return None
+
+    return Expansion(*properties)
+
+
+def get_update_operation():
+    """
+    Return the operation type of account updates and deletions (see
+    :func:`~flask_stormpath.resilience.call_stormpath`).
 
-stormpath_signals = Namespace()
-user_created = stormpath_signals.signal('user-created')
-user_updated = stormpath_signals.signal('user-updated')
-user_deleted = stormpath_signals.signal('user-deleted')
+    These are 'admin' operations when they're made within a
+    `stormpath_priority('bulk')` block (by a bulk job), and 'update'
+    operations otherwise (like a user saving their own profile).
+    """
+    return 'admin' if get_priority('update') == PRIORITY_BULK else 'update'
 
 
 class User(Account):
@@ -37,8 +79,18 @@ class User(Account):
         """
         A user account is active if, and only if, their account status is
         'ENABLED'.
+
+        If this user was loaded lazily (see `STORMPATH_LAZY_USER`), this will
+        fetch the account from Stormpath.  An account which can no longer be
+        fetched (because it was deleted, for instance) is never active.
         """
-        return self.status == 'ENABLED'
+        if not self._resolve():
+            return False
+
+        try:
+            return self.status == 'ENABLED'
+        except StormpathError:
+            return False
 
     def is_anonymous(self):
         """
@@ -48,16 +100,110 @@ class User(Account):
 
     def is_authenticated(self):
         """
-        All users will always be authenticated, so this will always return
-        True.
+        All users are authenticated -- unless they were loaded lazily (see
+        `STORMPATH_LAZY_USER`), and their account turns out to be deleted or
+        disabled.
+
+        Checking this fetches a lazy user's account from Stormpath (once).
+        """
+        return self._resolve()
+
+    def _resolve(self):
+        """
+        Fetch this user's account, if it was loaded lazily, and return False if
+        it was deleted or disabled (or Stormpath is unreachable).
+
+        Deleted and disabled accounts are remembered in the negative user cache
+        (if it's enabled), dropped from the local user cache, and logged out
+        of the current session -- so a lazy user can't stay logged in (or fail
+        on its first field read) once their account is gone.
+        """
+        if not self.__dict__.get('_lazy'):
+            return True
+
+        resolved = self.__dict__.get('_resolved')
+        if resolved is not None:
+            return resolved
+
+        try:
+            read_stormpath('load_user', self._ensure_data)
+            resolved = self.status != self.STATUS_DISABLED
+        except Exception as err:
+            if not isinstance(err, StormpathError) or is_failure(err):
+
+                # Like an eager load, an unreachable Stormpath means we treat
+                # this request as anonymous -- but we'll check again next time.
+                return False
+
+            resolved = False
+
+        if not resolved:
+            negative_cache = current_app.stormpath_negative_user_cache
+            if negative_cache is not None:
+                negative_cache.set(self.href, True)
+
+            cache = current_app.stormpath_user_cache
+            if cache is not None:
+                cache.delete(self.href)
+
+            if has_request_context() and session.get('user_id') == self.href:
+                logout_user()
+
+        self._resolved = resolved
+        return resolved
+
+    def is_degraded(self):
+        """
+        Return True if this user was served from the last known good cache,
+        because Stormpath was unreachable (see `STORMPATH_DEGRADED_MODE_ENABLED`).
+
+        Degraded users may be out of date, and are read-only.
+        """
+        return bool(self.__dict__.get('_degraded'))
+
+    def __setattr__(self, name, value):
+        """
+        Before a writable user rebuilt from a snapshot is first modified, fetch
+        its account (see :meth:`_refetch`).
+        """
+        if not name.startswith('_') and self.__dict__.get('_refetch'):
+            self._refetch()
+
+        super(User, self).__setattr__(name, value)
+
+    def _refetch(self):
         """
-        return True
+        Replace this user's (possibly stale) snapshot fields with a fresh copy
+        of its account, if it was rebuilt from a snapshot (see
+        :meth:`from_snapshot`).
+
+        This way, saving a user rebuilt from the shared user cache never writes
+        stale fields (like `status`) back to Stormpath.
+        """
+        if not self.__dict__.pop('_refetch', False):
+            return
+
+        def fetch():
+            account = current_app.stormpath_manager.client.accounts.get(self.href, expand=get_user_expansion())
+            account._ensure_data()
+
+            return account
+
+        try:
+            account = read_stormpath('load_user', fetch)
+        except Exception:
+            self.__dict__['_refetch'] = True
+            raise
+
+        self.__dict__.update(account.__dict__)
 
     def save(self):
         """
         Send signal after user is updated.
         """
-        return_value = super(User, self).save()
+        self._ensure_writable()
+        self._refetch()
+        return_value = call_stormpath(get_update_operation(), super(User, self).save)
         user_updated.send(self, user=self)
         return return_value
 
@@ -65,10 +211,103 @@ class User(Account):
         """
         Send signal after user is deleted.
         """
-        return_value = super(User, self).delete()
+        self._ensure_writable()
+        return_value = call_stormpath(get_update_operation(), super(User, self).delete)
         user_deleted.send(self, user=self)
         return return_value
 
+    def get_group_hrefs(self):
+        """
+        Return a set of the hrefs of every Group this user is a member of.
+
+        If this user was restored from a snapshot (or an access token), the
+        snapshot's Group hrefs are used.  Otherwise, this requires a single
+        Stormpath API call (to list the user's groups), which is shared by any
+        concurrent lookups for the same user.
+        """
+        hrefs = self.__dict__.get('_group_hrefs')
+        if hrefs is not None:
+            return hrefs
+
+        return current_app.stormpath_manager.single_flight.do(
+            ('groups', self.href),
+            read_stormpath,
+            'load_user',
+            lambda: frozenset(group.href for group in self.groups),
+        )
+
+    def has_groups(self, groups, all=True):
+        """
+        Check whether this user is a member of the given Groups.
+
+        Group names are resolved to hrefs using the application's Group catalog,
+        and compared against this user's Group hrefs (which are only fetched
+        once per request).  Outside of an app context, this falls back to the
+        Stormpath SDK's own (uncached) check.
+
+        :param list groups: A list of Groups (Group objects, names, or hrefs).
+        :param bool all: (optional) Should we ensure the user is a member of
+            every group listed?  Default: True.  If this is set to False, we'll
+            return True if the user is a member of at least one group.
+        """
+        if not has_app_context():
+            return super(User, self).has_groups(groups, all=all)
+
+        return current_app.stormpath_group_catalog.check(normalize_groups(groups), get_group_hrefs(self), all=all)
+
+    def _ensure_writable(self):
+        """
+        Ensure this user can be modified.
+
+        :raises: ReadOnlyUserError if this user was restored from a session
+            snapshot.
+        """
+        if self.__dict__.get('_read_only'):
+            raise ReadOnlyUserError('This user was restored from a session snapshot and is read-only.')
+
+    def to_snapshot(self):
+        """
+        Return a compact snapshot of this user's core fields.
+
+        This is a plain dict (safe to serialize) which can later be turned back
+        into a User with :meth:`from_snapshot`.
+        """
+        snapshot = dict((field, getattr(self, field)) for field in SNAPSHOT_FIELDS)
+        snapshot['modified_at'] = text_type(self.modified_at.isoformat()) if self.modified_at else None
+        snapshot['groups'] = sorted(get_group_hrefs(self))
+
+        return snapshot
+
+    @classmethod
+    def from_snapshot(self, snapshot, read_only=True):
+        """
+        Create a new User from a snapshot created by :meth:`to_snapshot`.
+
+        No Stormpath API calls are made, unless a field which isn't part of the
+        snapshot (like `custom_data`) is accessed.  Partial snapshots (like the
+        claims of an access token) are supported.
+
+        :param dict snapshot: The user snapshot.
+        :param bool read_only: (optional) Whether the User should be read-only
+            (the default).  A writable User fetches its account from Stormpath
+            before it's first modified (or saved), so stale snapshot fields are
+            never written back.
+        """
+        href = snapshot['href']
+        properties = dict((SNAPSHOT_FIELDS[field], snapshot[field]) for field in SNAPSHOT_FIELDS if field in snapshot)
+        if 'modified_at' in snapshot:
+            properties['modifiedAt'] = snapshot['modified_at']
+
+        properties['groups'] = {'href': href + '/groups'}
+        properties['customData'] = {'href': href + '/customData'}
+
+        _user = User(current_app.stormpath_manager.client, properties=properties)
+        _user._group_hrefs = frozenset(snapshot.get('groups', []))
+        _user._read_only = read_only
+        _user._refetch = not read_only
+
+        return _user
+
     @classmethod
     def create(self, email, password, given_name, surname, username=None, middle_name=None, custom_data=None, status='ENABLED'):
         """
@@ -98,7 +337,7 @@ class User(Account):
         If something goes wrong we'll raise an exception -- most likely -- a
         `StormpathError` (flask.ext.stormpath.StormpathError).
         """
-        _user = current_app.stormpath_manager.application.accounts.create({
+        _user = call_stormpath('registration', current_app.stormpath_manager.application.accounts.create, {
             'email': email,
             'password': password,
             'given_name': given_name,
@@ -122,11 +361,45 @@ class User(Account):
         If something goes wrong, this will raise an exception -- most likely --
         a `StormpathError` (flask.ext.stormpath.StormpathError).
         """
-        _user = current_app.stormpath_manager.application.authenticate_account(login, password).account
+        _user = call_stormpath(
+            'login',
+            current_app.stormpath_manager.application.authenticate_account,
+            login,
+            password,
+            expand = get_user_expansion(),
+        ).account
         _user.__class__ = User
 
         return _user
 
+    @classmethod
+    def _from_provider_account(self, account):
+        """
+        Turn an account returned by a social login provider into a User.
+
+        Since we can't ask Stormpath to expand properties when retrieving a
+        provider account, we'll re-fetch the account with the configured
+        expansion (if there is one) -- this is a single API call, which we'd
+        otherwise make anyway the first time a field is read.
+        """
+        expansion = get_user_expansion()
+        if expansion is not None:
+            href = account.href
+
+            # Accounts are fetched lazily, so we force the fetch here, where
+            # it's protected (and retried).
+            def fetch():
+                account = current_app.stormpath_manager.client.accounts.get(href, expand=expansion)
+                account._ensure_data()
+
+                return account
+
+            account = read_stormpath('login', fetch)
+
+        account.__class__ = User
+
+        return account
+
     @classmethod
     def from_google(self, code):
         """
@@ -138,13 +411,14 @@ class User(Account):
         If something goes wrong, this will raise an exception -- most likely --
         a `StormpathError` (flask.ext.stormpath.StormpathError).
         """
-        _user = current_app.stormpath_manager.application.get_provider_account(
+        _user = call_stormpath(
+            'login',
+            current_app.stormpath_manager.application.get_provider_account,
             code = code,
             provider = Provider.GOOGLE,
         )
-        _user.__class__ = User
 
-        return _user
+        return self._from_provider_account(_user)
 
     @classmethod
     def from_facebook(self, access_token):
@@ -157,10 +431,11 @@ class User(Account):
         If something goes wrong, this will raise an exception -- most likely --
         a `StormpathError` (flask.ext.stormpath.StormpathError).
         """
-        _user = current_app.stormpath_manager.application.get_provider_account(
+        _user = call_stormpath(
+            'login',
+            current_app.stormpath_manager.application.get_provider_account,
             access_token = access_token,
             provider = Provider.FACEBOOK,
         )
-        _user.__class__ = User
 
-        return _user
+        return self._from_provider_account(_user)
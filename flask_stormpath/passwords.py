@@ -0,0 +1,251 @@
+"""Helpers for validating passwords locally, against a Directory's password policy."""
+
+
+from string import ascii_lowercase, ascii_uppercase, digits
+from threading import Lock
+from time import time
+
+from flask import current_app
+
+from .resilience import read_stormpath
+
+
+# How long (in seconds) we wait before trying to load the password policy
+# again, after failing to load it.
+RETRY_INTERVAL = 30
+
+# The password strength rules we enforce, with the attribute of a Stormpath
+# PasswordStrength resource each one comes from.
+RULES = (
+    'min_length',
+    'max_length',
+    'min_lower_case',
+    'min_upper_case',
+    'min_numeric',
+    'min_symbol',
+    'min_diacritic',
+)
+
+
+def count_characters(password):
+    """
+    Count the lowercase, uppercase, numeric, symbol, and diacritic characters
+    in a password.
+
+    Since local checks must never reject a password Stormpath would accept,
+    characters are counted generously: non-ASCII letters count as diacritics
+    (and as lowercase or uppercase characters), and every other character
+    which isn't an ASCII letter or digit (including whitespace) counts as a
+    symbol.
+
+    :param str password: The password.
+    :rtype: dict
+    """
+    counts = dict.fromkeys(('lower_case', 'upper_case', 'numeric', 'symbol', 'diacritic'), 0)
+
+    for char in password:
+        if char in ascii_lowercase:
+            counts['lower_case'] += 1
+        elif char in ascii_uppercase:
+            counts['upper_case'] += 1
+        elif char in digits:
+            counts['numeric'] += 1
+        elif char.isalpha():
+            counts['diacritic'] += 1
+
+            if char.islower():
+                counts['lower_case'] += 1
+            elif char.isupper():
+                counts['upper_case'] += 1
+        else:
+            counts['symbol'] += 1
+
+    return counts
+
+
+def read_rules(directory):
+    """
+    Return the password strength rules of a Directory (see `RULES`).
+
+    :param obj directory: The Stormpath Directory.
+    :rtype: dict
+    """
+    strength = directory.password_policy.strength
+    return dict((rule, getattr(strength, rule, None)) for rule in RULES)
+
+
+def check_password(password, rules):
+    """
+    Return a list of the ways a password breaks the given password strength
+    rules (an empty list if it's valid).
+
+    The messages match the ones Stormpath returns, so users see the same
+    errors whether a password is rejected locally or by Stormpath.
+
+    :param str password: The password.
+    :param dict rules: The password strength rules (see `RULES`).
+    :rtype: list
+    """
+    errors = []
+
+    if rules.get('min_length') and len(password) < rules['min_length']:
+        errors.append('Account password minimum length not satisfied.')
+
+    if rules.get('max_length') and len(password) > rules['max_length']:
+        errors.append('Account password maximum length exceeded.')
+
+    counts = count_characters(password)
+    for kind, name in (
+        ('lower_case', 'lowercase character'),
+        ('upper_case', 'uppercase character'),
+        ('numeric', 'numeric character'),
+        ('symbol', 'symbol'),
+        ('diacritic', 'diacritic character'),
+    ):
+        required = rules.get('min_' + kind) or 0
+        if counts[kind] < required:
+            errors.append('Password requires at least %d %s%s.' % (required, name, '' if required == 1 else 's'))
+
+    return errors
+
+
+class PasswordPolicy(object):
+    """
+    The password strength policy of the application's default account store
+    (a Directory), and of any other Directory whose accounts change their
+    passwords.
+
+    Each policy is loaded lazily (the first time it's used), and reloaded once
+    it is older than its TTL, or after :meth:`refresh` is called.  This lets
+    us reject weak passwords locally, instead of finding out from a failed
+    Stormpath API call.
+
+    Local validation is only an optimization -- Stormpath still enforces the
+    policy itself.  So if the policy can't be loaded, passwords are let
+    through (or checked against the last policy we loaded).
+    """
+    def __init__(self, ttl=3600):
+        """
+        Initialize this policy.
+
+        :param int ttl: (optional) How long (in seconds) the policy is valid
+            for before being reloaded.
+        """
+        self.ttl = ttl
+        self.rules = {}
+        self._loaded_at = None
+        self._directories = {}
+        self._lock = Lock()
+
+    def refresh(self):
+        """Force every policy to be reloaded the next time it is used."""
+        with self._lock:
+            self._loaded_at = None
+            self._directories = {}
+
+    def load(self, application):
+        """
+        Load the password policy of the given Application's default account
+        store.
+
+        :param obj application: The Stormpath Application.
+        """
+        rules = {}
+
+        mapping = application.default_account_store_mapping
+        if mapping is not None:
+
+            # If the default account store is a Group, its Directory's policy
+            # applies.
+            store = mapping.account_store
+            rules = read_rules(getattr(store, 'directory', store))
+
+        with self._lock:
+            self.rules = rules
+            self._loaded_at = time()
+
+    def ensure_loaded(self):
+        """
+        Load the policy if it hasn't been loaded yet, or is older than its
+        TTL.
+
+        Concurrent loads share a single Stormpath API call.
+        """
+        loaded_at = self._loaded_at
+        if loaded_at is not None and time() - loaded_at < self.ttl:
+            return
+
+        manager = current_app.stormpath_manager
+
+        try:
+            application = manager.application
+            manager.single_flight.do(('password-policy', application.href), read_stormpath, 'application', self.load, application)
+
+        # Whatever went wrong, Stormpath will still check passwords itself, so
+        # we'll keep using the policy we have, and try again later.
+        except Exception:
+            with self._lock:
+                self._loaded_at = time() - self.ttl + RETRY_INTERVAL
+
+    def load_directory(self, directory):
+        """
+        Load the password policy of the given Directory.
+
+        :param obj directory: The Stormpath Directory.
+        """
+        rules = read_rules(directory)
+
+        with self._lock:
+            self._directories[directory.href] = (rules, time())
+
+    def account_rules(self, account):
+        """
+        Return the password strength rules of the given Account's Directory,
+        loading them if they haven't been loaded yet, or are older than our
+        TTL.
+
+        Concurrent loads share a single Stormpath API call.  If the rules can't
+        be loaded, the last ones we loaded are returned (or no rules at all).
+
+        :param obj account: The Stormpath Account.
+        :rtype: dict
+        """
+        try:
+            directory = read_stormpath('password', getattr, account, 'directory')
+        except Exception:
+            return {}
+
+        href = directory.href
+        rules, loaded_at = self._directories.get(href, ({}, None))
+        if loaded_at is not None and time() - loaded_at < self.ttl:
+            return rules
+
+        manager = current_app.stormpath_manager
+
+        try:
+            manager.single_flight.do(('password-policy', href), read_stormpath, 'application', self.load_directory, directory)
+
+        # Whatever went wrong, Stormpath will still check passwords itself, so
+        # we'll keep using the rules we have, and try again later.
+        except Exception:
+            with self._lock:
+                self._directories[href] = (rules, time() - self.ttl + RETRY_INTERVAL)
+
+        return self._directories.get(href, (rules, None))[0]
+
+    def check(self, password, account=None):
+        """
+        Return a list of the ways a password breaks this policy (an empty list
+        if it's valid).
+
+        :param str password: The password.
+        :param obj account: (optional) The Stormpath Account whose password
+            this is, if it already exists.  Its own Directory's policy is
+            checked, rather than the default account store's.
+        :rtype: list
+        """
+        if account is not None:
+            return check_password(password, self.account_rules(account))
+
+        self.ensure_loaded()
+        return check_password(password, self.rules)
@@ -0,0 +1,231 @@
+"""
+Rate limiting helpers, used to reject abusive login and password reset
+attempts locally, without making a Stormpath API call.
+
+Limits are enforced with the generic cell rate algorithm (GCRA), which behaves
+exactly like a token bucket (allowing bursts of up to `rate` requests, refilled
+evenly over `period`), but only needs to store a single timestamp per key: the
+"theoretical arrival time" of the next request.
+"""
+
+
+from collections import OrderedDict
+from struct import pack, unpack
+from threading import Lock
+from time import time
+
+from flask import current_app, request
+
+from .errors import RateLimitExceededError
+
+
+# How many times we try to update a key in a shared store, when other processes
+# keep updating it at the same time.
+UPDATE_ATTEMPTS = 10
+
+# How many locks we spread keys over, to serialize updates of the same key
+# within a process.
+KEY_LOCKS = 64
+
+
+class RateLimiter(object):
+    """
+    A token bucket rate limiter, keyed by an arbitrary string (a client IP
+    address, or a login).
+
+    By default, state is kept in memory (in a bounded LRU dict of one float per
+    key), so limits apply per process.  If a store is given (a
+    :class:`~flask_stormpath.cache.MemoryStore`,
+    :class:`~flask_stormpath.cache.RedisStore`, or anything with the same
+    interface), state is kept there instead, so limits are shared by every
+    process using the same store.  Updates of a key are serialized within each
+    process, and if the store has a `compare_and_set` method (like both of
+    ours), they're atomic across processes too -- otherwise, concurrent
+    requests on different servers may both be let through.  Store failures
+    let requests through rather than locking everyone out.
+    """
+    def __init__(self, rate, period, store=None, max_keys=100000, prefix=''):
+        """
+        Initialize this rate limiter.
+
+        :param int rate: How many requests are allowed per `period`.
+        :param float period: The period (in seconds).
+        :param obj store: (optional) A shared store to keep state in.
+        :param int max_keys: (optional) The maximum number of keys kept in
+            memory (when no store is given).  The least recently used keys are
+            dropped first.
+        :param str prefix: (optional) A prefix for all of our keys.
+        """
+        self.rate = rate
+        self.period = period
+        self.store = store
+        self.max_keys = max_keys
+        self.prefix = prefix
+
+        self.interval = float(period) / rate
+
+        self._arrivals = OrderedDict()
+        self._allowed = 0
+        self._limited = 0
+        self._errors = 0
+        self._lock = Lock()
+        self._key_locks = [Lock() for i in range(KEY_LOCKS)]
+
+    @property
+    def stats(self):
+        """Return the number of requests allowed and limited."""
+        with self._lock:
+            return {
+                'allowed': self._allowed,
+                'limited': self._limited,
+                'errors': self._errors,
+                'keys': len(self._arrivals),
+            }
+
+    def _admit(self, arrival, now):
+        """
+        Return the next theoretical arrival time for a key, given its current
+        one (or None).
+
+        :raises: RateLimitExceededError if the key is over its limit.
+        """
+        arrival = max(arrival or now, now) + self.interval
+
+        if arrival - now > self.period:
+            raise RateLimitExceededError(
+                'Too many requests.  Please try again later.',
+                retry_after = arrival - now - self.period,
+            )
+
+        return arrival
+
+    def _load(self, key):
+        """
+        Return the data kept in our store for `key`, and the theoretical
+        arrival time it holds (either may be None).
+        """
+        try:
+            data = self.store.get(self.prefix + key)
+            return data, unpack('!d', data)[0] if data else None
+        except Exception:
+            with self._lock:
+                self._errors += 1
+
+            return None, None
+
+    def _save(self, key, data, arrival, now):
+        """
+        Keep the theoretical arrival time for `key` in our store, if the store
+        still holds `data` for it.
+
+        :returns: False if another process changed `key` first.
+        """
+        compare_and_set = getattr(self.store, 'compare_and_set', None)
+
+        try:
+            if compare_and_set is not None:
+                return compare_and_set(self.prefix + key, data, pack('!d', arrival), arrival - now)
+
+            self.store.set(self.prefix + key, pack('!d', arrival), arrival - now)
+        except Exception:
+            with self._lock:
+                self._errors += 1
+
+        return True
+
+    def _hit_store(self, key, now):
+        """
+        Record a request for `key` in our store.
+
+        :raises: RateLimitExceededError if `key` is over its limit.
+        """
+        with self._key_locks[hash(key) % KEY_LOCKS]:
+            for i in range(UPDATE_ATTEMPTS):
+                data, arrival = self._load(key)
+                if self._save(key, data, self._admit(arrival, now), now):
+                    return
+
+        # We lost every race for this key, so we'll treat it like any other
+        # store failure, and let the request through.
+        with self._lock:
+            self._errors += 1
+
+    def hit(self, key):
+        """
+        Record a request for `key`.
+
+        :param str key: The key (a client IP address, or a login).
+        :raises: RateLimitExceededError if `key` is over its limit.
+        """
+        now = time()
+
+        try:
+            if self.store is not None:
+                self._hit_store(key, now)
+
+            else:
+                with self._lock:
+                    arrival = self._admit(self._arrivals.get(key), now)
+
+                    # Move the key to the end, so the least recently used keys
+                    # are dropped first.
+                    self._arrivals.pop(key, None)
+                    self._arrivals[key] = arrival
+
+                    while len(self._arrivals) > self.max_keys:
+                        self._arrivals.popitem(last=False)
+        except RateLimitExceededError:
+            with self._lock:
+                self._limited += 1
+
+            raise
+
+        with self._lock:
+            self._allowed += 1
+
+
+def get_client_ip():
+    """
+    Return the current client's IP address.
+
+    If the app runs behind `STORMPATH_RATE_LIMIT_TRUSTED_PROXIES` proxies (or
+    load balancers), this is the address the outermost of them saw, taken
+    from the `X-Forwarded-For` header.  Addresses to its left were sent by the
+    client itself, so they can't be trusted.
+    """
+    proxies = current_app.config['STORMPATH_RATE_LIMIT_TRUSTED_PROXIES']
+    if proxies:
+        forwarded = [address.strip() for address in request.headers.get('X-Forwarded-For', '').split(',')]
+        forwarded = [address for address in forwarded if address]
+
+        if forwarded:
+            return forwarded[-min(proxies, len(forwarded))]
+
+    return request.remote_addr
+
+
+def normalize_login(login):
+    """Return a canonical form of a login (email or username) to limit by."""
+    return login.strip().lower()
+
+
+def check_rate_limits(login=None):
+    """
+    Ensure the current client (and the given login) haven't gone over their
+    rate limits (`STORMPATH_RATE_LIMIT_BY_IP` and `STORMPATH_RATE_LIMIT_BY_LOGIN`).
+
+    This should be called before making any Stormpath calls on a client's
+    behalf.
+
+    :param str login: (optional) The submitted login (email or username).
+    :raises: RateLimitExceededError if a limit was exceeded.
+    """
+    ip_limiter = current_app.stormpath_ip_rate_limiter
+    if ip_limiter is not None:
+        ip = get_client_ip()
+        if ip:
+            ip_limiter.hit(ip)
+
+    login_limiter = current_app.stormpath_login_rate_limiter
+    if login_limiter is not None and login:
+        login_limiter.hit(normalize_login(login))
@@ -0,0 +1,789 @@
+"""
+Helpers which keep our app responsive when Stormpath is slow or unavailable.
+
+Every outbound Stormpath call made by this extension goes through
+:func:`call_stormpath`, which applies:
+
+- A :class:`Bulkhead`, which caps how many calls of each operation type (login,
+  load_user, registration, update, ...) may be in flight at once, so a backlog
+  of one kind of call can't tie up every thread.
+- An :class:`~flask_stormpath.concurrency.AdaptiveLimiter`, which caps how
+  many calls (of any type) may be in flight at once, adapting the cap to
+  Stormpath's observed latency.  Queued calls are let through by priority
+  class (see :func:`get_priority`), so interactive logins aren't stuck behind
+  background refreshes or bulk jobs.
+- A :class:`CircuitBreaker`, which stops calling Stormpath altogether once too
+  many calls fail (or are too slow), and periodically lets a probe call through
+  to check whether Stormpath has recovered.
+
+Calls which are rejected fail immediately with a
+:class:`~flask_stormpath.errors.StormpathUnavailableError`.
+
+In front of all of this, a :class:`LoadShedder` can reject new authentication
+requests outright (before any work is done on them) once too many are in
+flight.
+
+Idempotent reads (account, application, and group fetches) go through
+:func:`read_stormpath` instead, which can also retry transient failures (see
+:class:`RetryPolicy`), and hedge slow calls (see :class:`Hedger`).  Mutations
+are never retried.
+"""
+
+
+from collections import deque
+from contextlib import contextmanager
+from random import uniform
+from sys import exc_info
+from threading import Condition, Lock, Thread
+from time import sleep, time
+
+from flask import _app_ctx_stack as stack, current_app
+from six import reraise
+from six.moves import queue
+from stormpath.error import Error as StormpathError
+
+from .concurrency import PRIORITY_BULK, PRIORITY_INTERACTIVE
+from .deadlines import call_within_deadline, check_deadline, get_deadline, remaining_time, set_deadline
+from .errors import BulkheadFullError, CircuitOpenError, DeadlineExceededError, OverloadedError, StormpathUnavailableError
+from .signals import circuit_closed, circuit_half_opened, circuit_opened
+
+
+# The priority class of each operation type, unless overridden with
+# :func:`stormpath_priority`.
+OPERATION_PRIORITIES = {
+    'login': PRIORITY_INTERACTIVE,
+    'load_user': PRIORITY_INTERACTIVE,
+    'registration': PRIORITY_INTERACTIVE,
+    'password': PRIORITY_INTERACTIVE,
+    'update': PRIORITY_INTERACTIVE,
+    'application': PRIORITY_INTERACTIVE,
+    'admin': PRIORITY_BULK,
+}
+
+
+def is_failure(error):
+    """
+    Return True if the given exception means Stormpath itself is failing
+    (rather than, say, the user entering the wrong password).
+
+    Network errors, timeouts, rate limiting, and server errors are failures.
+
+    :param obj error: The exception.
+    """
+    if isinstance(error, StormpathError):
+        return error.status is None or error.status == 429 or error.status >= 500
+
+    # Socket errors, and `requests` connection errors / timeouts, are all
+    # IOErrors.
+    return isinstance(error, IOError)
+
+
+class CircuitBreaker(object):
+    """
+    A circuit breaker for Stormpath calls.
+
+    The breaker starts out closed (calls go through as usual).  Once at least
+    `min_calls` of the last `window` calls were made, and the share of them
+    which failed (or took longer than `slow_call_duration`) reaches
+    `failure_rate`, the breaker opens: every call is rejected immediately.
+
+    After `reset_timeout` seconds, the breaker becomes half-open, and lets
+    `half_open_calls` probe calls through.  If they all succeed, the breaker
+    closes again; if any fail, it re-opens.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_rate=0.5, slow_call_duration=None, min_calls=10, window=50, reset_timeout=30, half_open_calls=1):
+        """
+        Initialize this circuit breaker.
+
+        :param float failure_rate: (optional) The share of failed calls (0 - 1)
+            which opens the breaker.
+        :param float slow_call_duration: (optional) Calls slower than this many
+            seconds count as failures.
+        :param int min_calls: (optional) The minimum number of calls needed
+            before the breaker can open.
+        :param int window: (optional) How many recent calls are considered.
+        :param float reset_timeout: (optional) How long (in seconds) the
+            breaker stays open before letting probe calls through.
+        :param int half_open_calls: (optional) How many probe calls must
+            succeed to close the breaker.
+        """
+        self.failure_rate = failure_rate
+        self.slow_call_duration = slow_call_duration
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+
+        self.state = self.CLOSED
+        self._calls = deque(maxlen=window)
+        self._opened_at = None
+        self._probes = 0
+        self._probe_successes = 0
+        self._rejected = 0
+        self._lock = Lock()
+
+    def _transition(self, state):
+        """Change state (the lock must be held), and return the new state."""
+        self.state = state
+        self._calls.clear()
+        self._probes = 0
+        self._probe_successes = 0
+
+        if state == self.OPEN:
+            self._opened_at = time()
+
+        return state
+
+    def _notify(self, state):
+        """Send the signal for a state change (the lock must not be held)."""
+        if state == self.OPEN:
+            circuit_opened.send(self)
+        elif state == self.HALF_OPEN:
+            circuit_half_opened.send(self)
+        elif state == self.CLOSED:
+            circuit_closed.send(self)
+
+    @property
+    def retry_after(self):
+        """Return how long (in seconds) until the breaker lets calls through."""
+        if self.state != self.OPEN:
+            return 0
+
+        return max(0, self.reset_timeout - (time() - self._opened_at))
+
+    def before_call(self):
+        """
+        Check whether a call may go through.
+
+        :raises: CircuitOpenError if the call is rejected.
+        """
+        changed = None
+
+        with self._lock:
+            if self.state == self.OPEN and time() - self._opened_at >= self.reset_timeout:
+                changed = self._transition(self.HALF_OPEN)
+
+            if self.state == self.OPEN or (self.state == self.HALF_OPEN and self._probes >= self.half_open_calls):
+                self._rejected += 1
+                rejected = True
+            else:
+                rejected = False
+                if self.state == self.HALF_OPEN:
+                    self._probes += 1
+
+        if changed:
+            self._notify(changed)
+
+        if rejected:
+            raise CircuitOpenError('Stormpath is unavailable (the circuit breaker is open).', retry_after=self.retry_after or self.reset_timeout)
+
+    def record(self, failed, duration):
+        """
+        Record the outcome of a call.
+
+        :param bool failed: Whether the call failed.
+        :param float duration: How long (in seconds) the call took.
+        """
+        if self.slow_call_duration is not None and duration >= self.slow_call_duration:
+            failed = True
+
+        changed = None
+
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                if failed:
+                    changed = self._transition(self.OPEN)
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.half_open_calls:
+                        changed = self._transition(self.CLOSED)
+
+            elif self.state == self.CLOSED:
+                self._calls.append(failed)
+
+                calls = len(self._calls)
+                if calls >= self.min_calls and float(sum(self._calls)) / calls >= self.failure_rate:
+                    changed = self._transition(self.OPEN)
+
+        if changed:
+            self._notify(changed)
+
+    def release(self):
+        """
+        Give back the slot of a call which was let through, but whose outcome
+        won't be recorded.
+
+        If the breaker is half-open, this lets another probe call through.
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call `func(*args, **kwargs)` through this breaker.
+
+        :raises: CircuitOpenError if the call is rejected.
+        """
+        self.before_call()
+        start = time()
+
+        # If the current request's deadline has already passed, the call
+        # never reaches Stormpath, so it says nothing about Stormpath's health
+        # and isn't recorded at all.
+        remaining = remaining_time()
+        if remaining is not None and remaining <= 0:
+            self.release()
+            raise DeadlineExceededError('The request deadline was exceeded.')
+
+        try:
+            result = func(*args, **kwargs)
+
+        # Otherwise, the call used up the rest of the request's budget, which
+        # makes it a slow call -- and a failure.
+        except DeadlineExceededError:
+            self.record(True, time() - start)
+            raise
+
+        except Exception as err:
+            self.record(is_failure(err), time() - start)
+            raise
+
+        self.record(False, time() - start)
+        return result
+
+    @property
+    def stats(self):
+        """Return the breaker's state, and recent failure statistics."""
+        with self._lock:
+            calls = len(self._calls)
+            return {
+                'state': self.state,
+                'calls': calls,
+                'failures': sum(self._calls),
+                'failure_rate': float(sum(self._calls)) / calls if calls else 0.0,
+                'rejected': self._rejected,
+            }
+
+
+class Bulkhead(object):
+    """
+    Cap the number of concurrent Stormpath calls, per operation type.
+
+    Calls beyond an operation's limit are rejected immediately (rather than
+    queued), so no single kind of call can tie up every thread.
+    """
+    def __init__(self, limits=None):
+        """
+        Initialize this bulkhead.
+
+        :param dict limits: (optional) A dict mapping operation types to their
+            maximum number of concurrent calls.  Operations without a limit are
+            never rejected.
+        """
+        self.limits = dict(limits or {})
+        self._active = {}
+        self._rejected = {}
+        self._lock = Lock()
+
+    def acquire(self, operation):
+        """
+        Reserve a slot for a call.
+
+        :param str operation: The operation type.
+        :raises: BulkheadFullError if the operation is at its limit.
+        """
+        limit = self.limits.get(operation)
+
+        with self._lock:
+            active = self._active.get(operation, 0)
+            if limit is not None and active >= limit:
+                self._rejected[operation] = self._rejected.get(operation, 0) + 1
+                raise BulkheadFullError('Too many concurrent %r calls to Stormpath.' % operation, retry_after=1)
+
+            self._active[operation] = active + 1
+
+    def release(self, operation):
+        """
+        Release a slot reserved by :meth:`acquire`.
+
+        :param str operation: The operation type.
+        """
+        with self._lock:
+            self._active[operation] -= 1
+
+    @property
+    def stats(self):
+        """Return the number of active (and rejected) calls per operation."""
+        with self._lock:
+            return {
+                'active': dict(self._active),
+                'rejected': dict(self._rejected),
+            }
+
+
+class LoadShedder(object):
+    """
+    Shed authentication requests (logins, registrations, and password resets)
+    once too many are in flight.
+
+    Requests are shed when this process is already handling `max_in_flight`
+    of them, or (if an adaptive concurrency limiter is given) when
+    `max_queued` Stormpath calls are already waiting for a slot.  Shed
+    requests are rejected immediately, before any form parsing or Stormpath
+    calls -- so a spike can't pile up work we'd never finish in time anyway.
+    """
+    def __init__(self, max_in_flight=20, max_queued=None, retry_after=1, limiter=None):
+        """
+        Initialize this load shedder.
+
+        :param int max_in_flight: (optional) The maximum number of requests in
+            flight at once.
+        :param int max_queued: (optional) The maximum number of Stormpath
+            calls which may be waiting for a slot in `limiter`.
+        :param float retry_after: (optional) How long (in seconds) shed
+            clients should wait before trying again.
+        :param obj limiter: (optional) The app's
+            :class:`~flask_stormpath.concurrency.AdaptiveLimiter`.
+        """
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.retry_after = retry_after
+        self.limiter = limiter
+
+        self._in_flight = 0
+        self._accepted = 0
+        self._shed = 0
+        self._lock = Lock()
+
+    def enter(self):
+        """
+        Start handling a request.
+
+        :raises: OverloadedError if the request is shed.
+        """
+        queued = self.limiter.stats['queued'] if self.limiter is not None and self.max_queued is not None else 0
+
+        with self._lock:
+            if self._in_flight >= self.max_in_flight or (self.max_queued is not None and queued >= self.max_queued):
+                self._shed += 1
+                raise OverloadedError('Too many authentication requests in flight.', retry_after=self.retry_after)
+
+            self._in_flight += 1
+            self._accepted += 1
+
+    def exit(self):
+        """Finish handling a request started with :meth:`enter`."""
+        with self._lock:
+            self._in_flight -= 1
+
+    @property
+    def stats(self):
+        """Return the number of requests in flight, accepted, and shed."""
+        with self._lock:
+            return {
+                'in_flight': self._in_flight,
+                'accepted': self._accepted,
+                'shed': self._shed,
+            }
+
+
+@contextmanager
+def stormpath_priority(priority):
+    """
+    Give every Stormpath call made within this block the given priority class
+    (see :class:`~flask_stormpath.concurrency.AdaptiveLimiter`).
+
+    Usage::
+
+        with stormpath_priority(PRIORITY_BULK):
+            for email in emails:
+                User.create(email=email, password=password)
+
+    :param str priority: The priority class ('interactive', 'refresh', or
+        'bulk').
+    """
+    ctx = stack.top
+    previous = getattr(ctx, 'stormpath_priority', None)
+    ctx.stormpath_priority = priority
+
+    try:
+        yield
+    finally:
+        ctx.stormpath_priority = previous
+
+
+def get_priority(operation):
+    """
+    Return the priority class of a Stormpath call.
+
+    This is the priority set with :func:`stormpath_priority` (if any), or else
+    the priority of the operation type (see `OPERATION_PRIORITIES`).
+
+    :param str operation: The operation type.
+    """
+    ctx = stack.top
+    priority = getattr(ctx, 'stormpath_priority', None) if ctx is not None else None
+
+    return priority or OPERATION_PRIORITIES.get(operation, PRIORITY_INTERACTIVE)
+
+
+def _call_through_breaker(breaker, func, *args, **kwargs):
+    """Call `func(*args, **kwargs)` through the given breaker (if any)."""
+    if breaker is not None:
+        return breaker.call(call_within_deadline, func, *args, **kwargs)
+
+    return call_within_deadline(func, *args, **kwargs)
+
+
+def call_stormpath(operation, func, *args, **kwargs):
+    """
+    Make a Stormpath call, protected by the current app's bulkhead, adaptive
+    concurrency limiter, and circuit breaker (if they're enabled).
+
+    :param str operation: The operation type ('login', 'load_user',
+        'registration', 'password', 'update', 'application', or 'admin').
+    :param func func: The function which calls Stormpath.
+    :returns: Whatever `func` returns.
+    :raises: StormpathUnavailableError if the call is rejected, or
+        DeadlineExceededError if the request deadline passes.
+    """
+    check_deadline()
+
+    breaker = getattr(current_app, 'stormpath_circuit_breaker', None)
+    bulkhead = getattr(current_app, 'stormpath_bulkhead', None)
+    limiter = getattr(current_app, 'stormpath_concurrency_limiter', None)
+
+    if bulkhead is not None:
+        bulkhead.acquire(operation)
+
+    try:
+        if limiter is None:
+            return _call_through_breaker(breaker, func, *args, **kwargs)
+
+        priority = get_priority(operation)
+        limiter.acquire(remaining_time(), priority=priority)
+        start = time()
+
+        try:
+            result = _call_through_breaker(breaker, func, *args, **kwargs)
+        except DeadlineExceededError:
+            limiter.release(time() - start, failed=True, priority=priority, operation=operation)
+            raise
+        except StormpathUnavailableError:
+
+            # The call was rejected (by our circuit breaker) without being
+            # made, so it tells us nothing about Stormpath's latency.
+            limiter.release(priority=priority)
+            raise
+        except Exception as err:
+            limiter.release(time() - start, failed=is_failure(err), priority=priority, operation=operation)
+            raise
+
+        limiter.release(time() - start, priority=priority, operation=operation)
+        return result
+    finally:
+        if bulkhead is not None:
+            bulkhead.release(operation)
+
+
+class RetryPolicy(object):
+    """
+    Retry transient Stormpath failures (see :func:`is_failure`), with jittered
+    exponential backoff, and a total time budget.
+
+    This must only be used for idempotent calls.
+    """
+    def __init__(self, max_attempts=3, base_delay=0.1, max_delay=1, budget=3):
+        """
+        Initialize this retry policy.
+
+        :param int max_attempts: (optional) The maximum number of attempts
+            (including the first one).
+        :param float base_delay: (optional) The backoff (in seconds) before
+            the first retry.  This doubles after every retry.
+        :param float max_delay: (optional) The maximum backoff (in seconds).
+        :param float budget: (optional) The total time (in seconds) we may
+            spend on a call, including backoff.  No retry is made if it would
+            exceed this budget.
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+
+        self._retries = 0
+        self._lock = Lock()
+
+    def backoff(self, attempt):
+        """
+        Return how long (in seconds) to wait before the given retry.
+
+        We use "full jitter": a random delay between 0 and the exponential
+        backoff, so that clients which failed at the same time don't all retry
+        at the same time, too.
+
+        :param int attempt: The number of attempts made so far.
+        """
+        return uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def call(self, func, *args, **kwargs):
+        """Call `func(*args, **kwargs)`, retrying transient failures."""
+        start = time()
+        attempt = 0
+
+        while True:
+            attempt += 1
+
+            try:
+                return func(*args, **kwargs)
+            except Exception as err:
+                if not is_failure(err) or attempt >= self.max_attempts:
+                    raise
+
+                delay = self.backoff(attempt)
+                if time() - start + delay > self.budget:
+                    raise
+
+                # Don't bother retrying if we'd miss the request deadline.
+                remaining = remaining_time()
+                if remaining is not None and delay >= remaining:
+                    raise
+
+            with self._lock:
+                self._retries += 1
+
+            sleep(delay)
+
+    @property
+    def stats(self):
+        """Return the number of retries made."""
+        return {'retries': self._retries}
+
+
+class Hedger(object):
+    """
+    Hedge slow Stormpath reads.
+
+    Until enough latencies have been observed for an operation type, its
+    calls simply run on the calling thread.  After that, each call runs on a
+    worker thread, and if it takes longer than the observed latency quantile
+    (the p95, by default) of its operation type, a second, identical call (the
+    hedge) is started on another one.  Whichever call succeeds first wins, so
+    a single slow connection no longer sets the request's latency.  This must
+    only be used for idempotent calls.
+
+    Worker threads are reused between calls (and exit once they've been idle
+    for `WORKER_IDLE_TIMEOUT` seconds), so calls don't each pay for a new
+    thread.
+    """
+    # How long (in seconds) an idle worker thread waits for a new call, before
+    # it exits.
+    WORKER_IDLE_TIMEOUT = 60
+
+    def __init__(self, quantile=0.95, min_samples=20, window=100):
+        """
+        Initialize this hedger.
+
+        :param float quantile: (optional) The latency quantile (0 - 1) after
+            which a hedged call is made.
+        :param int min_samples: (optional) No calls are hedged until this many
+            latencies were observed (per operation type).
+        :param int window: (optional) How many recent latencies are kept (per
+            operation type).
+        """
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.window = window
+
+        self._latencies = {}
+        self._hedged = 0
+        self._lock = Lock()
+
+        self._tasks = deque()
+        self._idle = 0
+        self._condition = Condition(Lock())
+
+    def record(self, operation, duration):
+        """
+        Record the latency of a successful call.
+
+        :param str operation: The operation type.
+        :param float duration: How long (in seconds) the call took.
+        """
+        with self._lock:
+            latencies = self._latencies.get(operation)
+            if latencies is None:
+                latencies = self._latencies[operation] = deque(maxlen=self.window)
+
+            latencies.append(duration)
+
+    def delay(self, operation):
+        """
+        Return how long (in seconds) to wait before hedging a call (or None,
+        if we haven't seen enough calls yet).
+
+        :param str operation: The operation type.
+        """
+        with self._lock:
+            latencies = sorted(self._latencies.get(operation, ()))
+
+        if len(latencies) < self.min_samples:
+            return None
+
+        return latencies[min(len(latencies) - 1, int(len(latencies) * self.quantile))]
+
+    def call(self, operation, func, hedge=None):
+        """
+        Call `func()`, hedging it if it's slow.
+
+        :param str operation: The operation type.
+        :param func func: The function to call on the calling thread, while
+            calls aren't hedged yet.
+        :param func hedge: (optional) The function to call on worker threads,
+            if it differs from `func`.
+        :raises: DeadlineExceededError if neither call finishes before the
+            current request's deadline.
+        """
+        delay = self.delay(operation)
+
+        if delay is None:
+            start = time()
+            result = func()
+            self.record(operation, time() - start)
+
+            return result
+
+        results = queue.Queue()
+
+        def attempt():
+            start = time()
+
+            try:
+                result = (hedge or func)()
+            except Exception:
+                results.put((False, exc_info()))
+            else:
+                self.record(operation, time() - start)
+                results.put((True, result))
+
+        self._run(attempt)
+        pending = 1
+
+        try:
+            succeeded, value = results.get(timeout=delay)
+        except queue.Empty:
+            with self._lock:
+                self._hedged += 1
+
+            self._run(attempt)
+            pending += 1
+        else:
+            if succeeded:
+                return value
+
+            reraise(*value)
+
+        # Return the first call to succeed -- or, if both fail, the first
+        # failure.  Either way, we won't wait past the request's deadline.
+        error = None
+        while pending:
+            remaining = remaining_time()
+
+            try:
+                succeeded, value = results.get(timeout=max(remaining, 0) if remaining is not None else None)
+            except queue.Empty:
+                raise DeadlineExceededError('The request deadline was exceeded.')
+
+            if succeeded:
+                return value
+
+            error = error or value
+            pending -= 1
+
+        reraise(*error)
+
+    def _run(self, task):
+        """Call `task()` on an idle worker thread, or a new one."""
+        with self._condition:
+            if self._idle > len(self._tasks):
+                self._tasks.append(task)
+                self._condition.notify()
+                return
+
+        thread = Thread(target=self._work, args=(task,))
+        thread.daemon = True
+        thread.start()
+
+    def _work(self, task):
+        """Call `task()`, then any tasks queued for us, until we're idle for too long."""
+        while True:
+            task()
+
+            with self._condition:
+                self._idle += 1
+                idle_since = time()
+
+                while not self._tasks:
+                    timeout = self.WORKER_IDLE_TIMEOUT - (time() - idle_since)
+                    if timeout <= 0:
+                        self._idle -= 1
+                        return
+
+                    self._condition.wait(timeout)
+
+                self._idle -= 1
+                task = self._tasks.popleft()
+
+    @property
+    def stats(self):
+        """Return the number of hedged calls, and current hedging delays."""
+        with self._lock:
+            operations = list(self._latencies)
+
+        return {
+            'hedged': self._hedged,
+            'delays': dict((operation, self.delay(operation)) for operation in operations),
+        }
+
+
+def read_stormpath(operation, func, *args, **kwargs):
+    """
+    Make an idempotent Stormpath read, protected by the current app's bulkhead
+    and circuit breaker (see :func:`call_stormpath`), and retried or hedged (if
+    enabled).
+
+    :param str operation: The operation type.
+    :param func func: The function which calls Stormpath.  This must be
+        idempotent.
+    :returns: Whatever `func` returns.
+    """
+    retry_policy = getattr(current_app, 'stormpath_retry_policy', None)
+    hedger = getattr(current_app, 'stormpath_hedger', None)
+
+    def attempt():
+        return call_stormpath(operation, func, *args, **kwargs)
+
+    if hedger is not None:
+        app = current_app._get_current_object()
+        deadline = get_deadline()
+        priority = get_priority(operation)
+
+        def attempt_in_thread():
+            with app.app_context(), stormpath_priority(priority):
+                if deadline is not None:
+                    set_deadline(deadline - time())
+
+                return call_stormpath(operation, func, *args, **kwargs)
+
+        hedged_attempt = lambda: hedger.call(operation, attempt, hedge=attempt_in_thread)
+    else:
+        hedged_attempt = attempt
+
+    if retry_policy is not None:
+        return retry_policy.call(hedged_attempt)
+
+    return hedged_attempt()
@@ -3,6 +3,9 @@
 
 from datetime import timedelta
 
+from six import string_types
+
+from .concurrency import DEFAULT_PRIORITY_WEIGHTS
 from .errors import ConfigurationError
 
 
@@ -20,6 +23,14 @@ def init_settings(config):
     config.setdefault('STORMPATH_API_KEY_FILE', None)
     config.setdefault('STORMPATH_APPLICATION', None)
 
+    # STORMPATH_APPLICATION can be either an Application name or href.  If it's
+    # a name, the Application is searched for by name (once per process).  To
+    # avoid repeating that search in every process, the resolved href can be
+    # persisted to a small local file.  The Application can also be resolved
+    # as soon as the extension is initialized, instead of on the first request.
+    config.setdefault('STORMPATH_APPLICATION_HREF_FILE', None)
+    config.setdefault('STORMPATH_RESOLVE_APPLICATION_ON_INIT', False)
+
     # Which fields should be displayed when registering new users?
     config.setdefault('STORMPATH_ENABLE_FACEBOOK', False)
     config.setdefault('STORMPATH_ENABLE_GOOGLE', False)
@@ -56,6 +67,7 @@ def init_settings(config):
     config.setdefault('STORMPATH_ENABLE_LOGOUT', True)
     config.setdefault('STORMPATH_ENABLE_FORGOT_PASSWORD', False)
     config.setdefault('STORMPATH_ENABLE_SETTINGS', True)
+    config.setdefault('STORMPATH_ENABLE_ACCESS_TOKENS', False)
 
     # Configure URL mappings.  These URL mappings control which URLs will be
     # used by Flask-Stormpath views.
@@ -67,13 +79,201 @@ def init_settings(config):
     config.setdefault('STORMPATH_SETTINGS_URL', '/settings')
     config.setdefault('STORMPATH_GOOGLE_LOGIN_URL', '/google')
     config.setdefault('STORMPATH_FACEBOOK_LOGIN_URL', '/facebook')
+    config.setdefault('STORMPATH_ACCESS_TOKEN_URL', '/oauth/token')
 
     # After a successful login, where should users be redirected?
     config.setdefault('STORMPATH_REDIRECT_URL', '/')
 
+    # How long should the application's Group catalog (which maps Group names
+    # to hrefs) be cached before it's reloaded?
+    config.setdefault('STORMPATH_GROUP_CATALOG_TTL', timedelta(minutes=5))
+
+    # Password policy configuration.  If enabled, the password strength policy
+    # of the application's default Directory is loaded (and reloaded after
+    # STORMPATH_PASSWORD_POLICY_TTL), and passwords submitted to the
+    # registration and password change forms are checked against it locally,
+    # before they're sent to Stormpath.
+    config.setdefault('STORMPATH_PASSWORD_POLICY_ENABLED', False)
+    config.setdefault('STORMPATH_PASSWORD_POLICY_TTL', timedelta(hours=1))
+
+    # Access token configuration.  Tokens are signed with the first secret in
+    # STORMPATH_ACCESS_TOKEN_SECRETS (or the app's SECRET_KEY, if no secrets
+    # are specified), and verified with any of them -- this makes it easy to
+    # rotate secrets.  A single secret may be given as a plain string.
+    config.setdefault('STORMPATH_ACCESS_TOKEN_TTL', timedelta(minutes=10))
+    config.setdefault('STORMPATH_ACCESS_TOKEN_SECRETS', None)
+
+    # HTTP connection configuration.  Connections to Stormpath are pooled and
+    # kept alive, so they can be reused across requests.  Unless
+    # STORMPATH_HTTP_POOL_SIZE is specified, the pool is sized from the number
+    # of threads each server process runs (STORMPATH_SERVER_THREADS).
+    config.setdefault('STORMPATH_SERVER_THREADS', None)
+    config.setdefault('STORMPATH_HTTP_POOL_SIZE', None)
+    config.setdefault('STORMPATH_HTTP_MAX_CONNECTIONS', None)
+    config.setdefault('STORMPATH_HTTP_KEEP_ALIVE', True)
+    config.setdefault('STORMPATH_HTTP_CONNECT_TIMEOUT', timedelta(seconds=5))
+    config.setdefault('STORMPATH_HTTP_READ_TIMEOUT', timedelta(seconds=30))
+
+    # Asyncio configuration (see flask_stormpath.aio).  Since the Stormpath SDK
+    # is blocking, async calls run on a bounded pool of threads -- this is the
+    # maximum number of Stormpath calls (per process) in flight at once.
+    config.setdefault('STORMPATH_ASYNC_MAX_WORKERS', 100)
+
+    # Circuit breaker configuration.  If enabled, once at least
+    # STORMPATH_CIRCUIT_BREAKER_MIN_CALLS of the last
+    # STORMPATH_CIRCUIT_BREAKER_WINDOW Stormpath calls were made, and the share
+    # of them which failed (or were slower than the slow call duration) reaches
+    # the failure rate, Stormpath calls are rejected immediately.  After the
+    # reset timeout, a few probe calls are let through to check whether
+    # Stormpath has recovered.
+    config.setdefault('STORMPATH_CIRCUIT_BREAKER_ENABLED', False)
+    config.setdefault('STORMPATH_CIRCUIT_BREAKER_FAILURE_RATE', 0.5)
+    config.setdefault('STORMPATH_CIRCUIT_BREAKER_SLOW_CALL_DURATION', timedelta(seconds=10))
+    config.setdefault('STORMPATH_CIRCUIT_BREAKER_MIN_CALLS', 10)
+    config.setdefault('STORMPATH_CIRCUIT_BREAKER_WINDOW', 50)
+    config.setdefault('STORMPATH_CIRCUIT_BREAKER_RESET_TIMEOUT', timedelta(seconds=30))
+    config.setdefault('STORMPATH_CIRCUIT_BREAKER_HALF_OPEN_CALLS', 1)
+
+    # Bulkhead configuration.  A dict mapping operation types ('login',
+    # 'load_user', 'registration', 'password', 'update', 'application', and
+    # 'admin') to the maximum number of concurrent Stormpath calls of that
+    # type, per process.
+    config.setdefault('STORMPATH_BULKHEAD_LIMITS', None)
+
+    # Adaptive concurrency limit configuration.  If enabled, the number of
+    # concurrent Stormpath calls (per process) is capped.  The cap grows
+    # while latency stays healthy, and shrinks (multiplicatively, by
+    # STORMPATH_CONCURRENCY_LIMIT_BACKOFF) when calls fail, or get slower than
+    # STORMPATH_CONCURRENCY_LIMIT_LATENCY_TOLERANCE times the best recent
+    # latency of their operation type.  Calls beyond the cap wait in a bounded
+    # queue, or are rejected.
+    config.setdefault('STORMPATH_CONCURRENCY_LIMIT_ENABLED', False)
+    config.setdefault('STORMPATH_CONCURRENCY_LIMIT_INITIAL', 20)
+    config.setdefault('STORMPATH_CONCURRENCY_LIMIT_MIN', 1)
+    config.setdefault('STORMPATH_CONCURRENCY_LIMIT_MAX', 200)
+    config.setdefault('STORMPATH_CONCURRENCY_LIMIT_LATENCY_TOLERANCE', 2.0)
+    config.setdefault('STORMPATH_CONCURRENCY_LIMIT_BACKOFF', 0.9)
+    config.setdefault('STORMPATH_CONCURRENCY_LIMIT_QUEUE_SIZE', 50)
+    config.setdefault('STORMPATH_CONCURRENCY_LIMIT_QUEUE_TIMEOUT', timedelta(milliseconds=500))
+
+    # Priority class configuration (used by the adaptive concurrency limit).
+    # Every Stormpath call is 'interactive' (logins, registrations, loading
+    # the current user), 'refresh' (background user cache refreshes), or
+    # 'bulk' (admin work, and anything run within `stormpath_priority('bulk')`).
+    # STORMPATH_PRIORITY_WEIGHTS is a dict of how many queued calls of each
+    # class are let through, relative to the others.  STORMPATH_PRIORITY_SHARES
+    # is a dict of the share (0 - 1) of the concurrency limit each class may
+    # use at once.  Classes which aren't specified use the defaults.
+    config.setdefault('STORMPATH_PRIORITY_WEIGHTS', None)
+    config.setdefault('STORMPATH_PRIORITY_SHARES', None)
+
+    # Load shedding configuration.  If enabled, login, registration, and
+    # password reset POSTs are rejected (with a `503 Service Unavailable`
+    # response, and a Retry-After header of STORMPATH_LOAD_SHEDDING_RETRY_AFTER)
+    # once STORMPATH_LOAD_SHEDDING_MAX_IN_FLIGHT of them are being handled at
+    # once (per process), or once STORMPATH_LOAD_SHEDDING_MAX_QUEUED Stormpath
+    # calls are waiting on the adaptive concurrency limit.  GET requests, and
+    # requests from users who are already logged in, are never shed.
+    config.setdefault('STORMPATH_LOAD_SHEDDING_ENABLED', False)
+    config.setdefault('STORMPATH_LOAD_SHEDDING_MAX_IN_FLIGHT', 20)
+    config.setdefault('STORMPATH_LOAD_SHEDDING_MAX_QUEUED', None)
+    config.setdefault('STORMPATH_LOAD_SHEDDING_RETRY_AFTER', timedelta(seconds=1))
+
+    # Rate limit configuration.  Each limit is a (requests, timedelta) tuple,
+    # like (10, timedelta(minutes=1)), and applies to login, access token, and
+    # forgot password POSTs: STORMPATH_RATE_LIMIT_BY_IP per client IP address,
+    # and STORMPATH_RATE_LIMIT_BY_LOGIN per submitted login (or email).
+    # Requests over a limit are rejected with a `429 Too Many Requests`
+    # response, without calling Stormpath.  By default limits are tracked in
+    # memory (for up to STORMPATH_RATE_LIMIT_MAX_KEYS keys each), per process;
+    # set STORMPATH_RATE_LIMIT_STORE to a store (like a RedisStore) to share
+    # them between processes and servers.  If your app runs behind proxies (or
+    # load balancers), set STORMPATH_RATE_LIMIT_TRUSTED_PROXIES to how many,
+    # so client IP addresses are read from the X-Forwarded-For header.
+    config.setdefault('STORMPATH_RATE_LIMIT_BY_IP', None)
+    config.setdefault('STORMPATH_RATE_LIMIT_BY_LOGIN', None)
+    config.setdefault('STORMPATH_RATE_LIMIT_STORE', None)
+    config.setdefault('STORMPATH_RATE_LIMIT_MAX_KEYS', 100000)
+    config.setdefault('STORMPATH_RATE_LIMIT_TRUSTED_PROXIES', 0)
+
+    # Request deadline configuration.  If set, every Stormpath call made while
+    # handling a request must finish within this budget (counted from the
+    # start of the request): socket timeouts are capped to the time remaining,
+    # and once it's spent, calls fail with a DeadlineExceededError.  This can
+    # be overridden per view, with the `request_deadline` decorator.
+    config.setdefault('STORMPATH_REQUEST_DEADLINE', None)
+
+    # Retry configuration.  If enabled, idempotent reads (account,
+    # application, and group fetches) which fail with a network or server
+    # error are retried, with jittered exponential backoff -- as long as the
+    # total time spent stays within STORMPATH_RETRY_BUDGET.  Mutations (like
+    # creating a user) are never retried.
+    config.setdefault('STORMPATH_RETRY_ENABLED', False)
+    config.setdefault('STORMPATH_RETRY_MAX_ATTEMPTS', 3)
+    config.setdefault('STORMPATH_RETRY_BASE_DELAY', timedelta(milliseconds=100))
+    config.setdefault('STORMPATH_RETRY_MAX_DELAY', timedelta(seconds=1))
+    config.setdefault('STORMPATH_RETRY_BUDGET', timedelta(seconds=3))
+
+    # Hedging configuration.  If enabled, idempotent reads which take longer
+    # than the observed STORMPATH_HEDGING_QUANTILE latency are hedged: a
+    # second, identical call is made, and whichever succeeds first wins.
+    config.setdefault('STORMPATH_HEDGING_ENABLED', False)
+    config.setdefault('STORMPATH_HEDGING_QUANTILE', 0.95)
+    config.setdefault('STORMPATH_HEDGING_MIN_SAMPLES', 20)
+
     # Cache configuration.
     config.setdefault('STORMPATH_CACHE', None)
 
+    # Local user cache configuration.  If enabled, users are cached in memory
+    # (per process) so we don't need to hit Stormpath on every request.
+    config.setdefault('STORMPATH_USER_CACHE_ENABLED', False)
+    config.setdefault('STORMPATH_USER_CACHE_MAX_SIZE', 1000)
+    config.setdefault('STORMPATH_USER_CACHE_TTL', timedelta(minutes=5))
+
+    # Stale-while-revalidate configuration.  If a hard TTL is set, cached users
+    # older than STORMPATH_USER_CACHE_TTL (but younger than the hard TTL) are
+    # served immediately, and refreshed by a pool of background threads.
+    config.setdefault('STORMPATH_USER_CACHE_HARD_TTL', None)
+    config.setdefault('STORMPATH_USER_CACHE_REFRESH_THREADS', 2)
+    config.setdefault('STORMPATH_USER_CACHE_REFRESH_QUEUE_SIZE', 100)
+
+    # Shared user cache configuration.  If a store is specified (for instance,
+    # a flask_stormpath.cache.RedisStore), users are cached there so they can
+    # be shared by every worker process.  This is separate from STORMPATH_CACHE
+    # (which configures the Stormpath SDK's own resource cache).
+    config.setdefault('STORMPATH_USER_CACHE_STORE', None)
+
+    # Negative user cache configuration.  If enabled, accounts which couldn't
+    # be loaded (deleted, disabled, or unknown accounts) are remembered for a
+    # short time, so we don't ask Stormpath about them on every request.
+    config.setdefault('STORMPATH_USER_NEGATIVE_CACHE_ENABLED', False)
+    config.setdefault('STORMPATH_USER_NEGATIVE_CACHE_MAX_SIZE', 10000)
+    config.setdefault('STORMPATH_USER_NEGATIVE_CACHE_TTL', timedelta(minutes=1))
+
+    # Degraded mode configuration.  If enabled, when Stormpath is unreachable
+    # (network errors, server errors, or an open circuit breaker),
+    # already-authenticated users are served from their last known good copy
+    # (up to STORMPATH_DEGRADED_MAX_STALENESS old), instead of being logged out.
+    config.setdefault('STORMPATH_DEGRADED_MODE_ENABLED', False)
+    config.setdefault('STORMPATH_DEGRADED_MAX_STALENESS', timedelta(hours=1))
+    config.setdefault('STORMPATH_DEGRADED_CACHE_MAX_SIZE', 10000)
+
+    # Which account properties should be expanded (returned in the same API
+    # call) when users are fetched from Stormpath?  For instance:
+    # ('groups', 'customData').
+    config.setdefault('STORMPATH_USER_EXPAND', None)
+
+    # Should users be loaded lazily?  If this is enabled, the current user's
+    # account is only fetched from Stormpath when a profile field is read, or
+    # the user is checked with `is_authenticated` (by `login_required`, say).
+    config.setdefault('STORMPATH_LAZY_USER', False)
+
+    # Should a signed snapshot of the user be stored in the session?  If this
+    # is enabled, the current user is rebuilt from the snapshot (without any
+    # Stormpath API calls) until the snapshot is older than the max age.
+    config.setdefault('STORMPATH_ENABLE_SESSION_SNAPSHOT', False)
+    config.setdefault('STORMPATH_SESSION_SNAPSHOT_MAX_AGE', timedelta(minutes=5))
+
     # Configure templates.  These template settings control which templates are
     # used to render the Flask-Stormpath views.
     config.setdefault('STORMPATH_BASE_TEMPLATE', 'flask_stormpath/base.html')
@@ -140,3 +340,180 @@ def check_settings(config):
 
     if config['STORMPATH_COOKIE_DURATION'] and not isinstance(config['STORMPATH_COOKIE_DURATION'], timedelta):
         raise ConfigurationError('STORMPATH_COOKIE_DURATION must be a timedelta object.')
+
+    if config['STORMPATH_USER_CACHE_ENABLED']:
+        if not isinstance(config['STORMPATH_USER_CACHE_TTL'], timedelta):
+            raise ConfigurationError('STORMPATH_USER_CACHE_TTL must be a timedelta object.')
+
+        if not isinstance(config['STORMPATH_USER_CACHE_MAX_SIZE'], int) or config['STORMPATH_USER_CACHE_MAX_SIZE'] < 1:
+            raise ConfigurationError('STORMPATH_USER_CACHE_MAX_SIZE must be a positive integer.')
+
+        if config['STORMPATH_USER_CACHE_HARD_TTL']:
+            if not isinstance(config['STORMPATH_USER_CACHE_HARD_TTL'], timedelta):
+                raise ConfigurationError('STORMPATH_USER_CACHE_HARD_TTL must be a timedelta object.')
+
+            if config['STORMPATH_USER_CACHE_HARD_TTL'] < config['STORMPATH_USER_CACHE_TTL']:
+                raise ConfigurationError('STORMPATH_USER_CACHE_HARD_TTL must not be shorter than STORMPATH_USER_CACHE_TTL.')
+
+    if config['STORMPATH_ENABLE_SESSION_SNAPSHOT']:
+        if not isinstance(config['STORMPATH_SESSION_SNAPSHOT_MAX_AGE'], timedelta):
+            raise ConfigurationError('STORMPATH_SESSION_SNAPSHOT_MAX_AGE must be a timedelta object.')
+
+        if not config.get('SECRET_KEY'):
+            raise ConfigurationError('You must define a SECRET_KEY to use session snapshots.')
+
+    if config['STORMPATH_USER_NEGATIVE_CACHE_ENABLED']:
+        if not isinstance(config['STORMPATH_USER_NEGATIVE_CACHE_TTL'], timedelta):
+            raise ConfigurationError('STORMPATH_USER_NEGATIVE_CACHE_TTL must be a timedelta object.')
+
+        if not isinstance(config['STORMPATH_USER_NEGATIVE_CACHE_MAX_SIZE'], int) or config['STORMPATH_USER_NEGATIVE_CACHE_MAX_SIZE'] < 1:
+            raise ConfigurationError('STORMPATH_USER_NEGATIVE_CACHE_MAX_SIZE must be a positive integer.')
+
+    store = config['STORMPATH_USER_CACHE_STORE']
+    if store is not None and not all(hasattr(store, method) for method in ('get', 'set', 'delete')):
+        raise ConfigurationError('STORMPATH_USER_CACHE_STORE must provide get, set, and delete methods.')
+
+    if store is not None and not isinstance(config['STORMPATH_USER_CACHE_TTL'], timedelta):
+        raise ConfigurationError('STORMPATH_USER_CACHE_TTL must be a timedelta object.')
+
+    if config['STORMPATH_ENABLE_ACCESS_TOKENS']:
+        if not isinstance(config['STORMPATH_ACCESS_TOKEN_TTL'], timedelta):
+            raise ConfigurationError('STORMPATH_ACCESS_TOKEN_TTL must be a timedelta object.')
+
+        secrets = config['STORMPATH_ACCESS_TOKEN_SECRETS']
+        if isinstance(secrets, string_types):
+            secrets = [secrets]
+
+        if secrets is not None and not (isinstance(secrets, (list, tuple)) and secrets and all(isinstance(secret, string_types) and secret for secret in secrets)):
+            raise ConfigurationError('STORMPATH_ACCESS_TOKEN_SECRETS must be a non-empty list of non-empty strings.')
+
+        if not (secrets or config.get('SECRET_KEY')):
+            raise ConfigurationError('You must define STORMPATH_ACCESS_TOKEN_SECRETS (or a SECRET_KEY) to use access tokens.')
+
+    if not isinstance(config['STORMPATH_GROUP_CATALOG_TTL'], timedelta):
+        raise ConfigurationError('STORMPATH_GROUP_CATALOG_TTL must be a timedelta object.')
+
+    if config['STORMPATH_PASSWORD_POLICY_ENABLED'] and not isinstance(config['STORMPATH_PASSWORD_POLICY_TTL'], timedelta):
+        raise ConfigurationError('STORMPATH_PASSWORD_POLICY_TTL must be a timedelta object.')
+
+    if not isinstance(config['STORMPATH_ASYNC_MAX_WORKERS'], int) or config['STORMPATH_ASYNC_MAX_WORKERS'] < 1:
+        raise ConfigurationError('STORMPATH_ASYNC_MAX_WORKERS must be a positive integer.')
+
+    if config['STORMPATH_DEGRADED_MODE_ENABLED']:
+        if not isinstance(config['STORMPATH_DEGRADED_MAX_STALENESS'], timedelta):
+            raise ConfigurationError('STORMPATH_DEGRADED_MAX_STALENESS must be a timedelta object.')
+
+        if not isinstance(config['STORMPATH_DEGRADED_CACHE_MAX_SIZE'], int) or config['STORMPATH_DEGRADED_CACHE_MAX_SIZE'] < 1:
+            raise ConfigurationError('STORMPATH_DEGRADED_CACHE_MAX_SIZE must be a positive integer.')
+
+    if config['STORMPATH_CIRCUIT_BREAKER_ENABLED']:
+        failure_rate = config['STORMPATH_CIRCUIT_BREAKER_FAILURE_RATE']
+        if not isinstance(failure_rate, (int, float)) or not 0 < failure_rate <= 1:
+            raise ConfigurationError('STORMPATH_CIRCUIT_BREAKER_FAILURE_RATE must be a number between 0 and 1.')
+
+        for setting in ('STORMPATH_CIRCUIT_BREAKER_MIN_CALLS', 'STORMPATH_CIRCUIT_BREAKER_WINDOW', 'STORMPATH_CIRCUIT_BREAKER_HALF_OPEN_CALLS'):
+            if not isinstance(config[setting], int) or config[setting] < 1:
+                raise ConfigurationError('%s must be a positive integer.' % setting)
+
+        if config['STORMPATH_CIRCUIT_BREAKER_SLOW_CALL_DURATION'] is not None and not isinstance(config['STORMPATH_CIRCUIT_BREAKER_SLOW_CALL_DURATION'], timedelta):
+            raise ConfigurationError('STORMPATH_CIRCUIT_BREAKER_SLOW_CALL_DURATION must be a timedelta object.')
+
+        if not isinstance(config['STORMPATH_CIRCUIT_BREAKER_RESET_TIMEOUT'], timedelta):
+            raise ConfigurationError('STORMPATH_CIRCUIT_BREAKER_RESET_TIMEOUT must be a timedelta object.')
+
+    if config['STORMPATH_REQUEST_DEADLINE'] is not None and not isinstance(config['STORMPATH_REQUEST_DEADLINE'], timedelta):
+        raise ConfigurationError('STORMPATH_REQUEST_DEADLINE must be a timedelta object.')
+
+    if config['STORMPATH_CONCURRENCY_LIMIT_ENABLED']:
+        for setting in ('STORMPATH_CONCURRENCY_LIMIT_INITIAL', 'STORMPATH_CONCURRENCY_LIMIT_MIN', 'STORMPATH_CONCURRENCY_LIMIT_MAX'):
+            if not isinstance(config[setting], int) or config[setting] < 1:
+                raise ConfigurationError('%s must be a positive integer.' % setting)
+
+        if not config['STORMPATH_CONCURRENCY_LIMIT_MIN'] <= config['STORMPATH_CONCURRENCY_LIMIT_INITIAL'] <= config['STORMPATH_CONCURRENCY_LIMIT_MAX']:
+            raise ConfigurationError('STORMPATH_CONCURRENCY_LIMIT_INITIAL must be between STORMPATH_CONCURRENCY_LIMIT_MIN and STORMPATH_CONCURRENCY_LIMIT_MAX.')
+
+        backoff = config['STORMPATH_CONCURRENCY_LIMIT_BACKOFF']
+        if not isinstance(backoff, float) or not 0 < backoff < 1:
+            raise ConfigurationError('STORMPATH_CONCURRENCY_LIMIT_BACKOFF must be a number between 0 and 1.')
+
+        tolerance = config['STORMPATH_CONCURRENCY_LIMIT_LATENCY_TOLERANCE']
+        if not isinstance(tolerance, (int, float)) or tolerance <= 1:
+            raise ConfigurationError('STORMPATH_CONCURRENCY_LIMIT_LATENCY_TOLERANCE must be a number greater than 1.')
+
+        if not isinstance(config['STORMPATH_CONCURRENCY_LIMIT_QUEUE_SIZE'], int) or config['STORMPATH_CONCURRENCY_LIMIT_QUEUE_SIZE'] < 0:
+            raise ConfigurationError('STORMPATH_CONCURRENCY_LIMIT_QUEUE_SIZE must be a non-negative integer.')
+
+        if not isinstance(config['STORMPATH_CONCURRENCY_LIMIT_QUEUE_TIMEOUT'], timedelta):
+            raise ConfigurationError('STORMPATH_CONCURRENCY_LIMIT_QUEUE_TIMEOUT must be a timedelta object.')
+
+        weights = config['STORMPATH_PRIORITY_WEIGHTS'] or {}
+        if not isinstance(weights, dict) or any(priority not in DEFAULT_PRIORITY_WEIGHTS or not isinstance(weight, int) or weight < 1 for priority, weight in weights.items()):
+            raise ConfigurationError('STORMPATH_PRIORITY_WEIGHTS must be a dict mapping priority classes to positive integers.')
+
+        shares = config['STORMPATH_PRIORITY_SHARES'] or {}
+        if not isinstance(shares, dict) or any(priority not in DEFAULT_PRIORITY_WEIGHTS or not isinstance(share, (int, float)) or not 0 < share <= 1 for priority, share in shares.items()):
+            raise ConfigurationError('STORMPATH_PRIORITY_SHARES must be a dict mapping priority classes to numbers between 0 and 1.')
+
+    if config['STORMPATH_LOAD_SHEDDING_ENABLED']:
+        if not isinstance(config['STORMPATH_LOAD_SHEDDING_MAX_IN_FLIGHT'], int) or config['STORMPATH_LOAD_SHEDDING_MAX_IN_FLIGHT'] < 1:
+            raise ConfigurationError('STORMPATH_LOAD_SHEDDING_MAX_IN_FLIGHT must be a positive integer.')
+
+        max_queued = config['STORMPATH_LOAD_SHEDDING_MAX_QUEUED']
+        if max_queued is not None:
+            if not isinstance(max_queued, int) or max_queued < 1:
+                raise ConfigurationError('STORMPATH_LOAD_SHEDDING_MAX_QUEUED must be a positive integer.')
+
+            if not config['STORMPATH_CONCURRENCY_LIMIT_ENABLED']:
+                raise ConfigurationError('STORMPATH_LOAD_SHEDDING_MAX_QUEUED requires STORMPATH_CONCURRENCY_LIMIT_ENABLED.')
+
+        if not isinstance(config['STORMPATH_LOAD_SHEDDING_RETRY_AFTER'], timedelta):
+            raise ConfigurationError('STORMPATH_LOAD_SHEDDING_RETRY_AFTER must be a timedelta object.')
+
+    for setting in ('STORMPATH_RATE_LIMIT_BY_IP', 'STORMPATH_RATE_LIMIT_BY_LOGIN'):
+        limit = config[setting]
+        if limit is None:
+            continue
+
+        if not isinstance(limit, (list, tuple)) or len(limit) != 2 or not isinstance(limit[0], int) or limit[0] < 1 or not isinstance(limit[1], timedelta) or limit[1].total_seconds() <= 0:
+            raise ConfigurationError('%s must be a (requests, timedelta) tuple.' % setting)
+
+    store = config['STORMPATH_RATE_LIMIT_STORE']
+    if store is not None and not all(hasattr(store, method) for method in ('get', 'set', 'delete')):
+        raise ConfigurationError('STORMPATH_RATE_LIMIT_STORE must provide get, set, and delete methods.')
+
+    if not isinstance(config['STORMPATH_RATE_LIMIT_MAX_KEYS'], int) or config['STORMPATH_RATE_LIMIT_MAX_KEYS'] < 1:
+        raise ConfigurationError('STORMPATH_RATE_LIMIT_MAX_KEYS must be a positive integer.')
+
+    if not isinstance(config['STORMPATH_RATE_LIMIT_TRUSTED_PROXIES'], int) or config['STORMPATH_RATE_LIMIT_TRUSTED_PROXIES'] < 0:
+        raise ConfigurationError('STORMPATH_RATE_LIMIT_TRUSTED_PROXIES must be a non-negative integer.')
+
+    if config['STORMPATH_RETRY_ENABLED']:
+        if not isinstance(config['STORMPATH_RETRY_MAX_ATTEMPTS'], int) or config['STORMPATH_RETRY_MAX_ATTEMPTS'] < 1:
+            raise ConfigurationError('STORMPATH_RETRY_MAX_ATTEMPTS must be a positive integer.')
+
+        for setting in ('STORMPATH_RETRY_BASE_DELAY', 'STORMPATH_RETRY_MAX_DELAY', 'STORMPATH_RETRY_BUDGET'):
+            if not isinstance(config[setting], timedelta):
+                raise ConfigurationError('%s must be a timedelta object.' % setting)
+
+    if config['STORMPATH_HEDGING_ENABLED']:
+        quantile = config['STORMPATH_HEDGING_QUANTILE']
+        if not isinstance(quantile, (int, float)) or not 0 < quantile < 1:
+            raise ConfigurationError('STORMPATH_HEDGING_QUANTILE must be a number between 0 and 1.')
+
+        if not isinstance(config['STORMPATH_HEDGING_MIN_SAMPLES'], int) or config['STORMPATH_HEDGING_MIN_SAMPLES'] < 1:
+            raise ConfigurationError('STORMPATH_HEDGING_MIN_SAMPLES must be a positive integer.')
+
+    limits = config['STORMPATH_BULKHEAD_LIMITS']
+    if limits is not None and (not isinstance(limits, dict) or not all(isinstance(limit, int) and limit > 0 for limit in limits.values())):
+        raise ConfigurationError('STORMPATH_BULKHEAD_LIMITS must be a dict of positive integers.')
+
+    for setting in ('STORMPATH_SERVER_THREADS', 'STORMPATH_HTTP_POOL_SIZE', 'STORMPATH_HTTP_MAX_CONNECTIONS'):
+        if config[setting] is not None and (not isinstance(config[setting], int) or config[setting] < 1):
+            raise ConfigurationError('%s must be a positive integer.' % setting)
+
+    for setting in ('STORMPATH_HTTP_CONNECT_TIMEOUT', 'STORMPATH_HTTP_READ_TIMEOUT'):
+        if config[setting] is not None and not isinstance(config[setting], timedelta):
+            raise ConfigurationError('%s must be a timedelta object.' % setting)
+
+    if config['STORMPATH_USER_EXPAND'] and not isinstance(config['STORMPATH_USER_EXPAND'], (list, tuple)):
+        raise ConfigurationError('STORMPATH_USER_EXPAND must be a list or tuple of account properties.')
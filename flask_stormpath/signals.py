@@ -0,0 +1,18 @@
+"""Signals sent by Flask-Stormpath."""
+
+
+from blinker import Namespace
+
+
+stormpath_signals = Namespace()
+
+# Sent when a User is created, updated, or deleted.
+user_created = stormpath_signals.signal('user-created')
+user_updated = stormpath_signals.signal('user-updated')
+user_deleted = stormpath_signals.signal('user-deleted')
+
+# Sent (with the CircuitBreaker as the sender) when our circuit breaker changes
+# state.
+circuit_opened = stormpath_signals.signal('circuit-opened')
+circuit_half_opened = stormpath_signals.signal('circuit-half-opened')
+circuit_closed = stormpath_signals.signal('circuit-closed')
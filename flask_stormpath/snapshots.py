@@ -0,0 +1,109 @@
+"""
+Helpers for storing signed snapshots of users in the session.
+
+When `STORMPATH_ENABLE_SESSION_SNAPSHOT` is enabled, a compact, signed
+snapshot of the user is stored in the session when they log in.  This lets
+:meth:`StormpathManager.load_user` rebuild the current user locally (without
+any Stormpath API calls) until the snapshot is older than
+`STORMPATH_SESSION_SNAPSHOT_MAX_AGE`.
+"""
+
+
+from flask import current_app, has_request_context, session
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+from .models import User
+
+
+SNAPSHOT_SESSION_KEY = '_stormpath_user'
+SNAPSHOT_SALT = 'flask-stormpath-user-snapshot'
+
+
+def _get_serializer():
+    """
+    Return a serializer used to sign (and verify) user snapshots.
+
+    Snapshots are signed with the Flask app's `SECRET_KEY`.
+    """
+    return URLSafeTimedSerializer(current_app.secret_key, salt=SNAPSHOT_SALT)
+
+
+def save_user_snapshot(user, snapshot=None):
+    """
+    Store a signed snapshot of the given user in the session.
+
+    If session snapshots are disabled, this does nothing.  If the snapshot
+    can't be built (because the user's Groups couldn't be listed, for
+    instance), no snapshot is stored -- the user will just be loaded from
+    Stormpath next time.
+
+    :param obj user: The User to store.
+    :param dict snapshot: (optional) The user's snapshot, if it was already
+        built (see :meth:`User.to_snapshot`).
+    """
+    if not current_app.config['STORMPATH_ENABLE_SESSION_SNAPSHOT']:
+        return
+
+    if snapshot is None:
+        try:
+            snapshot = user.to_snapshot()
+        except Exception:
+            return
+
+    session[SNAPSHOT_SESSION_KEY] = _get_serializer().dumps(snapshot)
+
+
+def load_user_snapshot(account_href):
+    """
+    Return a read-only User rebuilt from the session snapshot (or None).
+
+    None is returned if there is no snapshot, if the snapshot's signature is
+    invalid, if the snapshot is older than `STORMPATH_SESSION_SNAPSHOT_MAX_AGE`,
+    or if the snapshot belongs to a different account.
+
+    :param str account_href: The href of the account we're loading.
+    """
+    token = session.get(SNAPSHOT_SESSION_KEY)
+    if not token:
+        return None
+
+    try:
+        snapshot = _get_serializer().loads(
+            token,
+            max_age = current_app.config['STORMPATH_SESSION_SNAPSHOT_MAX_AGE'].total_seconds(),
+        )
+    except BadSignature:
+        return None
+
+    if snapshot.get('href') != account_href:
+        return None
+
+    return User.from_snapshot(snapshot)
+
+
+def clear_user_snapshot():
+    """Remove the user snapshot from the session (if there is one)."""
+    session.pop(SNAPSHOT_SESSION_KEY, None)
+
+
+def invalidate_user_snapshot(sender, user=None):
+    """
+    A signal receiver which removes the session snapshot of the given user.
+
+    This is connected to the `user_updated` and `user_deleted` signals, so a
+    user who changes their own account won't keep seeing stale data.
+    """
+    if user is None or not has_request_context():
+        return
+
+    token = session.get(SNAPSHOT_SESSION_KEY)
+    if not token:
+        return
+
+    try:
+        snapshot = _get_serializer().loads(token)
+    except BadSignature:
+        snapshot = {}
+
+    if snapshot.get('href') in (None, user.href):
+        clear_user_snapshot()
@@ -0,0 +1,73 @@
+"""
+Helpers for issuing and verifying stateless access tokens.
+
+Access tokens are short-lived, signed tokens which carry a user's account
+href, status, and group hrefs.  Since they're signed, they can be verified
+locally (without any Stormpath API calls), which makes them well suited for
+authenticating JSON API requests.
+"""
+
+
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from six import string_types
+
+
+ACCESS_TOKEN_SALT = 'flask-stormpath-access-token'
+
+
+def _get_secrets():
+    """
+    Return the list of secrets used for access tokens.
+
+    The first secret is used to sign new tokens.  Every secret is accepted
+    when verifying tokens, which allows secrets to be rotated without
+    invalidating tokens which were already issued.  A single secret may be
+    given as a plain string.
+    """
+    secrets = current_app.config['STORMPATH_ACCESS_TOKEN_SECRETS']
+    if isinstance(secrets, string_types):
+        return [secrets]
+
+    return secrets or [current_app.secret_key]
+
+
+def issue_access_token(user):
+    """
+    Issue a new access token for the given user.
+
+    :param obj user: The User to issue a token for.
+    :rtype: tuple
+    :returns: A tuple of the token, and the number of seconds it is valid for.
+    """
+    claims = {
+        'href': user.href,
+        'status': user.status,
+        'groups': [group.href for group in user.groups],
+    }
+
+    serializer = URLSafeTimedSerializer(_get_secrets()[0], salt=ACCESS_TOKEN_SALT)
+    expires_in = int(current_app.config['STORMPATH_ACCESS_TOKEN_TTL'].total_seconds())
+
+    return serializer.dumps(claims), expires_in
+
+
+def verify_access_token(token):
+    """
+    Verify an access token, locally.
+
+    :param str token: The access token.
+    :rtype: dict
+    :returns: The token's claims, or None if the token is invalid or expired.
+    """
+    max_age = current_app.config['STORMPATH_ACCESS_TOKEN_TTL'].total_seconds()
+
+    for secret in _get_secrets():
+        serializer = URLSafeTimedSerializer(secret, salt=ACCESS_TOKEN_SALT)
+
+        try:
+            return serializer.loads(token, max_age=max_age)
+        except BadSignature:
+            continue
+
+    return None
@@ -0,0 +1,227 @@
+"""
+HTTP transport helpers, used to tune how we connect to Stormpath.
+
+The Stormpath SDK makes every API call through a single `requests` session.
+We mount our own connection pool on that session, so warm (keep-alive)
+connections are reused on every request path, instead of paying for a new TLS
+handshake whenever the pool runs dry.
+"""
+
+
+from threading import Condition, Lock
+from time import time
+
+from requests.adapters import HTTPAdapter
+
+from .deadlines import check_deadline, remaining_time
+from .errors import ConfigurationError, DeadlineExceededError
+
+
+# The number of threads we assume each server process runs, if
+# STORMPATH_SERVER_THREADS isn't specified.
+DEFAULT_SERVER_THREADS = 10
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    A `requests` transport adapter with a bounded connection pool, default
+    timeouts, and pool usage statistics.
+
+    If `max_connections` is set, no more than that many requests are sent at
+    once -- any others wait for a free connection (and their wait time is
+    recorded).  Otherwise, requests beyond `pool_size` never wait: they open an
+    extra connection, which is closed afterwards.
+    """
+    def __init__(self, pool_size=10, max_connections=None, connect_timeout=None, read_timeout=None):
+        """
+        Initialize this adapter.
+
+        :param int pool_size: (optional) How many connections to keep open to
+            each host.
+        :param int max_connections: (optional) The maximum number of requests
+            in flight at once (for every host).
+        :param float connect_timeout: (optional) The connect timeout (in
+            seconds) of requests which don't specify a timeout.
+        :param float read_timeout: (optional) The read timeout (in seconds) of
+            requests which don't specify a timeout.
+        """
+        self.pool_size = pool_size
+        self.max_connections = max_connections
+        self.timeout = (connect_timeout, read_timeout)
+
+        self._lock = Lock()
+        self._slot_freed = Condition(self._lock)
+        self._in_use = 0
+        self._max_in_use = 0
+        self._requests = 0
+        self._waits = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+        # We never let urllib3 block waiting for a pooled connection: that
+        # wait would be unbounded (and invisible to our statistics).  Waits
+        # only happen on our own slots (see `max_connections`).
+        super(PooledHTTPAdapter, self).__init__(
+            pool_connections = pool_size,
+            pool_maxsize = pool_size,
+            pool_block = False,
+        )
+
+    def send(self, request, **kwargs):
+        """
+        Send a request over a pooled connection.
+
+        If the current request has a deadline (see
+        :mod:`flask_stormpath.deadlines`), we won't wait for a free connection
+        past it, and our timeouts are capped to the time remaining once we
+        have one.
+        """
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+
+        check_deadline()
+        self._acquire()
+
+        try:
+            remaining = remaining_time()
+            if remaining is not None:
+                if remaining <= 0:
+                    raise DeadlineExceededError('The request deadline was exceeded.')
+
+                kwargs['timeout'] = cap_timeout(kwargs['timeout'], remaining)
+
+            return super(PooledHTTPAdapter, self).send(request, **kwargs)
+        finally:
+            with self._lock:
+                self._in_use -= 1
+                self._slot_freed.notify()
+
+    def _acquire(self):
+        """
+        Take a connection slot, waiting for one to be freed if we're already
+        at `max_connections` (and recording how long we waited).
+
+        :raises: DeadlineExceededError if the current request's deadline
+            passes while we're waiting.
+        """
+        with self._lock:
+            start = None
+
+            while self.max_connections and self._in_use >= self.max_connections:
+                if start is None:
+                    start = time()
+
+                remaining = remaining_time()
+                if remaining is not None and remaining <= 0:
+                    raise DeadlineExceededError('The request deadline was exceeded while waiting for a connection.')
+
+                self._slot_freed.wait(remaining)
+
+            self._in_use += 1
+            self._max_in_use = max(self._max_in_use, self._in_use)
+            self._requests += 1
+
+            if start is not None:
+                waited = time() - start
+                self._waits += 1
+                self._total_wait += waited
+                self._max_wait = max(self._max_wait, waited)
+
+    @property
+    def stats(self):
+        """
+        Return pool statistics: how many connections are in use, how many
+        requests had to wait for a free connection, and how long they waited
+        (in seconds).
+        """
+        capacity = self.max_connections or self.pool_size
+
+        with self._lock:
+            return {
+                'pool_size': self.pool_size,
+                'max_connections': self.max_connections,
+                'in_use': self._in_use,
+                'max_in_use': self._max_in_use,
+                'utilization': float(self._in_use) / capacity,
+                'requests': self._requests,
+                'waits': self._waits,
+                'total_wait': self._total_wait,
+                'average_wait': self._total_wait / self._waits if self._waits else 0.0,
+                'max_wait': self._max_wait,
+            }
+
+
+def cap_timeout(timeout, limit):
+    """
+    Cap a `requests` timeout (a number, a `(connect, read)` tuple, or None) to
+    the given limit (in seconds).
+    """
+    if isinstance(timeout, tuple):
+        return tuple(cap_timeout(part, limit) for part in timeout)
+
+    return limit if timeout is None else min(timeout, limit)
+
+
+def get_pool_size(config):
+    """
+    Return the number of connections to keep open to Stormpath.
+
+    Unless STORMPATH_HTTP_POOL_SIZE is specified, the pool is sized so that
+    every server thread (and background refresh thread) can hold a connection
+    at once.
+
+    :param dict config: The Flask app config.
+    :rtype: int
+    """
+    if config['STORMPATH_HTTP_POOL_SIZE']:
+        return config['STORMPATH_HTTP_POOL_SIZE']
+
+    threads = config['STORMPATH_SERVER_THREADS'] or DEFAULT_SERVER_THREADS
+    if config['STORMPATH_USER_CACHE_HARD_TTL'] is not None:
+        threads += config['STORMPATH_USER_CACHE_REFRESH_THREADS']
+
+    return threads
+
+
+def get_session(client):
+    """
+    Return the `requests` session the given Stormpath Client uses.
+
+    :param obj client: The Stormpath Client.
+    :raises: ConfigurationError if the Client doesn't use a `requests` session.
+    """
+    session = getattr(getattr(getattr(client, 'data_store', None), 'executor', None), 'session', None)
+    if session is None:
+        raise ConfigurationError('The Stormpath Client does not use an HTTP session which can be configured.')
+
+    return session
+
+
+def configure_client(client, config):
+    """
+    Mount a :class:`PooledHTTPAdapter` on the given Stormpath Client's HTTP
+    session, configured from the Flask app config.
+
+    :param obj client: The Stormpath Client.
+    :param dict config: The Flask app config.
+    :rtype: obj
+    :returns: The adapter.
+    """
+    connect_timeout = config['STORMPATH_HTTP_CONNECT_TIMEOUT']
+    read_timeout = config['STORMPATH_HTTP_READ_TIMEOUT']
+
+    adapter = PooledHTTPAdapter(
+        pool_size = get_pool_size(config),
+        max_connections = config['STORMPATH_HTTP_MAX_CONNECTIONS'],
+        connect_timeout = connect_timeout.total_seconds() if connect_timeout is not None else None,
+        read_timeout = read_timeout.total_seconds() if read_timeout is not None else None,
+    )
+
+    session = get_session(client)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    if not config['STORMPATH_HTTP_KEEP_ALIVE']:
+        session.headers['Connection'] = 'close'
+
+    return adapter
@@ -1,11 +1,14 @@
 """Our pluggable views."""
 
 
+from math import ceil
+
 from facebook import get_user_from_cookie
 from flask import (
     abort,
     current_app,
     flash,
+    jsonify,
     redirect,
     render_template,
     request,
@@ -15,6 +18,7 @@ from six import string_types
 from stormpath.resources.provider import Provider
 
 from . import StormpathError, logout_user
+from .decorators import shed_load
 from .forms import (
     ChangePasswordForm,
     ForgotPasswordForm,
@@ -22,8 +26,13 @@ from .forms import (
     RegistrationForm,
 )
 from .models import User
+from .ratelimit import check_rate_limits
+from .resilience import call_stormpath, read_stormpath
+from .snapshots import clear_user_snapshot, save_user_snapshot
+from .tokens import issue_access_token
 
 
+@shed_load
 def register():
     """
     Register a new user with Stormpath.
@@ -82,6 +91,7 @@ def register():
                 # Flask-Login), then redirect the user to the
                 # STORMPATH_REDIRECT_URL setting.
                 login_user(account, remember=True)
+                save_user_snapshot(account)
 
                 if 'STORMPATH_REGISTRATION_REDIRECT_URL'\
                         in current_app.config:
@@ -94,12 +104,19 @@ def register():
             except StormpathError as err:
                 flash(err.message.get('message'))
 
+    # If the password was rejected locally (see
+    # `STORMPATH_PASSWORD_POLICY_ENABLED`), we'll display the reason.
+    elif request.method == 'POST' and form.password.data:
+        for error in form.password.errors:
+            flash(error)
+
     return render_template(
         current_app.config['STORMPATH_REGISTRATION_TEMPLATE'],
         form = form,
     )
 
 
+@shed_load
 def login():
     """
     Log in an existing Stormpath user.
@@ -116,6 +133,8 @@ def login():
     # If we received a POST request with valid information, we'll continue
     # processing.
     if form.validate_on_submit():
+        check_rate_limits(form.login.data)
+
         try:
             # Try to fetch the user's account from Stormpath.  If this
             # fails, an exception will be raised.
@@ -126,6 +145,7 @@ def login():
             # Flask-Login), then redirect the user to the ?next=<url>
             # query parameter, or the STORMPATH_REDIRECT_URL setting.
             login_user(account, remember=True)
+            save_user_snapshot(account)
 
             return redirect(request.args.get('next') or current_app.config['STORMPATH_REDIRECT_URL'])
 
@@ -138,6 +158,49 @@ def login():
     )
 
 
+def token():
+    """
+    Issue a stateless access token to an existing Stormpath user.
+
+    This view accepts a login (`email` or `username`) and password, either as
+    form data or as JSON, and returns a short-lived, signed access token which
+    can be used to authenticate API requests (see :func:`token_required`).
+
+    The URL this view is bound to, and how long tokens are valid for, can be
+    controlled via Flask-Stormpath settings.
+    """
+    data = request.get_json(silent=True) or request.form
+    if not isinstance(data, dict):
+        data = {}
+
+    login = data.get('login') or data.get('username')
+    password = data.get('password')
+
+    if not login or not password:
+        response = jsonify(error='invalid_request', message='A login and password are required.')
+        response.status_code = 400
+        return response
+
+    check_rate_limits(login)
+
+    try:
+        account = User.from_login(login, password)
+    except StormpathError as err:
+        message = err.message.get('message') if hasattr(err.message, 'get') else 'Invalid login or password.'
+        response = jsonify(error='invalid_grant', message=message)
+        response.status_code = 401
+        return response
+
+    access_token, expires_in = issue_access_token(account)
+
+    return jsonify(
+        access_token = access_token,
+        token_type = 'Bearer',
+        expires_in = expires_in,
+    )
+
+
+@shed_load
 def forgot():
     """
     Initialize 'password reset' functionality for a user who has forgotten his
@@ -154,10 +217,16 @@ def forgot():
     # If we received a POST request with valid information, we'll continue
     # processing.
     if form.validate_on_submit():
+        check_rate_limits(form.email.data)
+
         try:
             # Try to fetch the user's account from Stormpath.  If this
             # fails, an exception will be raised.
-            account = current_app.stormpath_manager.application.send_password_reset_email(form.email.data)
+            account = call_stormpath(
+                'password',
+                current_app.stormpath_manager.application.send_password_reset_email,
+                form.email.data,
+            )
             account.__class__ = User
 
             # If we're able to successfully send a password reset email to this
@@ -184,6 +253,7 @@ def forgot():
     )
 
 
+@shed_load
 def forgot_change():
     """
     Allow a user to change his password.
@@ -196,11 +266,17 @@ def forgot_change():
     this page can all be controlled via Flask-Stormpath settings.
     """
     try:
-        account = current_app.stormpath_manager.application.verify_password_reset_token(request.args.get('sptoken'))
+        account = read_stormpath(
+            'password',
+            current_app.stormpath_manager.application.verify_password_reset_token,
+            request.args.get('sptoken'),
+        )
     except StormpathError as err:
         abort(400)
 
-    form = ChangePasswordForm()
+    # The password is checked against the policy of the user's own Directory,
+    # which may not be the application's default one.
+    form = ChangePasswordForm(account=account)
 
     # If we received a POST request with valid information, we'll continue
     # processing.
@@ -208,11 +284,12 @@ def forgot_change():
         try:
             # Update this user's passsword.
             account.password = form.password.data
-            account.save()
+            call_stormpath('password', account.save)
 
             # Log this user into their account.
             account = User.from_login(account.email, form.password.data)
             login_user(account, remember=True)
+            save_user_snapshot(account)
 
             return render_template(current_app.config['STORMPATH_FORGOT_PASSWORD_COMPLETE_TEMPLATE'])
         except StormpathError as err:
@@ -222,9 +299,11 @@ def forgot_change():
                 flash(err.message.get('message'))
 
     # If this is a POST request, and the form isn't valid, this means the
-    # user's password was no good, so we'll display a message.
+    # user's password was no good (it broke the password policy, or the two
+    # passwords didn't match), so we'll display a message.
     elif request.method == 'POST':
-        flash("Passwords don't match.")
+        errors = form.password.errors if form.password.data else []
+        flash(errors[0] if errors else "Passwords don't match.")
 
     return render_template(
         current_app.config['STORMPATH_FORGOT_PASSWORD_CHANGE_TEMPLATE'],
@@ -317,6 +396,7 @@ def facebook_login():
     # Now we'll log the new user into their account.  From this point on, this
     # Facebook user will be treated exactly like a normal Stormpath user!
     login_user(account, remember=True)
+    save_user_snapshot(account)
 
     return redirect(request.args.get('next') or current_app.config['STORMPATH_REDIRECT_URL'])
 
@@ -395,6 +475,7 @@ def google_login():
     # Now we'll log the new user into their account.  From this point on, this
     # Google user will be treated exactly like a normal Stormpath user!
     login_user(account, remember=True)
+    save_user_snapshot(account)
 
     return redirect(request.args.get('next') or current_app.config['STORMPATH_REDIRECT_URL'])
 
@@ -407,4 +488,38 @@ def logout():
     then redirect the user to the home page of the site.
    """
     logout_user()
+    clear_user_snapshot()
     return redirect('/')
+
+
+def unavailable(error):
+    """
+    Handle Stormpath calls which were rejected because Stormpath is unavailable
+    (or overloaded).
+
+    Rather than letting the request fail with a generic server error, we'll
+    return a `503 Service Unavailable` response, telling the client when to
+    try again.
+
+    :param obj error: The `StormpathUnavailableError`.
+    """
+    retry_after = int(ceil(error.retry_after or 1))
+    return 'Authentication is temporarily unavailable.  Please try again later.', 503, {
+        'Retry-After': str(retry_after),
+    }
+
+
+def rate_limited(error):
+    """
+    Handle requests which were rejected because the client (or login) went
+    over its rate limit.
+
+    We'll return a `429 Too Many Requests` response, telling the client when
+    to try again.
+
+    :param obj error: The `RateLimitExceededError`.
+    """
+    retry_after = int(ceil(error.retry_after or 1))
+    return 'Too many requests.  Please try again later.', 429, {
+        'Retry-After': str(retry_after),
+    }
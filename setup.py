@@ -54,6 +54,7 @@ setup(
         'Flask>=0.9.0',
         'Flask-Login==0.2.9',
         'Flask-WTF>=0.9.5',
+        'itsdangerous>=0.24',
         'facebook-sdk==0.4.0',
         'oauth2client==1.2',
         'stormpath==2.1.1',
@@ -0,0 +1,55 @@
+"""Tests for our asyncio support (Python 3.5+ only)."""
+
+
+from sys import version_info
+from threading import current_thread
+from unittest import TestCase, skipIf
+from uuid import uuid4
+
+from flask import Flask, request
+from flask.ext.stormpath import StormpathManager
+
+
+@skipIf(version_info < (3, 5), 'asyncio support requires Python 3.5+')
+class TestAsync(TestCase):
+    """Our asyncio support test suite."""
+
+    def setUp(self):
+        from asyncio import new_event_loop
+        from flask.ext.stormpath import aio
+
+        self.aio = aio
+        self.loop = new_event_loop()
+
+        self.app = Flask(__name__)
+        self.app.config['SECRET_KEY'] = uuid4().hex
+        self.app.config['STORMPATH_API_KEY_ID'] = 'id'
+        self.app.config['STORMPATH_API_KEY_SECRET'] = 'secret'
+        self.app.config['STORMPATH_APPLICATION'] = 'https://api.stormpath.com/v1/applications/xxx'
+        self.app.config['STORMPATH_ASYNC_MAX_WORKERS'] = 4
+        StormpathManager(self.app)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_run_in_app_context(self):
+        def func():
+            from flask import current_app
+            return current_app.name, current_thread().name
+
+        with self.app.app_context():
+            name, thread = self.loop.run_until_complete(self.aio.run(func))
+
+        self.assertEqual(name, self.app.name)
+        self.assertNotEqual(thread, current_thread().name)
+
+    def test_run_in_request_context(self):
+        with self.app.test_request_context('/?next=/dashboard'):
+            result = self.loop.run_until_complete(self.aio.run(lambda: request.args['next']))
+
+        self.assertEqual(result, '/dashboard')
+
+    def test_executor_is_bounded(self):
+        executor = self.aio.get_executor(self.app)
+        self.assertEqual(executor._max_workers, 4)
+        self.assertTrue(self.aio.get_executor(self.app) is executor)
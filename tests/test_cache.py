@@ -0,0 +1,416 @@
+"""Tests for our local caching helpers."""
+
+
+from multiprocessing import Process
+from os import listdir, mkdir, path
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Event
+from time import sleep
+from unittest import TestCase, skipIf
+
+from flask.ext.stormpath import cache
+from flask.ext.stormpath.cache import (
+    MemoryStore,
+    RedisStore,
+    RefreshPool,
+    SharedUserCache,
+    UserCache,
+    decode_user,
+    encode_user,
+    delete_cached_href,
+    load_cached_href,
+    store_cached_href,
+)
+
+
+class FakeUser(object):
+    """A minimal stand-in for a User, which only has an href."""
+
+    def __init__(self, href):
+        self.href = href
+
+
+class FakeRedis(object):
+    """
+    A local stand-in for a Redis client, which implements the small subset of
+    the `redis.StrictRedis` API used by our RedisStore.
+    """
+    def __init__(self):
+        self.data = {}
+
+    def get(self, name):
+        return self.data.get(name, (None,))[0]
+
+    def set(self, name, value, ex=None):
+        self.data[name] = (value, ex)
+
+    def delete(self, name):
+        self.data.pop(name, None)
+
+    def eval(self, script, numkeys, name, expected, value, ex):
+        if self.get(name) != (expected or None):
+            return 0
+
+        self.set(name, value, ex=ex)
+        return 1
+
+
+class BrokenStore(object):
+    """A store which is always unavailable."""
+
+    def get(self, key):
+        raise IOError('unavailable')
+
+    set = delete = get
+
+
+SNAPSHOT = {
+    'href': 'https://api.stormpath.com/v1/accounts/xxx',
+    'email': u'r@rdegges.com',
+    'username': u'rdegges',
+    'given_name': u'Randall',
+    'middle_name': None,
+    'surname': u'D\xe9gges',
+    'status': u'ENABLED',
+    'modified_at': u'2015-08-31T00:00:00+00:00',
+    'groups': [
+        'https://api.stormpath.com/v1/groups/aaa',
+        'https://api.stormpath.com/v1/groups/bbb',
+    ],
+}
+
+
+class TestUserCache(TestCase):
+    """Our UserCache test suite."""
+
+    def test_get_and_set(self):
+        cache = UserCache()
+        self.assertEqual(cache.get('a'), None)
+
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertTrue('a' in cache)
+        self.assertEqual(len(cache), 1)
+
+    def test_ttl(self):
+        cache = UserCache(ttl=0.01)
+        cache.set('a', 1)
+        sleep(0.02)
+
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(len(cache), 0)
+
+    def test_stale_entries(self):
+        cache = UserCache(ttl=0.01, hard_ttl=60)
+        cache.set('a', 1)
+        self.assertEqual(cache.lookup('a'), (1, False))
+        sleep(0.02)
+
+        # Stale entries are still returned by `lookup`, but not by `get`.
+        self.assertEqual(cache.lookup('a'), (1, True))
+        self.assertEqual(cache.get('a'), None)
+
+    def test_hard_ttl(self):
+        cache = UserCache(ttl=0.01, hard_ttl=0.02)
+        cache.set('a', 1)
+        sleep(0.03)
+
+        self.assertEqual(cache.lookup('a'), (None, False))
+
+    def test_lru_eviction(self):
+        cache = UserCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+
+        # Touch 'a' so that 'b' is now the least recently used entry.
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_delete_and_clear(self):
+        cache = UserCache()
+        cache.set('a', 1)
+        cache.set('b', 2)
+
+        cache.delete('a')
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('b'), 2)
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_invalidate(self):
+        cache = UserCache()
+        cache.set('https://api.stormpath.com/v1/accounts/xxx', 1)
+
+        cache.invalidate(None, user=FakeUser('https://api.stormpath.com/v1/accounts/xxx'))
+        self.assertEqual(cache.get('https://api.stormpath.com/v1/accounts/xxx'), None)
+
+    def test_generations(self):
+        cache = UserCache()
+
+        # A fetch which started before an invalidation can't store its result.
+        generation = cache.generation('a')
+        cache.invalidate(None, user=FakeUser('a'))
+        self.assertFalse(cache.set('a', 'stale', generation=generation))
+        self.assertEqual(cache.get('a'), None)
+
+        # A fetch which started afterwards can.
+        generation = cache.generation('a')
+        self.assertTrue(cache.set('a', 'fresh', generation=generation))
+        self.assertEqual(cache.get('a'), 'fresh')
+
+        # Clearing the cache moves every key to a new generation.
+        generation = cache.generation('b')
+        cache.clear()
+        self.assertFalse(cache.set('b', 'stale', generation=generation))
+
+    def test_forgotten_generations(self):
+        cache = UserCache(max_size=2)
+
+        # Once 'a' is invalidated, its generation must never go back to the
+        # one a slow fetch saw -- not even after it has been forgotten.
+        generation = cache.generation('a')
+        cache.invalidate(None, user=FakeUser('a'))
+        cache.invalidate(None, user=FakeUser('b'))
+        cache.invalidate(None, user=FakeUser('c'))
+        self.assertFalse('a' in cache._generations)
+        self.assertFalse(cache.set('a', 'stale', generation=generation))
+
+        generation = cache.generation('a')
+        self.assertTrue(cache.set('a', 'fresh', generation=generation))
+
+
+class TestRefreshPool(TestCase):
+    """Our RefreshPool test suite."""
+
+    def test_submit(self):
+        pool = RefreshPool(size=1)
+        done = Event()
+
+        self.assertTrue(pool.submit('a', done.set))
+        self.assertTrue(done.wait(5))
+
+        pool._queue.join()
+        self.assertEqual(pool.stats['refreshed'], 1)
+        self.assertEqual(pool.stats['pending'], 0)
+
+    def test_failures_are_counted(self):
+        pool = RefreshPool(size=1)
+
+        def fail():
+            raise ValueError('oops')
+
+        pool.submit('a', fail)
+        pool._queue.join()
+        self.assertEqual(pool.stats['failed'], 1)
+
+    def test_duplicate_keys_are_not_queued(self):
+        pool = RefreshPool(size=1)
+        release = Event()
+
+        self.assertTrue(pool.submit('a', release.wait))
+        self.assertFalse(pool.submit('a', release.wait))
+
+        release.set()
+        pool._queue.join()
+        self.assertEqual(pool.stats['refreshed'], 1)
+
+    def test_full_queue_drops_refreshes(self):
+        pool = RefreshPool(size=1, max_queue=1)
+        release = Event()
+
+        # Occupy our only worker, then fill the queue.
+        started = Event()
+        pool.submit('a', lambda: started.set() or release.wait())
+        started.wait(5)
+        pool.submit('b', release.wait)
+
+        self.assertFalse(pool.submit('c', release.wait))
+        self.assertEqual(pool.stats['dropped'], 1)
+
+        release.set()
+        pool._queue.join()
+
+
+class TestUserEncoding(TestCase):
+    """Our binary user encoding test suite."""
+
+    def test_round_trip(self):
+        self.assertEqual(decode_user(encode_user(SNAPSHOT)), SNAPSHOT)
+
+    def test_unknown_version(self):
+        data = encode_user(SNAPSHOT)
+        self.assertEqual(decode_user(b'\xff' + data[1:]), None)
+
+    def test_corrupt_data(self):
+        self.assertEqual(decode_user(encode_user(SNAPSHOT)[:-3]), None)
+
+    def test_long_strings(self):
+        snapshot = dict(SNAPSHOT, given_name=u'x' * 70000)
+        self.assertEqual(decode_user(encode_user(snapshot)), snapshot)
+
+    def test_compact(self):
+        # Ensure our encoding is smaller than the equivalent JSON.
+        from json import dumps
+        self.assertTrue(len(encode_user(SNAPSHOT)) < len(dumps(SNAPSHOT)))
+
+
+class TestStores(TestCase):
+    """Our shared cache store test suite."""
+
+    def test_memory_store(self):
+        store = MemoryStore()
+        store.set('a', b'1', 60)
+        self.assertEqual(store.get('a'), b'1')
+
+        store.set('b', b'2', 0)
+        self.assertEqual(store.get('b'), None)
+
+        store.delete('a')
+        self.assertEqual(store.get('a'), None)
+
+    def test_memory_store_max_size(self):
+        store = MemoryStore(max_size=2)
+        store.set('a', b'1', 60)
+        store.set('b', b'2', 60)
+        store.set('a', b'3', 60)
+        store.set('c', b'4', 60)
+
+        self.assertEqual(store.get('a'), b'3')
+        self.assertEqual(store.get('b'), None)
+        self.assertEqual(store.get('c'), b'4')
+
+    def test_memory_store_compare_and_set(self):
+        store = MemoryStore()
+        self.assertTrue(store.compare_and_set('a', None, b'1', 60))
+        self.assertFalse(store.compare_and_set('a', None, b'2', 60))
+        self.assertFalse(store.compare_and_set('a', b'2', b'3', 60))
+        self.assertTrue(store.compare_and_set('a', b'1', b'3', 60))
+        self.assertEqual(store.get('a'), b'3')
+
+    def test_redis_store(self):
+        client = FakeRedis()
+        store = RedisStore(client=client, prefix='test:')
+
+        store.set('a', b'1', 60)
+        self.assertEqual(client.data['test:a'], (b'1', 60))
+        self.assertEqual(store.get('a'), b'1')
+
+        store.delete('a')
+        self.assertEqual(store.get('a'), None)
+
+    def test_redis_store_compare_and_set(self):
+        client = FakeRedis()
+        store = RedisStore(client=client, prefix='test:')
+
+        self.assertTrue(store.compare_and_set('a', None, b'1', 60))
+        self.assertFalse(store.compare_and_set('a', None, b'2', 60))
+        self.assertTrue(store.compare_and_set('a', b'1', b'3', 0.5))
+        self.assertEqual(client.data['test:a'], (b'3', 1))
+
+
+class TestSharedUserCache(TestCase):
+    """Our SharedUserCache test suite."""
+
+    def test_get_and_set(self):
+        cache = SharedUserCache(RedisStore(client=FakeRedis()))
+        self.assertEqual(cache.get(SNAPSHOT['href']), None)
+
+        cache.set(SNAPSHOT['href'], SNAPSHOT)
+        self.assertEqual(cache.get(SNAPSHOT['href']), SNAPSHOT)
+
+        self.assertEqual(cache.stats['hits'], 1)
+        self.assertEqual(cache.stats['misses'], 1)
+        self.assertEqual(cache.stats['errors'], 0)
+
+    def test_invalidate(self):
+        cache = SharedUserCache(MemoryStore())
+        cache.set(SNAPSHOT['href'], SNAPSHOT)
+
+        cache.invalidate(None, user=FakeUser(SNAPSHOT['href']))
+        self.assertEqual(cache.get(SNAPSHOT['href']), None)
+
+    def test_store_errors_are_misses(self):
+        cache = SharedUserCache(BrokenStore())
+        cache.set(SNAPSHOT['href'], SNAPSHOT)
+
+        self.assertEqual(cache.get(SNAPSHOT['href']), None)
+        self.assertEqual(cache.stats['misses'], 1)
+        self.assertEqual(cache.stats['errors'], 2)
+
+
+def store_hrefs(filename, worker):
+    """Store a batch of hrefs for `worker` (in a separate process)."""
+    for i in range(20):
+        store_cached_href(filename, '%s-%s' % (worker, i), 'https://api.stormpath.com/v1/applications/%s' % i)
+
+
+class TestHrefFiles(TestCase):
+    """Our href file test suite."""
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.filename = path.join(self.directory, 'hrefs.json')
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def test_missing_file(self):
+        self.assertEqual(load_cached_href(self.filename, 'myapp'), None)
+
+    def test_store_and_load(self):
+        store_cached_href(self.filename, 'myapp', 'https://api.stormpath.com/v1/applications/xxx')
+        store_cached_href(self.filename, 'other', 'https://api.stormpath.com/v1/applications/yyy')
+
+        self.assertEqual(load_cached_href(self.filename, 'myapp'), 'https://api.stormpath.com/v1/applications/xxx')
+        self.assertEqual(load_cached_href(self.filename, 'other'), 'https://api.stormpath.com/v1/applications/yyy')
+        self.assertEqual(load_cached_href(self.filename, 'missing'), None)
+
+    def test_corrupt_file(self):
+        with open(self.filename, 'w') as f:
+            f.write('{not json')
+
+        self.assertEqual(load_cached_href(self.filename, 'myapp'), None)
+
+        store_cached_href(self.filename, 'myapp', 'https://api.stormpath.com/v1/applications/xxx')
+        self.assertEqual(load_cached_href(self.filename, 'myapp'), 'https://api.stormpath.com/v1/applications/xxx')
+
+    def test_delete(self):
+        store_cached_href(self.filename, 'myapp', 'https://api.stormpath.com/v1/applications/xxx')
+        store_cached_href(self.filename, 'other', 'https://api.stormpath.com/v1/applications/yyy')
+
+        delete_cached_href(self.filename, 'myapp')
+        delete_cached_href(self.filename, 'missing')
+
+        self.assertEqual(load_cached_href(self.filename, 'myapp'), None)
+        self.assertEqual(load_cached_href(self.filename, 'other'), 'https://api.stormpath.com/v1/applications/yyy')
+
+    def test_temporary_files_are_cleaned_up(self):
+        # Renaming over a directory fails, which must not leave a temporary
+        # file behind.
+        mkdir(self.filename)
+        store_cached_href(self.filename, 'myapp', 'https://api.stormpath.com/v1/applications/xxx')
+
+        self.assertEqual(sorted(listdir(self.directory)), ['hrefs.json', 'hrefs.json.lock'])
+
+    @skipIf(cache.flock is None, 'fcntl is not available')
+    def test_concurrent_writers(self):
+        processes = [Process(target=store_hrefs, args=(self.filename, worker)) for worker in range(4)]
+        for process in processes:
+            process.start()
+
+        for process in processes:
+            process.join()
+
+        # No process may have overwritten another's hrefs.
+        for worker in range(4):
+            for i in range(20):
+                self.assertEqual(
+                    load_cached_href(self.filename, '%s-%s' % (worker, i)),
+                    'https://api.stormpath.com/v1/applications/%s' % i,
+                )
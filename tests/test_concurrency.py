@@ -0,0 +1,244 @@
+"""Tests for our concurrency helpers."""
+
+
+from threading import Event, Thread
+from time import sleep
+from unittest import TestCase
+
+from flask.ext.stormpath.concurrency import (
+    PRIORITY_BULK,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_REFRESH,
+    AdaptiveLimiter,
+    SingleFlight,
+)
+from flask.ext.stormpath.errors import ConcurrencyLimitError
+
+
+class TestSingleFlight(TestCase):
+    """Our SingleFlight test suite."""
+
+    def run_concurrently(self, flights, func, count=10):
+        """
+        Call `flights.do('key', func)` from `count` threads at once, and return
+        a list of (result, error) tuples.
+        """
+        outcomes = []
+
+        def worker():
+            try:
+                outcomes.append((flights.do('key', func), None))
+            except Exception as err:
+                outcomes.append((None, err))
+
+        threads = [Thread(target=worker) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+
+        # Give every thread a chance to join the in-flight call.
+        while len(flights) == 0:
+            sleep(0.001)
+        sleep(0.05)
+
+        return threads, outcomes
+
+    def test_calls_are_coalesced(self):
+        flights = SingleFlight()
+        release = Event()
+        calls = []
+
+        def func():
+            calls.append(1)
+            release.wait(5)
+            return 'result'
+
+        threads, outcomes = self.run_concurrently(flights, func)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(outcomes, [('result', None)] * 10)
+        self.assertEqual(len(flights), 0)
+
+    def test_errors_are_shared(self):
+        flights = SingleFlight()
+        release = Event()
+
+        def func():
+            release.wait(5)
+            raise ValueError('oops')
+
+        threads, outcomes = self.run_concurrently(flights, func)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(outcomes), 10)
+        for result, err in outcomes:
+            self.assertIsInstance(err, ValueError)
+
+    def test_sequential_calls_are_not_coalesced(self):
+        flights = SingleFlight()
+        calls = []
+
+        flights.do('key', calls.append, 1)
+        flights.do('key', calls.append, 2)
+        self.assertEqual(calls, [1, 2])
+
+
+class TestAdaptiveLimiter(TestCase):
+    """Our AdaptiveLimiter test suite."""
+
+    def test_additive_increase(self):
+        limiter = AdaptiveLimiter(initial_limit=2, max_limit=3)
+
+        # Every "round" of healthy calls raises the limit by about one.
+        for i in range(10):
+            limiter.acquire()
+            limiter.release(0.01)
+
+        self.assertEqual(limiter.stats['limit'], 3)
+        self.assertEqual(limiter.stats['accepted'], 10)
+
+    def test_multiplicative_decrease_on_latency(self):
+        limiter = AdaptiveLimiter(initial_limit=10, backoff=0.5, latency_tolerance=2.0)
+
+        limiter.acquire()
+        limiter.release(0.01)
+
+        limiter.acquire()
+        limiter.release(0.05)
+
+        self.assertEqual(limiter.stats['limit'], 5)
+
+    def test_latency_baselines_are_per_operation(self):
+        limiter = AdaptiveLimiter(initial_limit=10, backoff=0.5, latency_tolerance=2.0)
+
+        limiter.acquire()
+        limiter.release(0.01, operation='load_user')
+
+        # A login is much slower than a cached read, but that's normal.
+        limiter.acquire()
+        limiter.release(0.05, operation='login')
+        self.assertEqual(limiter.stats['limit'], 10)
+
+        limiter.acquire()
+        limiter.release(0.2, operation='login')
+        self.assertEqual(limiter.stats['limit'], 5)
+        self.assertEqual(limiter.stats['best_latencies'], {'load_user': 0.01, 'login': 0.05})
+
+    def test_multiplicative_decrease_on_failure(self):
+        limiter = AdaptiveLimiter(initial_limit=10, backoff=0.5)
+
+        limiter.acquire()
+        limiter.release(0.01, failed=True)
+
+        self.assertEqual(limiter.stats['limit'], 5)
+
+    def test_min_limit(self):
+        limiter = AdaptiveLimiter(initial_limit=2, min_limit=1, backoff=0.1)
+
+        limiter.acquire()
+        limiter.release(0, failed=True)
+
+        self.assertEqual(limiter.stats['limit'], 1)
+
+    def test_calls_which_werent_made_dont_count(self):
+        limiter = AdaptiveLimiter(initial_limit=10)
+
+        limiter.acquire()
+        limiter.release()
+
+        self.assertEqual(limiter.limit, 10)
+        self.assertEqual(limiter.stats['in_flight'], 0)
+
+    def test_rejects_when_queue_is_full(self):
+        limiter = AdaptiveLimiter(initial_limit=1, queue_size=0)
+
+        limiter.acquire()
+        self.assertRaises(ConcurrencyLimitError, limiter.acquire)
+        self.assertEqual(limiter.stats['rejected'], 1)
+
+    def test_queue_timeout(self):
+        limiter = AdaptiveLimiter(initial_limit=1, queue_timeout=0.01)
+
+        limiter.acquire()
+        self.assertRaises(ConcurrencyLimitError, limiter.acquire)
+        self.assertEqual(limiter.stats['queued'], 0)
+
+    def test_queued_calls_get_released_slots(self):
+        limiter = AdaptiveLimiter(initial_limit=1, queue_timeout=5)
+        acquired = Event()
+
+        limiter.acquire()
+
+        def waiter():
+            limiter.acquire()
+            acquired.set()
+
+        thread = Thread(target=waiter)
+        thread.start()
+        sleep(0.05)
+
+        self.assertFalse(acquired.is_set())
+        self.assertEqual(limiter.stats['queued'], 1)
+
+        limiter.release(0.01)
+        self.assertTrue(acquired.wait(5))
+        thread.join()
+
+    def test_priority_shares(self):
+        limiter = AdaptiveLimiter(initial_limit=4, queue_size=0, shares={PRIORITY_BULK: 0.5})
+
+        # Bulk calls may only use half of the limit...
+        limiter.acquire(priority=PRIORITY_BULK)
+        limiter.acquire(priority=PRIORITY_BULK)
+        self.assertRaises(ConcurrencyLimitError, limiter.acquire, priority=PRIORITY_BULK)
+
+        # ...which leaves room for interactive calls.
+        limiter.acquire(priority=PRIORITY_INTERACTIVE)
+        limiter.acquire(priority=PRIORITY_INTERACTIVE)
+        self.assertRaises(ConcurrencyLimitError, limiter.acquire, priority=PRIORITY_INTERACTIVE)
+
+        self.assertEqual(limiter.stats['in_flight_by_priority'], {
+            PRIORITY_INTERACTIVE: 2,
+            PRIORITY_REFRESH: 0,
+            PRIORITY_BULK: 2,
+        })
+
+    def test_unknown_priority(self):
+        limiter = AdaptiveLimiter()
+        self.assertRaises(ValueError, limiter.acquire, priority='urgent')
+
+    def test_queued_calls_are_weighted_by_priority(self):
+        limiter = AdaptiveLimiter(initial_limit=1, queue_timeout=5, weights={PRIORITY_INTERACTIVE: 3, PRIORITY_BULK: 1})
+        order = []
+        threads = []
+
+        limiter.acquire()
+
+        def waiter(priority):
+            limiter.acquire(priority=priority)
+            order.append(priority)
+            limiter.release(priority=priority)
+
+        # Queue up bulk calls first, then interactive calls.
+        for priority in [PRIORITY_BULK] * 4 + [PRIORITY_INTERACTIVE] * 4:
+            thread = Thread(target=waiter, args=(priority,))
+            thread.start()
+            threads.append(thread)
+            sleep(0.01)
+
+        self.assertEqual(limiter.stats['queued_by_priority'][PRIORITY_BULK], 4)
+        self.assertEqual(limiter.stats['queued_by_priority'][PRIORITY_INTERACTIVE], 4)
+
+        limiter.release()
+        for thread in threads:
+            thread.join()
+
+        # Interactive calls jump ahead of the bulk calls queued before them
+        # (3 to 1), but bulk calls still get a turn.
+        self.assertEqual(order[0], PRIORITY_INTERACTIVE)
+        self.assertEqual(order[:4].count(PRIORITY_INTERACTIVE), 3)
+        self.assertEqual(sorted(order), sorted([PRIORITY_BULK] * 4 + [PRIORITY_INTERACTIVE] * 4))
@@ -0,0 +1,82 @@
+"""Tests for our per-request deadlines."""
+
+
+from datetime import timedelta
+from time import sleep
+from unittest import TestCase
+
+from flask import Flask
+from stormpath.error import Error as StormpathError
+from flask.ext.stormpath.deadlines import (
+    call_within_deadline,
+    check_deadline,
+    remaining_time,
+    set_deadline,
+    start_request_deadline,
+)
+from flask.ext.stormpath.errors import DeadlineExceededError
+from flask.ext.stormpath.transport import cap_timeout
+
+
+def fail():
+    raise IOError('timed out')
+
+
+class TestDeadlines(TestCase):
+    """Our deadline test suite."""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['STORMPATH_REQUEST_DEADLINE'] = timedelta(seconds=1)
+
+    def test_no_deadline(self):
+        with self.app.app_context():
+            self.assertEqual(remaining_time(), None)
+            check_deadline()
+
+        # Outside of an app context, there's never a deadline.
+        self.assertEqual(remaining_time(), None)
+
+    def test_start_request_deadline(self):
+        with self.app.app_context():
+            start_request_deadline()
+            self.assertTrue(0 < remaining_time() <= 1)
+
+    def test_deadlines_are_per_context(self):
+        with self.app.app_context():
+            set_deadline(1)
+
+        with self.app.app_context():
+            self.assertEqual(remaining_time(), None)
+
+    def test_exceeded_deadline(self):
+        with self.app.app_context():
+            set_deadline(0.01)
+            check_deadline()
+            sleep(0.02)
+
+            self.assertRaises(DeadlineExceededError, check_deadline)
+
+    def test_call_within_deadline(self):
+        with self.app.app_context():
+            set_deadline(1)
+            self.assertEqual(call_within_deadline(lambda: 'ok'), 'ok')
+
+            # Errors raised before the deadline are left alone.
+            self.assertRaises(IOError, call_within_deadline, fail)
+
+            # Errors raised after the deadline are deadline errors.
+            set_deadline(0)
+            self.assertRaises(DeadlineExceededError, call_within_deadline, fail)
+
+            # But real client error responses are not.
+            def wrong_password():
+                raise StormpathError({'status': 400, 'message': 'Invalid username or password.'})
+
+            self.assertRaises(StormpathError, call_within_deadline, wrong_password)
+
+    def test_cap_timeout(self):
+        self.assertEqual(cap_timeout(None, 0.3), 0.3)
+        self.assertEqual(cap_timeout(5, 0.3), 0.3)
+        self.assertEqual(cap_timeout(0.1, 0.3), 0.1)
+        self.assertEqual(cap_timeout((5, None), 0.3), (0.3, 0.3))
@@ -1,8 +1,10 @@
 """Run tests against our custom decorators."""
 
 
-from flask.ext.stormpath import User
-from flask.ext.stormpath.decorators import groups_required
+from json import loads
+
+from flask.ext.stormpath import User, current_user
+from flask.ext.stormpath.decorators import groups_required, shed_load, token_required
 
 from .helpers import StormpathTestCase
 
@@ -107,3 +109,256 @@ class TestGroupsRequired(StormpathTestCase):
             # to one of the required groups.
             resp = c.get('/test')
             self.assertEqual(resp.status_code, 200)
+
+
+    def test_group_objects_and_hrefs(self):
+        @self.app.route('/test')
+        @groups_required([self.admins, self.developers.href])
+        def some_view():
+            """
+            A view which requires a user to be a member of both the admins and
+            developers groups (specified as a Group object and an href).
+            """
+            return 'hello, world'
+
+        with self.app.test_client() as c:
+
+            # Log our user in.
+            c.post('/login', data={
+                'login': self.user.email,
+                'password': 'woot1LoveCookies!',
+            })
+
+            self.user.add_group(self.admins)
+            resp = c.get('/test')
+            self.assertEqual(resp.status_code, 302)
+
+            self.user.add_group(self.developers)
+            resp = c.get('/test')
+            self.assertEqual(resp.status_code, 200)
+
+    def test_policy_expressions(self):
+        @self.app.route('/test')
+        @groups_required(policy='admins | (developers & !contractors)')
+        def some_view():
+            """
+            A view which requires a user to be an admin, or a developer who
+            isn't a contractor.
+            """
+            return 'hello, world'
+
+        with self.app.app_context():
+            contractors = self.application.groups.create({
+                'name': 'contractors',
+            })
+
+        with self.app.test_client() as c:
+
+            # Log our user in.
+            c.post('/login', data={
+                'login': self.user.email,
+                'password': 'woot1LoveCookies!',
+            })
+
+            resp = c.get('/test')
+            self.assertEqual(resp.status_code, 302)
+
+            self.user.add_group(self.developers)
+            self.user.add_group(contractors)
+            resp = c.get('/test')
+            self.assertEqual(resp.status_code, 302)
+
+            self.user.add_group(self.admins)
+            resp = c.get('/test')
+            self.assertEqual(resp.status_code, 200)
+
+    def test_plain_strings_are_group_names(self):
+        with self.app.app_context():
+            research = self.application.groups.create({'name': 'R&D'})
+
+        @self.app.route('/test')
+        @groups_required('R&D')
+        def some_view():
+            """A view which requires a user to be in the "R&D" Group."""
+            return 'hello, world'
+
+        # Names which look like (invalid) policies are still just names.
+        groups_required('Admins (EU)')
+        self.assertRaises(TypeError, groups_required)
+
+        with self.app.test_client() as c:
+
+            # Log our user in.
+            c.post('/login', data={
+                'login': self.user.email,
+                'password': 'woot1LoveCookies!',
+            })
+
+            resp = c.get('/test')
+            self.assertEqual(resp.status_code, 302)
+
+            self.user.add_group(research)
+            resp = c.get('/test')
+            self.assertEqual(resp.status_code, 200)
+
+    def test_memberships_fetched_once_per_request(self):
+        @self.app.route('/test')
+        @groups_required(['admins'])
+        @groups_required(['developers'])
+        @groups_required(['admins', 'developers'], all=False)
+        def some_view():
+            """A view with several stacked group requirements."""
+            return 'hello, world'
+
+        calls = []
+        original = User.get_group_hrefs
+
+        def get_group_hrefs(user):
+            calls.append(user.href)
+            return original(user)
+
+        User.get_group_hrefs = get_group_hrefs
+
+        try:
+            with self.app.test_client() as c:
+
+                # Log our user in.
+                c.post('/login', data={
+                    'login': self.user.email,
+                    'password': 'woot1LoveCookies!',
+                })
+
+                self.user.add_group(self.admins)
+                self.user.add_group(self.developers)
+
+                resp = c.get('/test')
+                self.assertEqual(resp.status_code, 200)
+                self.assertEqual(len(calls), 1)
+        finally:
+            User.get_group_hrefs = original
+
+
+class TestTokenRequired(StormpathTestCase):
+
+    def setUp(self):
+        """Provision a single user account, and enable access tokens."""
+        super(TestTokenRequired, self).setUp()
+        self.app.config['STORMPATH_ENABLE_ACCESS_TOKENS'] = True
+        self.app.stormpath_manager.init_routes(self.app)
+
+        with self.app.app_context():
+            self.user = User.create(
+                given_name = 'Randall',
+                surname = 'Degges',
+                email = 'r@rdegges.com',
+                password = 'woot1LoveCookies!',
+            )
+
+        @self.app.route('/api/me')
+        @token_required
+        def api_me():
+            """A view which requires a valid access token."""
+            return current_user.href
+
+    def get_token(self, c):
+        """Return a new access token for our user."""
+        resp = c.post('/oauth/token', data={
+            'login': 'r@rdegges.com',
+            'password': 'woot1LoveCookies!',
+        })
+        self.assertEqual(resp.status_code, 200)
+
+        return loads(resp.data.decode('utf-8'))['access_token']
+
+    def test_requires_token(self):
+        with self.app.test_client() as c:
+            self.assertEqual(c.get('/api/me').status_code, 401)
+
+            resp = c.get('/api/me', headers={'Authorization': 'Bearer xxx'})
+            self.assertEqual(resp.status_code, 401)
+
+    def test_valid_token(self):
+        with self.app.test_client() as c:
+            token = self.get_token(c)
+
+            resp = c.get('/api/me', headers={'Authorization': 'Bearer %s' % token})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.data.decode('utf-8'), self.user.href)
+
+    def test_secret_rotation(self):
+        self.app.config['STORMPATH_ACCESS_TOKEN_SECRETS'] = ['old']
+
+        with self.app.test_client() as c:
+            token = self.get_token(c)
+
+            # Rotate in a new secret: old tokens must still be accepted.
+            self.app.config['STORMPATH_ACCESS_TOKEN_SECRETS'] = ['new', 'old']
+            resp = c.get('/api/me', headers={'Authorization': 'Bearer %s' % token})
+            self.assertEqual(resp.status_code, 200)
+
+            # Retire the old secret: old tokens must be rejected.
+            self.app.config['STORMPATH_ACCESS_TOKEN_SECRETS'] = ['new']
+            resp = c.get('/api/me', headers={'Authorization': 'Bearer %s' % token})
+            self.assertEqual(resp.status_code, 401)
+
+
+class TestShedLoad(StormpathTestCase):
+
+    def setUp(self):
+        """Enable load shedding, and add a view which is always busy."""
+        super(TestShedLoad, self).setUp()
+        self.app.config['STORMPATH_LOAD_SHEDDING_ENABLED'] = True
+        self.app.stormpath_manager.init_resilience(self.app)
+
+        @self.app.route('/signup', methods=['GET', 'POST'])
+        @shed_load
+        def signup():
+            """A view which is called while the process is at capacity."""
+            return 'signed up!'
+
+        self.shedder = self.app.stormpath_load_shedder
+        for i in range(self.shedder.max_in_flight):
+            self.shedder.enter()
+
+    def test_sheds_posts(self):
+        with self.app.test_client() as c:
+            resp = c.post('/signup', data={'email': 'r@rdegges.com'})
+            self.assertEqual(resp.status_code, 503)
+            self.assertEqual(resp.headers['Retry-After'], '1')
+
+            # Shed requests never count as in flight.
+            self.assertEqual(self.shedder.stats['in_flight'], self.shedder.max_in_flight)
+            self.assertEqual(self.shedder.stats['shed'], 1)
+
+    def test_built_in_views_are_shed(self):
+        with self.app.test_client() as c:
+            resp = c.post('/login', data={
+                'login': 'r@rdegges.com',
+                'password': 'woot1LoveCookies!',
+            })
+            self.assertEqual(resp.status_code, 503)
+
+    def test_gets_are_not_shed(self):
+        with self.app.test_client() as c:
+            self.assertEqual(c.get('/signup').status_code, 200)
+            self.assertEqual(c.get('/login').status_code, 200)
+
+    def test_logged_in_sessions_are_not_shed(self):
+        with self.app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess['user_id'] = 'https://api.stormpath.com/v1/accounts/xxx'
+
+            # The user is never loaded (which could call Stormpath) to decide.
+            self.app.login_manager.user_callback = lambda account_href: self.fail('The user was loaded.')
+
+            resp = c.post('/signup', data={'email': 'r@rdegges.com'})
+
+            self.assertEqual(resp.status_code, 200)
+
+    def test_capacity_is_released(self):
+        self.shedder.exit()
+
+        with self.app.test_client() as c:
+            resp = c.post('/signup', data={'email': 'r@rdegges.com'})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(self.shedder.stats['in_flight'], self.shedder.max_in_flight - 1)
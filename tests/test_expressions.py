@@ -0,0 +1,53 @@
+"""Tests for our authorization policy expressions."""
+
+
+from unittest import TestCase
+
+from flask.ext.stormpath.errors import InvalidPolicyError
+from flask.ext.stormpath.expressions import compile_policy
+
+
+class TestCompilePolicy(TestCase):
+    """Our compile_policy test suite."""
+
+    def test_single_group(self):
+        policy = compile_policy('(admins)')
+        self.assertEqual(policy.groups, frozenset(['admins']))
+        self.assertTrue(policy.evaluate(set(['admins'])))
+        self.assertFalse(policy.evaluate(set(['developers'])))
+
+    def test_operators(self):
+        policy = compile_policy('admins | (developers & !contractors)')
+        self.assertEqual(policy.groups, frozenset(['admins', 'developers', 'contractors']))
+
+        self.assertTrue(policy.evaluate(set(['admins'])))
+        self.assertTrue(policy.evaluate(set(['admins', 'contractors'])))
+        self.assertTrue(policy.evaluate(set(['developers'])))
+        self.assertFalse(policy.evaluate(set(['developers', 'contractors'])))
+        self.assertFalse(policy.evaluate(set()))
+
+    def test_precedence(self):
+        # `&` binds tighter than `|`, and `!` binds tighter than `&`.
+        policy = compile_policy('a | b & !c')
+        self.assertTrue(policy.evaluate(set(['a', 'c'])))
+        self.assertTrue(policy.evaluate(set(['b'])))
+        self.assertFalse(policy.evaluate(set(['b', 'c'])))
+
+        policy = compile_policy('!!a')
+        self.assertTrue(policy.evaluate(set(['a'])))
+
+    def test_quoted_names_and_hrefs(self):
+        policy = compile_policy('"paid users" & !https://api.stormpath.com/v1/groups/xxx')
+        self.assertEqual(policy.groups, frozenset([
+            'paid users',
+            'https://api.stormpath.com/v1/groups/xxx',
+        ]))
+        self.assertTrue(policy.evaluate(set(['paid users'])))
+
+    def test_policies_are_shared(self):
+        self.assertTrue(compile_policy('a & b') is compile_policy('a & b'))
+
+    def test_invalid_policies(self):
+        for expression in ['', '&', 'a &', 'a b', '(a | b', 'a | b)', '!', 'a | "b']:
+            self.assertRaises(InvalidPolicyError, compile_policy, expression)
+
@@ -0,0 +1,86 @@
+"""Tests for our Group helpers."""
+
+
+from unittest import TestCase
+
+from flask.ext.stormpath.groups import GroupCatalog, normalize_groups
+
+
+class FakeGroup(object):
+    """A minimal stand-in for a Stormpath Group."""
+
+    def __init__(self, name, href):
+        self.name = name
+        self.href = href
+
+
+class FakeApplication(object):
+    """A minimal stand-in for a Stormpath Application."""
+
+    def __init__(self, groups):
+        self.href = 'https://api.stormpath.com/v1/applications/xxx'
+        self.groups = groups
+
+
+ADMINS = FakeGroup('admins', 'https://api.stormpath.com/v1/groups/aaa')
+DEVELOPERS = FakeGroup('developers', 'https://api.stormpath.com/v1/groups/bbb')
+
+
+class TestNormalizeGroups(TestCase):
+    """Our normalize_groups test suite."""
+
+    def test_normalize(self):
+        self.assertEqual(
+            normalize_groups([ADMINS, 'developers', 'https://api.stormpath.com/v1/groups/ccc']),
+            frozenset([ADMINS.href, 'developers', 'https://api.stormpath.com/v1/groups/ccc']),
+        )
+
+    def test_single_group(self):
+        self.assertEqual(normalize_groups('admins'), frozenset(['admins']))
+        self.assertEqual(normalize_groups(ADMINS), frozenset([ADMINS.href]))
+
+
+class TestGroupCatalog(TestCase):
+    """Our GroupCatalog test suite."""
+
+    def setUp(self):
+        self.catalog = GroupCatalog()
+        self.catalog.load(FakeApplication([ADMINS, DEVELOPERS]))
+
+    def test_lookups(self):
+        self.assertEqual(len(self.catalog), 2)
+        self.assertEqual(self.catalog.get_hrefs('admins'), frozenset([ADMINS.href]))
+        self.assertEqual(self.catalog.get_name(DEVELOPERS.href), 'developers')
+        self.assertEqual(self.catalog.get_hrefs('contractors'), frozenset())
+
+    def test_duplicate_names(self):
+        # Groups in different Directories can share a name.
+        other_admins = FakeGroup('admins', 'https://api.stormpath.com/v1/groups/ccc')
+        self.catalog.load(FakeApplication([ADMINS, other_admins]))
+
+        self.assertEqual(self.catalog.get_hrefs('admins'), frozenset([ADMINS.href, other_admins.href]))
+        self.assertTrue(self.catalog.is_member('admins', frozenset([other_admins.href])))
+
+    def test_unknown_names_reload(self):
+        contractors = FakeGroup('contractors', 'https://api.stormpath.com/v1/groups/ccc')
+        application = FakeApplication([ADMINS, DEVELOPERS, contractors])
+
+        def ensure_loaded():
+            if self.catalog._loaded_at is None:
+                self.catalog.load(application)
+
+        self.catalog.ensure_loaded = ensure_loaded
+
+        # The catalog was just loaded, so we don't reload it yet.
+        self.assertEqual(self.catalog.get_hrefs('contractors'), frozenset())
+
+        self.catalog.miss_interval = 0
+        self.assertEqual(self.catalog.get_hrefs('contractors'), frozenset([contractors.href]))
+
+    def test_check(self):
+        memberships = frozenset([ADMINS.href])
+
+        self.assertTrue(self.catalog.check(frozenset(['admins']), memberships))
+        self.assertFalse(self.catalog.check(frozenset(['admins', DEVELOPERS.href]), memberships))
+        self.assertTrue(self.catalog.check(frozenset(['admins', DEVELOPERS.href]), memberships, all=False))
+        self.assertFalse(self.catalog.check(frozenset(['contractors']), memberships, all=False))
@@ -1,7 +1,8 @@
 """Tests for our data models."""
 
 
-from flask.ext.stormpath.models import User
+from flask.ext.stormpath.models import User, get_update_operation
+from flask.ext.stormpath.resilience import stormpath_priority
 from stormpath.resources.account import Account
 
 from .helpers import StormpathTestCase
@@ -114,6 +115,14 @@ class TestUser(StormpathTestCase):
             )
             self.assertEqual(user.is_authenticated(), True)
 
+    def test_update_operation(self):
+        with self.app.app_context():
+            self.assertEqual(get_update_operation(), 'update')
+
+            # Updates made by bulk jobs are admin operations.
+            with stormpath_priority('bulk'):
+                self.assertEqual(get_update_operation(), 'admin')
+
     def test_create(self):
         with self.app.app_context():
 
@@ -201,3 +210,22 @@ class TestUser(StormpathTestCase):
                 'woot1LoveCookies!',
             )
             self.assertEqual(user.href, original_href)
+
+    def test_from_login_with_expansion(self):
+        self.app.config['STORMPATH_USER_EXPAND'] = ('groups', 'customData')
+
+        with self.app.app_context():
+            user = User.create(
+                email = 'r@rdegges.com',
+                password = 'woot1LoveCookies!',
+                given_name = 'Randall',
+                surname = 'Degges',
+                custom_data = {'favorite_color': 'blue'},
+            )
+            group = self.application.groups.create({'name': 'admins'})
+            user.add_group(group)
+
+            # Ensure expanded properties are available on the logged in user.
+            user = User.from_login('r@rdegges.com', 'woot1LoveCookies!')
+            self.assertEqual(user.custom_data['favorite_color'], 'blue')
+            self.assertEqual([g.href for g in user.groups], [group.href])
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""Tests for our password policy helpers."""
+
+
+from unittest import TestCase
+
+from flask.ext.stormpath.passwords import PasswordPolicy, check_password, count_characters
+
+
+class Resource(object):
+    """A stand-in for a Stormpath resource."""
+
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+def make_application(store):
+    """Return a stand-in Application whose default account store is `store`."""
+    return Resource(default_account_store_mapping=Resource(account_store=store))
+
+
+def make_directory(href='https://api.stormpath.com/v1/directories/xxx', **strength):
+    """Return a stand-in Directory with the given password strength rules."""
+    return Resource(href=href, password_policy=Resource(strength=Resource(**strength)))
+
+
+class TestCheckPassword(TestCase):
+    """Our check_password test suite."""
+
+    def test_counts_characters(self):
+        self.assertEqual(count_characters(u'aB3!é'), {
+            'lower_case': 2,
+            'upper_case': 1,
+            'numeric': 1,
+            'symbol': 1,
+            'diacritic': 1,
+        })
+
+    def test_counts_every_other_character_as_a_symbol(self):
+        self.assertEqual(count_characters(u' \t€«»')['symbol'], 5)
+        self.assertEqual(check_password(u'correct horse', {'min_symbol': 1}), [])
+
+    def test_lengths(self):
+        rules = {'min_length': 8, 'max_length': 10}
+
+        self.assertEqual(check_password('hilol', rules), ['Account password minimum length not satisfied.'])
+        self.assertEqual(check_password('hilolwoothilol', rules), ['Account password maximum length exceeded.'])
+        self.assertEqual(check_password('hilolwoot', rules), [])
+
+    def test_character_classes(self):
+        rules = {'min_lower_case': 1, 'min_upper_case': 1, 'min_numeric': 2, 'min_symbol': 1}
+
+        self.assertEqual(check_password('hilolwoot1', rules), [
+            'Password requires at least 1 uppercase character.',
+            'Password requires at least 2 numeric characters.',
+            'Password requires at least 1 symbol.',
+        ])
+        self.assertEqual(check_password('woot1LoveCookies!2', rules), [])
+
+    def test_no_rules(self):
+        self.assertEqual(check_password('a', {}), [])
+
+
+class TestPasswordPolicy(TestCase):
+    """Our PasswordPolicy test suite."""
+
+    def test_load(self):
+        policy = PasswordPolicy()
+        policy.load(make_application(make_directory(min_length=8, max_length=100, min_numeric=1)))
+
+        self.assertEqual(policy.rules['min_length'], 8)
+        self.assertEqual(policy.rules['max_length'], 100)
+        self.assertEqual(policy.rules['min_numeric'], 1)
+        self.assertEqual(policy.rules['min_symbol'], None)
+
+    def test_group_account_store(self):
+        policy = PasswordPolicy()
+        group = Resource(directory=make_directory(min_length=12))
+        policy.load(make_application(group))
+
+        self.assertEqual(policy.rules['min_length'], 12)
+
+    def test_no_account_store(self):
+        policy = PasswordPolicy()
+        policy.load(Resource(default_account_store_mapping=None))
+
+        self.assertEqual(policy.rules, {})
+
+    def test_load_directory(self):
+        policy = PasswordPolicy()
+        policy.load(make_application(make_directory(min_length=8)))
+        policy.load_directory(make_directory('https://api.stormpath.com/v1/directories/yyy', min_length=12))
+
+        # Each Directory has its own rules.
+        self.assertEqual(policy.rules['min_length'], 8)
+        self.assertEqual(policy._directories['https://api.stormpath.com/v1/directories/yyy'][0]['min_length'], 12)
+
+    def test_refresh(self):
+        policy = PasswordPolicy()
+        policy.load(make_application(make_directory(min_length=8)))
+        policy.load_directory(make_directory(min_length=8))
+        self.assertNotEqual(policy._loaded_at, None)
+
+        policy.refresh()
+        self.assertEqual(policy._loaded_at, None)
+        self.assertEqual(policy._directories, {})
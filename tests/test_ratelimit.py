@@ -0,0 +1,128 @@
+"""Tests for our rate limiting helpers."""
+
+
+from time import sleep
+from unittest import TestCase
+
+from flask.ext.stormpath.cache import MemoryStore
+from flask.ext.stormpath.errors import RateLimitExceededError
+from flask.ext.stormpath.ratelimit import RateLimiter, normalize_login
+
+
+class BrokenStore(object):
+    """A store which is always unavailable."""
+
+    def get(self, key):
+        raise IOError('connection refused')
+
+    def set(self, key, value, ttl):
+        raise IOError('connection refused')
+
+    def delete(self, key):
+        raise IOError('connection refused')
+
+
+class RacingStore(MemoryStore):
+    """
+    A MemoryStore where another limiter records a request for a key, right
+    after the first time it is read.
+    """
+    def __init__(self, other, key):
+        super(RacingStore, self).__init__()
+        self.other = other
+        self.key = key
+
+    def get(self, key):
+        value = super(RacingStore, self).get(key)
+
+        if self.other is not None:
+            other, self.other = self.other, None
+            other.hit(self.key)
+
+        return value
+
+
+class TestRateLimiter(TestCase):
+    """Our RateLimiter test suite."""
+
+    def test_allows_bursts_up_to_rate(self):
+        limiter = RateLimiter(3, 60)
+
+        for i in range(3):
+            limiter.hit('1.2.3.4')
+
+        try:
+            limiter.hit('1.2.3.4')
+            self.fail('The request should have been limited.')
+        except RateLimitExceededError as err:
+            self.assertTrue(0 < err.retry_after <= 20)
+
+        # Other keys aren't affected.
+        limiter.hit('5.6.7.8')
+
+        self.assertEqual(limiter.stats['allowed'], 4)
+        self.assertEqual(limiter.stats['limited'], 1)
+
+    def test_refills(self):
+        limiter = RateLimiter(2, 0.1)
+
+        limiter.hit('key')
+        limiter.hit('key')
+        self.assertRaises(RateLimitExceededError, limiter.hit, 'key')
+
+        # One token is refilled every 0.05 seconds.
+        sleep(0.06)
+        limiter.hit('key')
+        self.assertRaises(RateLimitExceededError, limiter.hit, 'key')
+
+    def test_max_keys(self):
+        limiter = RateLimiter(1, 60, max_keys=2)
+
+        limiter.hit('a')
+        limiter.hit('b')
+        limiter.hit('c')
+        self.assertEqual(limiter.stats['keys'], 2)
+
+        # The least recently used key was dropped.
+        limiter.hit('a')
+        self.assertRaises(RateLimitExceededError, limiter.hit, 'c')
+
+    def test_shared_store(self):
+        store = MemoryStore()
+        first = RateLimiter(2, 60, store=store, prefix='ratelimit:')
+        second = RateLimiter(2, 60, store=store, prefix='ratelimit:')
+
+        # Both limiters share the same state.
+        first.hit('key')
+        second.hit('key')
+        self.assertRaises(RateLimitExceededError, first.hit, 'key')
+        self.assertRaises(RateLimitExceededError, second.hit, 'key')
+
+        self.assertEqual(len(first._arrivals), 0)
+        self.assertTrue(store.get('ratelimit:key'))
+
+    def test_shared_store_updates_are_atomic(self):
+        other = RateLimiter(1, 60)
+        store = RacingStore(other, 'key')
+        other.store = store
+        limiter = RateLimiter(1, 60, store=store)
+
+        # The other limiter takes the only token while we're deciding, so we
+        # must notice, and reject the request.
+        self.assertRaises(RateLimitExceededError, limiter.hit, 'key')
+        self.assertEqual(other.stats['allowed'], 1)
+        self.assertEqual(limiter.stats['errors'], 0)
+
+    def test_store_failures_allow_requests(self):
+        limiter = RateLimiter(1, 60, store=BrokenStore())
+
+        limiter.hit('key')
+        limiter.hit('key')
+        self.assertEqual(limiter.stats['errors'], 4)
+
+
+class TestNormalizeLogin(TestCase):
+    """Our normalize_login test suite."""
+
+    def test_normalizes(self):
+        self.assertEqual(normalize_login('  R@RDegges.com '), 'r@rdegges.com')
@@ -0,0 +1,348 @@
+"""Tests for our resilience helpers (circuit breaker, bulkhead, load shedding, retries, and hedging)."""
+
+
+from threading import current_thread
+from time import sleep, time
+from unittest import TestCase
+
+from flask import Flask
+from stormpath.error import Error as StormpathError
+
+from flask.ext.stormpath.concurrency import AdaptiveLimiter
+from flask.ext.stormpath.deadlines import set_deadline
+from flask.ext.stormpath.errors import BulkheadFullError, CircuitOpenError, DeadlineExceededError, OverloadedError
+from flask.ext.stormpath.resilience import (
+    Bulkhead,
+    CircuitBreaker,
+    Hedger,
+    LoadShedder,
+    RetryPolicy,
+    is_failure,
+)
+from flask.ext.stormpath.signals import circuit_closed, circuit_half_opened, circuit_opened
+
+
+def fail():
+    raise IOError('connection reset')
+
+
+class Flaky(object):
+    """A callable which fails a given number of times before succeeding."""
+
+    def __init__(self, failures, error=IOError):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error('connection reset')
+
+        return 'ok'
+
+
+class TestIsFailure(TestCase):
+    """Our is_failure test suite."""
+
+    def test_network_errors(self):
+        self.assertTrue(is_failure(IOError('connection reset')))
+
+    def test_stormpath_errors(self):
+        self.assertTrue(is_failure(StormpathError({'status': 503, 'message': 'unavailable'})))
+        self.assertTrue(is_failure(StormpathError({'status': 429, 'message': 'slow down'})))
+        self.assertFalse(is_failure(StormpathError({'status': 400, 'message': 'invalid password'})))
+        self.assertFalse(is_failure(StormpathError({'status': 404, 'message': 'not found'})))
+
+    def test_other_errors(self):
+        self.assertFalse(is_failure(ValueError('oops')))
+
+
+class TestCircuitBreaker(TestCase):
+    """Our CircuitBreaker test suite."""
+
+    def setUp(self):
+        self.signals = []
+        for signal in (circuit_opened, circuit_half_opened, circuit_closed):
+            signal.connect(self.receiver)
+
+    def tearDown(self):
+        for signal in (circuit_opened, circuit_half_opened, circuit_closed):
+            signal.disconnect(self.receiver)
+
+    def receiver(self, sender):
+        self.signals.append(sender.state)
+
+    def test_opens_on_failure_rate(self):
+        breaker = CircuitBreaker(failure_rate=0.5, min_calls=4, window=10)
+
+        breaker.call(lambda: None)
+        breaker.call(lambda: None)
+        self.assertRaises(IOError, breaker.call, fail)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+        self.assertRaises(IOError, breaker.call, fail)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.signals, [CircuitBreaker.OPEN])
+
+        # Calls are now rejected immediately.
+        self.assertRaises(CircuitOpenError, breaker.call, lambda: None)
+        self.assertEqual(breaker.stats['rejected'], 1)
+
+    def test_client_errors_dont_open(self):
+        breaker = CircuitBreaker(min_calls=2)
+
+        def invalid_password():
+            raise StormpathError({'status': 400, 'message': 'invalid password'})
+
+        for i in range(5):
+            self.assertRaises(StormpathError, breaker.call, invalid_password)
+
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_slow_calls_are_failures(self):
+        breaker = CircuitBreaker(min_calls=1, slow_call_duration=0.01)
+
+        breaker.call(sleep, 0.02)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    def test_half_open_probe_success(self):
+        breaker = CircuitBreaker(min_calls=1, reset_timeout=0.01)
+        self.assertRaises(IOError, breaker.call, fail)
+        sleep(0.02)
+
+        self.assertEqual(breaker.call(lambda: 'ok'), 'ok')
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(self.signals, [CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN, CircuitBreaker.CLOSED])
+
+    def test_half_open_probe_failure(self):
+        breaker = CircuitBreaker(min_calls=1, reset_timeout=0.01)
+        self.assertRaises(IOError, breaker.call, fail)
+        sleep(0.02)
+
+        self.assertRaises(IOError, breaker.call, fail)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    def test_half_open_limits_probes(self):
+        breaker = CircuitBreaker(min_calls=1, reset_timeout=0.01, half_open_calls=1)
+        self.assertRaises(IOError, breaker.call, fail)
+        sleep(0.02)
+
+        # Only a single probe call may be in flight at once.
+        breaker.before_call()
+        self.assertRaises(CircuitOpenError, breaker.before_call)
+
+    def test_deadline_errors_are_failures(self):
+        breaker = CircuitBreaker(min_calls=1, reset_timeout=0.01)
+        self.assertRaises(IOError, breaker.call, fail)
+        sleep(0.02)
+
+        def exceed_deadline():
+            raise DeadlineExceededError('The request deadline was exceeded.')
+
+        # A probe which uses up its request's deadline failed.
+        self.assertRaises(DeadlineExceededError, breaker.call, exceed_deadline)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    def test_passed_deadlines_are_not_recorded(self):
+        breaker = CircuitBreaker(min_calls=1, reset_timeout=0.01)
+        self.assertRaises(IOError, breaker.call, fail)
+        sleep(0.02)
+
+        # A probe whose request's deadline had already passed is never made,
+        # so it neither closes the breaker, nor uses up the probe.
+        with Flask(__name__).app_context():
+            set_deadline(0)
+            self.assertRaises(DeadlineExceededError, breaker.call, lambda: 'ok')
+
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        breaker.before_call()
+
+
+class TestBulkhead(TestCase):
+    """Our Bulkhead test suite."""
+
+    def test_limits(self):
+        bulkhead = Bulkhead({'login': 1})
+
+        bulkhead.acquire('login')
+        self.assertRaises(BulkheadFullError, bulkhead.acquire, 'login')
+
+        # Other operations aren't affected.
+        bulkhead.acquire('load_user')
+
+        bulkhead.release('login')
+        bulkhead.acquire('login')
+
+        self.assertEqual(bulkhead.stats['active'], {'login': 1, 'load_user': 1})
+        self.assertEqual(bulkhead.stats['rejected'], {'login': 1})
+
+
+class TestLoadShedder(TestCase):
+    """Our LoadShedder test suite."""
+
+    def test_max_in_flight(self):
+        shedder = LoadShedder(max_in_flight=2, retry_after=5)
+
+        shedder.enter()
+        shedder.enter()
+
+        try:
+            shedder.enter()
+            self.fail('The request should have been shed.')
+        except OverloadedError as err:
+            self.assertEqual(err.retry_after, 5)
+
+        shedder.exit()
+        shedder.enter()
+
+        self.assertEqual(shedder.stats, {'in_flight': 2, 'accepted': 3, 'shed': 1})
+
+    def test_max_queued(self):
+        limiter = AdaptiveLimiter(initial_limit=1)
+        shedder = LoadShedder(max_in_flight=10, max_queued=1, limiter=limiter)
+
+        shedder.enter()
+
+        # Pretend a Stormpath call is waiting on the limiter.
+        limiter._queued = 1
+        self.assertRaises(OverloadedError, shedder.enter)
+
+        limiter._queued = 0
+        shedder.enter()
+
+
+class TestRetryPolicy(TestCase):
+    """Our RetryPolicy test suite."""
+
+    def test_retries_transient_failures(self):
+        policy = RetryPolicy(max_attempts=3, base_delay=0.001)
+        flaky = Flaky(2)
+
+        self.assertEqual(policy.call(flaky), 'ok')
+        self.assertEqual(flaky.calls, 3)
+        self.assertEqual(policy.stats['retries'], 2)
+
+    def test_max_attempts(self):
+        policy = RetryPolicy(max_attempts=2, base_delay=0.001)
+        flaky = Flaky(5)
+
+        self.assertRaises(IOError, policy.call, flaky)
+        self.assertEqual(flaky.calls, 2)
+
+    def test_other_errors_are_not_retried(self):
+        policy = RetryPolicy(base_delay=0.001)
+        flaky = Flaky(1, error=ValueError)
+
+        self.assertRaises(ValueError, policy.call, flaky)
+        self.assertEqual(flaky.calls, 1)
+
+    def test_budget(self):
+        policy = RetryPolicy(max_attempts=10, base_delay=1, max_delay=1, budget=0.001)
+        policy.backoff = lambda attempt: 1
+        flaky = Flaky(5)
+
+        # No retry fits in our budget.
+        self.assertRaises(IOError, policy.call, flaky)
+        self.assertEqual(flaky.calls, 1)
+
+    def test_backoff_is_bounded(self):
+        policy = RetryPolicy(base_delay=0.1, max_delay=0.5)
+
+        for attempt in range(1, 10):
+            self.assertTrue(0 <= policy.backoff(attempt) <= 0.5)
+
+
+class TestHedger(TestCase):
+    """Our Hedger test suite."""
+
+    def test_no_hedging_without_samples(self):
+        hedger = Hedger(min_samples=2)
+        self.assertEqual(hedger.delay('load_user'), None)
+
+        self.assertEqual(hedger.call('load_user', lambda: 'ok'), 'ok')
+        self.assertEqual(hedger.stats['hedged'], 0)
+
+    def test_delay_quantile(self):
+        hedger = Hedger(quantile=0.9, min_samples=10)
+        for i in range(10):
+            hedger.record('load_user', i / 100.0)
+
+        self.assertEqual(hedger.delay('load_user'), 0.09)
+        self.assertEqual(hedger.delay('login'), None)
+
+    def test_slow_calls_are_hedged(self):
+        hedger = Hedger(min_samples=1)
+        hedger.record('load_user', 0.01)
+
+        calls = []
+
+        def call():
+            calls.append(1)
+
+            # Only the first call is slow (and ends up failing).
+            if len(calls) == 1:
+                sleep(0.2)
+                fail()
+
+            return 'fast'
+
+        self.assertEqual(hedger.call('load_user', call), 'fast')
+        self.assertEqual(hedger.stats['hedged'], 1)
+
+    def test_slow_successes_are_hedged(self):
+        hedger = Hedger(min_samples=1)
+        hedger.record('load_user', 0.01)
+
+        calls = []
+
+        def call():
+            calls.append(1)
+
+            # The first call is slow (but ends up succeeding).
+            if len(calls) == 1:
+                sleep(0.5)
+                return 'slow'
+
+            return 'fast'
+
+        # The hedge succeeds first, so we don't wait for the slow call.
+        start = time()
+        self.assertEqual(hedger.call('load_user', call), 'fast')
+        self.assertTrue(time() - start < 0.3)
+
+    def test_fast_calls_are_not_hedged(self):
+        hedger = Hedger(min_samples=1)
+        hedger.record('load_user', 0.05)
+
+        self.assertEqual(hedger.call('load_user', lambda: 'ok'), 'ok')
+
+        sleep(0.1)
+        self.assertEqual(hedger.stats['hedged'], 0)
+
+    def test_worker_threads_are_reused(self):
+        hedger = Hedger(min_samples=1)
+        hedger.record('load_user', 0.05)
+
+        threads = []
+
+        def call():
+            threads.append(current_thread())
+            return 'ok'
+
+        self.assertEqual(hedger.call('load_user', call), 'ok')
+        sleep(0.01)
+        self.assertEqual(hedger.call('load_user', call), 'ok')
+
+        self.assertFalse(threads[0] is current_thread())
+        self.assertTrue(threads[0] is threads[1])
+
+    def test_hedged_failures(self):
+        hedger = Hedger(min_samples=1)
+        hedger.record('load_user', 0.001)
+
+        def call():
+            sleep(0.01)
+            fail()
+
+        self.assertRaises(IOError, hedger.call, 'load_user', call)
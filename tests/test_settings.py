@@ -123,6 +123,42 @@ class TestCheckSettings(StormpathTestCase):
         self.app.config['STORMPATH_COOKIE_DURATION'] = timedelta(minutes=1)
         check_settings(self.app.config)
 
+    def test_user_cache_settings(self):
+        # Ensure that if a user enables the user cache with a TTL which isn't a
+        # timedelta object, an error is raised.
+        self.app.config['STORMPATH_USER_CACHE_ENABLED'] = True
+        self.app.config['STORMPATH_USER_CACHE_TTL'] = 60
+        self.assertRaises(ConfigurationError, check_settings, self.app.config)
+
+        # Ensure that the cache size must be a positive integer.
+        self.app.config['STORMPATH_USER_CACHE_TTL'] = timedelta(minutes=1)
+        self.app.config['STORMPATH_USER_CACHE_MAX_SIZE'] = 0
+        self.assertRaises(ConfigurationError, check_settings, self.app.config)
+
+        # Now that we've configured things properly, it should work.
+        self.app.config['STORMPATH_USER_CACHE_MAX_SIZE'] = 100
+        check_settings(self.app.config)
+
+    def test_access_token_settings(self):
+        self.app.config['STORMPATH_ENABLE_ACCESS_TOKENS'] = True
+
+        # Ensure that secrets must be non-empty strings.
+        self.app.config['STORMPATH_ACCESS_TOKEN_SECRETS'] = []
+        self.assertRaises(ConfigurationError, check_settings, self.app.config)
+
+        self.app.config['STORMPATH_ACCESS_TOKEN_SECRETS'] = ['new', '']
+        self.assertRaises(ConfigurationError, check_settings, self.app.config)
+
+        self.app.config['STORMPATH_ACCESS_TOKEN_SECRETS'] = 42
+        self.assertRaises(ConfigurationError, check_settings, self.app.config)
+
+        # A single secret may be given as a plain string.
+        self.app.config['STORMPATH_ACCESS_TOKEN_SECRETS'] = 'mysecret'
+        check_settings(self.app.config)
+
+        self.app.config['STORMPATH_ACCESS_TOKEN_SECRETS'] = ['new', 'old']
+        check_settings(self.app.config)
+
     def tearDown(self):
         """Remove our apiKey.properties file."""
         super(TestCheckSettings, self).tearDown()
@@ -130,3 +166,4 @@ class TestCheckSettings(StormpathTestCase):
         # Remove our file.
         close(self.fd)
         remove(self.file)
+
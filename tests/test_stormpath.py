@@ -7,20 +7,30 @@ we'll just follow Flask conventions and have single file stuff going on.
 """
 
 
-from os import environ, remove
+from os import environ, path, remove
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Thread
+from time import sleep
 from unittest import TestCase
 from uuid import uuid4
 
-from flask import Flask, request
+from flask import Flask, request, session
 from flask.ext.stormpath import (
     StormpathManager,
     User,
     groups_required,
+    login_required,
     login_user,
     logout_user,
 )
+import flask_stormpath
+from flask.ext.stormpath.cache import MemoryStore, load_cached_href, store_cached_href
+from flask.ext.stormpath.snapshots import SNAPSHOT_SESSION_KEY
 from stormpath.client import Client
 
+from .helpers import StormpathTestCase
+
 
 #class TestStormpathManager(TestCase):
 #    """Our StormpathManager test suite."""
@@ -229,3 +239,397 @@ from stormpath.client import Client
 #    def tearDown(self):
 #        self.application.delete()
 #        self.client.directories.search(self.application_name)[0].delete()
+
+
+class TestLoadUser(StormpathTestCase):
+    """Our StormpathManager.load_user test suite."""
+
+    def setUp(self):
+        """Provision a single user account for testing."""
+        super(TestLoadUser, self).setUp()
+
+        with self.app.app_context():
+            self.user = User.create(
+                given_name = 'Randall',
+                surname = 'Degges',
+                email = 'r@rdegges.com',
+                password = 'woot1LoveCookies!',
+            )
+
+    def test_load_user(self):
+        with self.app.app_context():
+            user = StormpathManager.load_user(self.user.href)
+            self.assertIsInstance(user, User)
+            self.assertEqual(user.email, 'r@rdegges.com')
+
+    def test_load_invalid_user(self):
+        with self.app.app_context():
+            self.user.delete()
+            self.assertEqual(StormpathManager.load_user(self.user.href), None)
+
+    def test_user_cache(self):
+        self.app.config['STORMPATH_USER_CACHE_ENABLED'] = True
+        self.app.stormpath_manager.init_cache(self.app)
+
+        with self.app.app_context():
+
+            # Ensure the same object is served from the cache on the second
+            # load.
+            user = StormpathManager.load_user(self.user.href)
+            self.assertTrue(StormpathManager.load_user(self.user.href) is user)
+
+            # Ensure updating the user evicts it from the cache.
+            user.middle_name = 'Clark'
+            user.save()
+            self.assertFalse(StormpathManager.load_user(self.user.href) is user)
+
+    def test_shared_cache_users_are_writable(self):
+        self.app.config['STORMPATH_USER_CACHE_STORE'] = MemoryStore()
+        self.app.stormpath_manager.init_shared_cache(self.app)
+
+        with self.app.app_context():
+            StormpathManager.load_user(self.user.href)
+
+            # This load is served from the shared cache.
+            user = StormpathManager.load_user(self.user.href)
+            self.assertEqual(self.app.stormpath_shared_user_cache.hits, 1)
+
+            user.middle_name = 'Clark'
+            user.save()
+            self.assertEqual(StormpathManager.fetch_user(self.user.href).middle_name, 'Clark')
+
+    def test_shared_cache_users_never_save_stale_fields(self):
+        self.app.config['STORMPATH_USER_CACHE_STORE'] = MemoryStore()
+        self.app.stormpath_manager.init_shared_cache(self.app)
+
+        with self.app.app_context():
+            StormpathManager.load_user(self.user.href)
+            user = StormpathManager.load_user(self.user.href)
+            self.assertEqual(self.app.stormpath_shared_user_cache.hits, 1)
+
+            # The account changes after it was cached.
+            account = StormpathManager.fetch_user(self.user.href)
+            account.surname = 'Smith'
+            account.save()
+
+            user.middle_name = 'Clark'
+            user.save()
+
+            account = StormpathManager.fetch_user(self.user.href)
+            self.assertEqual(account.middle_name, 'Clark')
+            self.assertEqual(account.surname, 'Smith')
+
+    def test_lazy_user(self):
+        self.app.config['STORMPATH_LAZY_USER'] = True
+
+        with self.app.app_context():
+            user = StormpathManager.load_user(self.user.href)
+            self.assertIsInstance(user, User)
+            self.assertEqual(user.get_id(), self.user.href)
+            self.assertEqual(user.is_authenticated(), True)
+
+            # Reading a profile field fetches the account.
+            self.assertEqual(user.email, 'r@rdegges.com')
+            self.assertEqual(user.is_active(), True)
+
+    def test_lazy_users_are_not_snapshotted(self):
+        self.app.config['STORMPATH_LAZY_USER'] = True
+        self.app.config['STORMPATH_ENABLE_SESSION_SNAPSHOT'] = True
+
+        with self.app.test_request_context():
+            user = StormpathManager.load_user(self.user.href)
+
+            # Snapshotting the user would have fetched the account.
+            self.assertEqual(user.get_id(), self.user.href)
+            self.assertFalse(SNAPSHOT_SESSION_KEY in session)
+
+    def test_lazy_deleted_user_is_inactive(self):
+        self.app.config['STORMPATH_LAZY_USER'] = True
+
+        with self.app.app_context():
+            self.user.delete()
+
+            user = StormpathManager.load_user(self.user.href)
+            self.assertEqual(user.is_active(), False)
+
+    def test_lazy_deleted_user_is_logged_out(self):
+        self.app.config['STORMPATH_LAZY_USER'] = True
+        self.app.config['STORMPATH_USER_NEGATIVE_CACHE_ENABLED'] = True
+        self.app.stormpath_manager.init_negative_cache(self.app)
+
+        @self.app.route('/private')
+        @login_required
+        def private():
+            return 'secret'
+
+        with self.app.test_client() as c:
+            c.post('/login', data={
+                'login': self.user.email,
+                'password': 'woot1LoveCookies!',
+            })
+            self.assertEqual(c.get('/private').status_code, 200)
+
+            with self.app.app_context():
+                self.user.delete()
+
+            # The deleted account is logged out (instead of failing with a
+            # 500 on its first field read), and remembered.
+            self.assertEqual(c.get('/private').status_code, 302)
+            self.assertTrue(self.app.stormpath_negative_user_cache.get(self.user.href))
+
+            with c.session_transaction() as sess:
+                self.assertFalse('user_id' in sess)
+
+    def test_negative_cache(self):
+        self.app.config['STORMPATH_USER_NEGATIVE_CACHE_ENABLED'] = True
+        self.app.stormpath_manager.init_negative_cache(self.app)
+
+        with self.app.app_context():
+            self.user.delete()
+
+            # Ensure deleted accounts are remembered in the negative cache.
+            self.assertEqual(StormpathManager.load_user(self.user.href), None)
+            self.assertTrue(self.app.stormpath_negative_user_cache.get(self.user.href))
+            self.assertEqual(StormpathManager.load_user(self.user.href), None)
+
+    def test_disabled_accounts(self):
+        with self.app.app_context():
+            user = StormpathManager.load_user(self.user.href)
+            user.status = User.STATUS_DISABLED
+            user.save()
+
+            # Ensure disabled accounts are never loaded, even without the
+            # negative cache.
+            self.assertEqual(self.app.stormpath_negative_user_cache, None)
+            self.assertEqual(StormpathManager.load_user(self.user.href), None)
+
+    def test_negative_cache_disabled_accounts(self):
+        self.app.config['STORMPATH_USER_NEGATIVE_CACHE_ENABLED'] = True
+        self.app.stormpath_manager.init_negative_cache(self.app)
+
+        with self.app.app_context():
+            user = StormpathManager.load_user(self.user.href)
+            user.status = User.STATUS_DISABLED
+            user.save()
+
+            # Ensure disabled accounts are never loaded.
+            self.assertEqual(StormpathManager.load_user(self.user.href), None)
+            self.assertTrue(self.app.stormpath_negative_user_cache.get(self.user.href))
+
+            # Ensure re-enabling the account clears the negative cache.
+            user.status = User.STATUS_ENABLED
+            user.save()
+            self.assertFalse(self.app.stormpath_negative_user_cache.get(self.user.href))
+            self.assertIsInstance(StormpathManager.load_user(self.user.href), User)
+
+    def test_degraded_mode(self):
+        self.app.config['STORMPATH_DEGRADED_MODE_ENABLED'] = True
+        self.app.stormpath_manager.init_degraded_cache(self.app)
+
+        with self.app.app_context():
+            self.assertFalse(StormpathManager.load_user(self.user.href).is_degraded())
+
+            # Simulate a Stormpath outage.
+            original_fetch_user = StormpathManager.fetch_user
+
+            def fetch_user(account_href, lazy=False):
+                raise IOError('connection refused')
+
+            StormpathManager.fetch_user = staticmethod(fetch_user)
+            try:
+                user = StormpathManager.load_user(self.user.href)
+            finally:
+                StormpathManager.fetch_user = staticmethod(original_fetch_user)
+
+            # Ensure the last known good copy of the user is served.
+            self.assertTrue(user.is_degraded())
+            self.assertEqual(user.email, 'r@rdegges.com')
+
+    def test_group_failures_skip_snapshots(self):
+        self.app.config['STORMPATH_DEGRADED_MODE_ENABLED'] = True
+        self.app.stormpath_manager.init_degraded_cache(self.app)
+
+        with self.app.app_context():
+
+            # Simulate a failure listing the user's Groups (after the account
+            # itself was fetched).
+            original_get_group_hrefs = User.get_group_hrefs
+
+            def get_group_hrefs(user):
+                raise IOError('connection refused')
+
+            User.get_group_hrefs = get_group_hrefs
+            try:
+                user = StormpathManager.load_user(self.user.href)
+            finally:
+                User.get_group_hrefs = original_get_group_hrefs
+
+            # Ensure the user is still loaded, but not snapshotted.
+            self.assertEqual(user.email, 'r@rdegges.com')
+            self.assertEqual(self.app.stormpath_degraded_user_cache.get(self.user.href), None)
+
+    def test_outage_without_degraded_mode(self):
+        with self.app.app_context():
+            original_fetch_user = StormpathManager.fetch_user
+
+            def fetch_user(account_href, lazy=False):
+                raise IOError('connection refused')
+
+            StormpathManager.fetch_user = staticmethod(fetch_user)
+            try:
+                self.assertEqual(StormpathManager.load_user(self.user.href), None)
+            finally:
+                StormpathManager.fetch_user = staticmethod(original_fetch_user)
+
+
+class TestApplication(StormpathTestCase):
+    """Our StormpathManager.application test suite."""
+
+    def test_application_name(self):
+        with self.app.app_context():
+            self.assertEqual(self.app.stormpath_manager.application.href, self.application.href)
+
+    def test_application_href(self):
+        self.app.config['STORMPATH_APPLICATION'] = self.application.href
+
+        with self.app.app_context():
+            application = self.app.stormpath_manager.application
+            self.assertEqual(application.href, self.application.href)
+            self.assertEqual(application.name, self.application.name)
+
+    def test_application_href_file(self):
+        directory = mkdtemp()
+        self.app.config['STORMPATH_APPLICATION_HREF_FILE'] = path.join(directory, 'hrefs.json')
+
+        try:
+            with self.app.app_context():
+                self.app.stormpath_manager.application
+
+            # Ensure the resolved href was persisted for other processes.
+            key = '%s:%s' % (self.app.stormpath_manager.client.auth.id, self.application.name)
+            self.assertEqual(
+                load_cached_href(self.app.config['STORMPATH_APPLICATION_HREF_FILE'], key),
+                self.application.href,
+            )
+
+            # Ensure an href which no longer exists is dropped, and searched
+            # for again.
+            store_cached_href(self.app.config['STORMPATH_APPLICATION_HREF_FILE'], key, self.application.href + 'xxx')
+            with self.app.app_context():
+                self.assertEqual(self.app.stormpath_manager.load_application().href, self.application.href)
+        finally:
+            rmtree(directory)
+
+    def test_warm_up(self):
+        self.assertFalse(hasattr(self.app, 'stormpath_application'))
+
+        self.app.stormpath_manager.warm_up()
+        self.assertEqual(self.app.stormpath_application.href, self.application.href)
+
+
+class CountingClient(Client):
+    """A Stormpath Client which counts how many times it was constructed."""
+
+    constructions = 0
+
+    def __init__(self, *args, **kwargs):
+        CountingClient.constructions += 1
+
+        # Widen the window in which concurrent threads could race.
+        sleep(0.01)
+        super(CountingClient, self).__init__(*args, **kwargs)
+
+
+class TestLazyInitialization(TestCase):
+    """Our StormpathManager lazy initialization test suite."""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SECRET_KEY'] = uuid4().hex
+        self.app.config['STORMPATH_API_KEY_ID'] = 'id'
+        self.app.config['STORMPATH_API_KEY_SECRET'] = 'secret'
+        self.app.config['STORMPATH_APPLICATION'] = 'https://api.stormpath.com/v1/applications/xxx'
+        self.manager = StormpathManager(self.app)
+
+        CountingClient.constructions = 0
+        self.original_client = flask_stormpath.Client
+        flask_stormpath.Client = CountingClient
+
+    def tearDown(self):
+        flask_stormpath.Client = self.original_client
+
+    def hammer(self, func, threads=50):
+        """Call `func` from many threads at once, inside an app context."""
+        results = []
+
+        def target():
+            with self.app.app_context():
+                results.append(func())
+
+        workers = [Thread(target=target) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+
+        for worker in workers:
+            worker.join()
+
+        return results
+
+    def test_client_is_created_once(self):
+        clients = self.hammer(lambda: self.manager.client)
+
+        self.assertEqual(CountingClient.constructions, 1)
+        self.assertEqual(len(set(id(client) for client in clients)), 1)
+
+    def test_application_is_created_once(self):
+        loads = []
+
+        def load_application():
+            loads.append(1)
+            sleep(0.01)
+            return self.manager.client.applications.get(self.app.config['STORMPATH_APPLICATION'])
+
+        self.manager.load_application = load_application
+        applications = self.hammer(lambda: self.manager.application)
+
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(CountingClient.constructions, 1)
+        self.assertEqual(len(set(id(application) for application in applications)), 1)
+
+    def test_fork_recreates_client(self):
+        with self.app.app_context():
+            client = self.manager.client
+
+        # Pretend we're now running in a forked worker process.
+        original_getpid = flask_stormpath.getpid
+        flask_stormpath.getpid = lambda: original_getpid() + 1
+
+        try:
+            clients = self.hammer(lambda: self.manager.client)
+        finally:
+            flask_stormpath.getpid = original_getpid
+
+        self.assertEqual(CountingClient.constructions, 2)
+        self.assertEqual(len(set(id(c) for c in clients)), 1)
+        self.assertFalse(clients[0] is client)
+
+    def test_fork_rebuilds_state(self):
+        self.app.config['STORMPATH_USER_CACHE_ENABLED'] = True
+        self.app.config['STORMPATH_CIRCUIT_BREAKER_ENABLED'] = True
+        self.manager.init_state(self.app)
+
+        cache = self.app.stormpath_user_cache
+        breaker = self.app.stormpath_circuit_breaker
+
+        # Pretend we're now running in a forked worker process.
+        original_getpid = flask_stormpath.getpid
+        flask_stormpath.getpid = lambda: original_getpid() + 1
+
+        try:
+            with self.app.test_request_context('/'):
+                self.app.preprocess_request()
+        finally:
+            flask_stormpath.getpid = original_getpid
+
+        self.assertFalse(self.app.stormpath_user_cache is cache)
+        self.assertFalse(self.app.stormpath_circuit_breaker is breaker)
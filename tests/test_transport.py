@@ -0,0 +1,148 @@
+"""Tests for our HTTP transport helpers."""
+
+
+from datetime import timedelta
+from threading import Event, Thread
+from time import sleep
+from unittest import TestCase
+
+from flask import Flask
+from requests import Session
+from requests.adapters import HTTPAdapter
+
+from flask.ext.stormpath.deadlines import set_deadline
+from flask.ext.stormpath.errors import ConfigurationError, DeadlineExceededError
+from flask.ext.stormpath.transport import (
+    DEFAULT_SERVER_THREADS,
+    PooledHTTPAdapter,
+    configure_client,
+    get_pool_size,
+)
+
+
+class FakeClient(object):
+    """A minimal stand-in for a Stormpath Client, which has an HTTP session."""
+
+    def __init__(self):
+        self.data_store = type('DataStore', (), {})()
+        self.data_store.executor = type('Executor', (), {})()
+        self.data_store.executor.session = Session()
+
+
+CONFIG = {
+    'STORMPATH_SERVER_THREADS': None,
+    'STORMPATH_HTTP_POOL_SIZE': None,
+    'STORMPATH_HTTP_MAX_CONNECTIONS': None,
+    'STORMPATH_HTTP_KEEP_ALIVE': True,
+    'STORMPATH_HTTP_CONNECT_TIMEOUT': timedelta(seconds=5),
+    'STORMPATH_HTTP_READ_TIMEOUT': timedelta(seconds=30),
+    'STORMPATH_USER_CACHE_HARD_TTL': None,
+    'STORMPATH_USER_CACHE_REFRESH_THREADS': 2,
+}
+
+
+class TestPooledHTTPAdapter(TestCase):
+    """Our PooledHTTPAdapter test suite."""
+
+    def setUp(self):
+        self.sent = []
+        self.original_send = HTTPAdapter.send
+
+        def send(adapter, request, **kwargs):
+            self.sent.append(kwargs)
+            return getattr(self, 'block', lambda: None)()
+
+        HTTPAdapter.send = send
+
+    def tearDown(self):
+        HTTPAdapter.send = self.original_send
+
+    def test_default_timeouts(self):
+        adapter = PooledHTTPAdapter(connect_timeout=1, read_timeout=2)
+
+        adapter.send(None)
+        adapter.send(None, timeout=3)
+
+        self.assertEqual(self.sent[0]['timeout'], (1, 2))
+        self.assertEqual(self.sent[1]['timeout'], 3)
+        self.assertEqual(adapter.stats['requests'], 2)
+        self.assertEqual(adapter.stats['in_use'], 0)
+
+    def test_pool_never_blocks(self):
+        # Waiting for a pooled connection inside urllib3 would be unbounded
+        # (and unmeasured), so requests beyond the pool size must never block
+        # there.
+        adapter = PooledHTTPAdapter(pool_size=1)
+        self.assertEqual(adapter._pool_block, False)
+
+    def test_max_connections(self):
+        adapter = PooledHTTPAdapter(max_connections=1)
+        started = Event()
+        release = Event()
+
+        self.block = lambda: started.set() or release.wait()
+        first = Thread(target=adapter.send, args=(None,))
+        first.start()
+        started.wait(5)
+
+        self.assertEqual(adapter.stats['in_use'], 1)
+        self.assertEqual(adapter.stats['utilization'], 1.0)
+
+        # The second request has to wait for the first one's connection.
+        second = Thread(target=adapter.send, args=(None,))
+        second.start()
+        sleep(0.05)
+        release.set()
+        first.join()
+        second.join()
+
+        stats = adapter.stats
+        self.assertEqual(stats['requests'], 2)
+        self.assertEqual(stats['max_in_use'], 1)
+        self.assertEqual(stats['waits'], 1)
+        self.assertTrue(stats['max_wait'] > 0)
+
+    def test_max_connections_deadline(self):
+        adapter = PooledHTTPAdapter(max_connections=1)
+        started = Event()
+        release = Event()
+
+        self.block = lambda: started.set() or release.wait()
+        first = Thread(target=adapter.send, args=(None,))
+        first.start()
+        started.wait(5)
+
+        # Waiting for a connection must not outlast the request's deadline.
+        app = Flask(__name__)
+        with app.app_context():
+            set_deadline(0.05)
+            self.assertRaises(DeadlineExceededError, adapter.send, None)
+
+        release.set()
+        first.join()
+
+        self.assertEqual(adapter.stats['in_use'], 0)
+        self.assertEqual(adapter.stats['requests'], 1)
+
+
+class TestConfigureClient(TestCase):
+    """Our configure_client test suite."""
+
+    def test_pool_size(self):
+        self.assertEqual(get_pool_size(CONFIG), DEFAULT_SERVER_THREADS)
+        self.assertEqual(get_pool_size(dict(CONFIG, STORMPATH_SERVER_THREADS=4)), 4)
+        self.assertEqual(get_pool_size(dict(CONFIG, STORMPATH_SERVER_THREADS=4, STORMPATH_USER_CACHE_HARD_TTL=timedelta(hours=1))), 6)
+        self.assertEqual(get_pool_size(dict(CONFIG, STORMPATH_HTTP_POOL_SIZE=20)), 20)
+
+    def test_configure_client(self):
+        client = FakeClient()
+        adapter = configure_client(client, dict(CONFIG, STORMPATH_HTTP_KEEP_ALIVE=False))
+
+        session = client.data_store.executor.session
+        self.assertTrue(session.get_adapter('https://api.stormpath.com/v1') is adapter)
+        self.assertEqual(session.headers['Connection'], 'close')
+        self.assertEqual(adapter.timeout, (5, 30))
+        self.assertEqual(adapter.pool_size, DEFAULT_SERVER_THREADS)
+
+    def test_configure_unsupported_client(self):
+        self.assertRaises(ConfigurationError, configure_client, object(), CONFIG)
@@ -1,7 +1,13 @@
 """Run tests against our custom views."""
 
 
+from datetime import timedelta
+from json import dumps, loads
+
+from flask.ext.login import current_user
+from flask.ext.stormpath.errors import ReadOnlyUserError
 from flask.ext.stormpath.models import User
+from flask.ext.stormpath.snapshots import SNAPSHOT_SESSION_KEY
 
 from .helpers import StormpathTestCase
 
@@ -120,6 +126,33 @@ class TestRegister(StormpathTestCase):
                 resp.data.decode('utf-8'))
             self.assertFalse("developerMessage" in resp.data.decode('utf-8'))
 
+    def test_password_policy_is_checked_locally(self):
+        # Require a symbol, which Stormpath's default policy doesn't -- so if
+        # this password were sent to Stormpath, the account would be created.
+        self.app.config['STORMPATH_PASSWORD_POLICY_ENABLED'] = True
+        self.app.stormpath_manager.init_password_policy(self.app)
+
+        policy = self.app.stormpath_password_policy
+        with self.app.app_context():
+            policy.ensure_loaded()
+
+        policy.rules['min_symbol'] = 1
+
+        with self.app.test_client() as c:
+            resp = c.post('/register', data={
+                'given_name': 'Randall',
+                'surname': 'Degges',
+                'email': 'r@rdegges.com',
+                'password': 'woot1LoveCookies',
+            })
+            self.assertEqual(resp.status_code, 200)
+            self.assertTrue(
+                'Password requires at least 1 symbol.' in
+                resp.data.decode('utf-8'))
+
+        with self.app.app_context():
+            self.assertEqual(len(self.application.accounts.search({'email': 'r@rdegges.com'})), 0)
+
     def test_redirect_to_login_and_register_url(self):
         # Setting redirect URL to something that is easy to check
         stormpath_redirect_url = '/redirect_for_login_and_registration'
@@ -235,6 +268,54 @@ class TestLogin(StormpathTestCase):
                 'Invalid username or password.' in resp.data.decode('utf-8'))
             self.assertFalse("developerMessage" in resp.data.decode('utf-8'))
 
+    def test_rate_limits(self):
+        self.app.config['STORMPATH_RATE_LIMIT_BY_LOGIN'] = (2, timedelta(minutes=1))
+        self.app.stormpath_manager.init_rate_limits(self.app)
+
+        with self.app.test_client() as c:
+            for i in range(2):
+                resp = c.post('/login', data={
+                    'login': 'rdegges',
+                    'password': 'hilol',
+                })
+                self.assertEqual(resp.status_code, 200)
+
+            # Further attempts for the same login are rejected locally, no
+            # matter how the login is capitalized.
+            resp = c.post('/login', data={
+                'login': ' RDegges',
+                'password': 'hilol',
+            })
+            self.assertEqual(resp.status_code, 429)
+            self.assertTrue(int(resp.headers['Retry-After']) >= 1)
+
+            # Other logins aren't affected.
+            resp = c.post('/login', data={
+                'login': 'someone-else',
+                'password': 'hilol',
+            })
+            self.assertEqual(resp.status_code, 200)
+
+    def test_rate_limits_behind_proxies(self):
+        self.app.config['STORMPATH_RATE_LIMIT_BY_IP'] = (1, timedelta(minutes=1))
+        self.app.config['STORMPATH_RATE_LIMIT_TRUSTED_PROXIES'] = 1
+        self.app.stormpath_manager.init_rate_limits(self.app)
+
+        with self.app.test_client() as c:
+            def login(forwarded_for):
+                return c.post('/login', data={
+                    'login': 'rdegges',
+                    'password': 'hilol',
+                }, headers={'X-Forwarded-For': forwarded_for})
+
+            self.assertEqual(login('1.2.3.4').status_code, 200)
+
+            # Clients behind the same proxy have their own limits.
+            self.assertEqual(login('5.6.7.8').status_code, 200)
+
+            # Addresses a client adds itself are ignored.
+            self.assertEqual(login('9.9.9.9, 1.2.3.4').status_code, 429)
+
     def test_redirect_to_login_and_register_url(self):
         # Create a user.
         with self.app.app_context():
@@ -290,6 +371,129 @@ class TestLogin(StormpathTestCase):
             self.assertFalse('redirect_for_registration' in location)
 
 
+class TestToken(StormpathTestCase):
+    """Test our access token view."""
+
+    def setUp(self):
+        super(TestToken, self).setUp()
+        self.app.config['STORMPATH_ENABLE_ACCESS_TOKENS'] = True
+        self.app.stormpath_manager.init_routes(self.app)
+
+        # Create a user.
+        with self.app.app_context():
+            User.create(
+                given_name = 'Randall',
+                surname = 'Degges',
+                email = 'r@rdegges.com',
+                password = 'woot1LoveCookies!',
+            )
+
+    def test_issues_token(self):
+        with self.app.test_client() as c:
+            resp = c.post('/oauth/token', data={
+                'login': 'r@rdegges.com',
+                'password': 'woot1LoveCookies!',
+            })
+            self.assertEqual(resp.status_code, 200)
+
+            data = loads(resp.data.decode('utf-8'))
+            self.assertTrue(data['access_token'])
+            self.assertEqual(data['token_type'], 'Bearer')
+            self.assertEqual(data['expires_in'], 600)
+
+    def test_error_messages(self):
+        with self.app.test_client() as c:
+            resp = c.post('/oauth/token', data={'login': 'r@rdegges.com'})
+            self.assertEqual(resp.status_code, 400)
+
+            resp = c.post('/oauth/token', data={
+                'login': 'r@rdegges.com',
+                'password': 'xxx',
+            })
+            self.assertEqual(resp.status_code, 401)
+            self.assertEqual(loads(resp.data.decode('utf-8'))['error'], 'invalid_grant')
+
+    def test_json_bodies_must_be_objects(self):
+        with self.app.test_client() as c:
+            for body in (['r@rdegges.com', 'woot1LoveCookies!'], 'r@rdegges.com', 42):
+                resp = c.post(
+                    '/oauth/token',
+                    data = dumps(body),
+                    content_type = 'application/json',
+                )
+                self.assertEqual(resp.status_code, 400)
+                self.assertEqual(loads(resp.data.decode('utf-8'))['error'], 'invalid_request')
+
+
+class TestSessionSnapshot(StormpathTestCase):
+    """Test our signed session snapshots."""
+
+    def setUp(self):
+        super(TestSessionSnapshot, self).setUp()
+        self.app.config['STORMPATH_ENABLE_SESSION_SNAPSHOT'] = True
+
+        # Create a user.
+        with self.app.app_context():
+            User.create(
+                given_name = 'Randall',
+                surname = 'Degges',
+                email = 'r@rdegges.com',
+                password = 'woot1LoveCookies!',
+            )
+
+        @self.app.route('/me')
+        def me():
+            """Return the current user's email, and whether it's read-only."""
+            try:
+                current_user.save()
+                read_only = False
+            except ReadOnlyUserError:
+                read_only = True
+
+            return '%s %s' % (current_user.email, read_only)
+
+    def test_login_stores_snapshot(self):
+        with self.app.test_client() as c:
+            resp = c.post('/login', data={
+                'login': 'r@rdegges.com',
+                'password': 'woot1LoveCookies!',
+            })
+            self.assertEqual(resp.status_code, 302)
+
+            with c.session_transaction() as session:
+                self.assertTrue(session.get(SNAPSHOT_SESSION_KEY))
+
+            # Ensure the current user is rebuilt from the snapshot.
+            resp = c.get('/me')
+            self.assertEqual(resp.data.decode('utf-8'), 'r@rdegges.com True')
+
+    def test_invalid_snapshot_is_ignored(self):
+        with self.app.test_client() as c:
+            c.post('/login', data={
+                'login': 'r@rdegges.com',
+                'password': 'woot1LoveCookies!',
+            })
+
+            # Tamper with the snapshot, and ensure the user is loaded from
+            # Stormpath instead.
+            with c.session_transaction() as session:
+                session[SNAPSHOT_SESSION_KEY] = session[SNAPSHOT_SESSION_KEY] + 'x'
+
+            resp = c.get('/me')
+            self.assertEqual(resp.data.decode('utf-8'), 'r@rdegges.com False')
+
+    def test_logout_clears_snapshot(self):
+        with self.app.test_client() as c:
+            c.post('/login', data={
+                'login': 'r@rdegges.com',
+                'password': 'woot1LoveCookies!',
+            })
+            c.get('/logout')
+
+            with c.session_transaction() as session:
+                self.assertFalse(session.get(SNAPSHOT_SESSION_KEY))
+
+
 class TestLogout(StormpathTestCase):
     """Test our logout view."""
 